@@ -0,0 +1,100 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the startup time of one-shot bman commands that only read the
+config file, and list the heavy modules that each of them loads.
+
+Each command runs in a fresh interpreter against a small generated config
+file, with HOME pointed at a temporary directory.
+
+Usage: python benchmarks/startup.py [runs per command]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = ['namenodes', 'datanodes', 'config', 'help']
+
+# Modules that local-only commands should not need.
+HEAVY_MODULES = ['fabric', 'paramiko', 'prompt_toolkit', 'pygments', 'pkg_resources', 'daiquiri']
+MODULES_MARKER = 'heavy-modules:'
+
+CONFIG = """
+Cluster: startup
+HomeDir: /opt/hadoop
+HadoopTarball: /tmp/hadoop.tar.gz
+Workers: [worker1, worker2, worker3]
+CoreSiteSettings:
+  fs.defaultFS: 'hdfs://nn1:8020'
+HdfsSiteSettings:
+  dfs.namenode.name.dir: /data/name
+"""
+
+RUN_COMMAND = """
+import sys
+import bman.__main__
+sys.argv = ['bman'] + sys.argv[1:]
+try:
+    bman.__main__.main()
+finally:
+    sys.stderr.write('\\n{}' + ' '.join(m for m in {} if m in sys.modules))
+"""
+
+
+def run(command, home, root):
+    """ :return: the wall clock time of one run and the heavy modules it loaded. """
+    env = dict(os.environ, HOME=home, PYTHONPATH=root)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', RUN_COMMAND.format(MODULES_MARKER, HEAVY_MODULES), command],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    seconds = time.perf_counter() - start
+    modules = result.stderr[result.stderr.rindex(MODULES_MARKER) + len(MODULES_MARKER):].split()
+    return seconds, modules
+
+
+def run_python(home):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], env=dict(os.environ, HOME=home), check=True)
+    return time.perf_counter() - start
+
+
+def main(runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as home:
+        config_dir = os.path.join(home, '.config', 'bman')
+        os.makedirs(config_dir)
+        with open(os.path.join(config_dir, 'config.yaml'), 'w') as f:
+            f.write(CONFIG)
+
+        baseline = min(run_python(home) for _ in range(runs))
+        print("Python startup: {:.0f} ms".format(baseline * 1000))
+        # The first run parses the config file and logs while doing so,
+        # the timed runs read the config cache it writes.
+        seconds, modules = run(COMMANDS[0], home, root)
+        print("first run        {:4.0f} ms   heavy modules: {}".format(seconds * 1000, ' '.join(modules) or 'none'))
+        for command in COMMANDS:
+            results = [run(command, home, root) for _ in range(runs)]
+            median = statistics.median(seconds for seconds, _ in results)
+            print("bman {:<12} median {:4.0f} ms   heavy modules: {}".format(
+                command, median * 1000, ' '.join(sorted({m for _, ms in results for m in ms})) or 'none'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
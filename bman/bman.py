@@ -17,12 +17,6 @@ from __future__ import unicode_literals
 import os.path
 
 import sys
-from prompt_toolkit import prompt
-from prompt_toolkit.contrib.completers import WordCompleter
-from prompt_toolkit.history import FileHistory
-from pygments.style import Style
-from pygments.styles.default import DefaultStyle
-from pygments.token import Token
 
 import bman.bman_commands as bman_commands
 from bman import constants
@@ -33,18 +27,28 @@ commands_list = ['config', 'help', 'quit', 'namenodes', 'datanodes',
                  'journalnodes', 'cluster', 'tarball', 'prepare',
                  'deploy', 'hdfs', 'cblock', 'start', 'stop',
                  'mapred', 'yarn', 'nodemanager', 'resourcemanager',
-                 'useradd']
-command_completer = WordCompleter(commands_list, ignore_case=True)
+                 'useradd', 'status', 'restart', 'trash', 'converge',
+                 'preflight']
 
 
-class DocumentStyle(Style):
-    styles = {
-        Token.Menu.Completions.Completion.Current: 'bg:#00aaaa #000000',
-        Token.Menu.Completions.Completion: 'bg:#008888 #ffffff',
-        Token.Menu.Completions.ProgressButton: 'bg:#003333',
-        Token.Menu.Completions.ProgressBar: 'bg:#00aaaa',
-    }
-    styles.update(DefaultStyle.styles)
+def get_document_style():
+    """
+    The completion menu style. prompt_toolkit and pygments are only
+    needed by the interactive shell, so they are imported here.
+    """
+    from pygments.style import Style
+    from pygments.styles.default import DefaultStyle
+    from pygments.token import Token
+
+    class DocumentStyle(Style):
+        styles = {
+            Token.Menu.Completions.Completion.Current: 'bg:#00aaaa #000000',
+            Token.Menu.Completions.Completion: 'bg:#008888 #ffffff',
+            Token.Menu.Completions.ProgressButton: 'bg:#003333',
+            Token.Menu.Completions.ProgressBar: 'bg:#00aaaa',
+        }
+        styles.update(DefaultStyle.styles)
+    return DocumentStyle
 
 
 def welcome():
@@ -72,6 +76,7 @@ def get_shell_history():
     history_dir = os.path.join(os.path.expanduser("~"), ".config", "bman")
     os.makedirs(history_dir, exist_ok=True)
     history_file = os.path.join(history_dir, "history.bman")
+    from prompt_toolkit.history import FileHistory
     return FileHistory(history_file)
 
 
@@ -89,6 +94,10 @@ def run_bman(argv):
 
 
 def launch_interactive_shell(cluster):
+    from prompt_toolkit import prompt
+    from prompt_toolkit.contrib.completers import WordCompleter
+    command_completer = WordCompleter(commands_list, ignore_case=True)
+    style = get_document_style()
     history = get_shell_history()
     welcome()
     bman_command_handler = bman_commands.BmanCommandHandler(cluster)
@@ -96,7 +105,7 @@ def launch_interactive_shell(cluster):
         try:
             text = prompt(message='{}> '.format(cluster.get_config(constants.KEY_NAME)),
                           completer=command_completer,
-                          style=DocumentStyle,
+                          style=style,
                           history=history)
             bman_command_handler.handle_command(text, cluster)
         except EOFError:
@@ -15,18 +15,14 @@
 from __future__ import print_function
 from __future__ import print_function
 
-import fabric
-from colorama import Fore
-from fabric.api import env, local, hide
-from prompt_toolkit import prompt
-
 import bman.bman_config as config
 import bman.constants as constants
-from bman.deployment_manager import install_cluster
 from bman.logger import get_logger
-from bman.remote_tasks import prepare_cluster, run_hdfs, run_yarn, run_ozone, start_stop_datanodes, \
-    start_stop_namenodes, start_stop_journalnodes, shutdown, add_user
-from bman.utils import is_true, do_sleep
+
+# Commands that only read the config file. They run without loading
+# Fabric and the remote task modules, which take most of bman's startup
+# time. Other commands import what they need on first use.
+LOCAL_COMMANDS = {'config', 'help', 'quit', 'namenodes', 'datanodes', 'journalnodes'}
 
 
 class BmanCommandHandler:
@@ -42,28 +38,42 @@ class BmanCommandHandler:
             'prepare': self.handle_prepare_cluster,
             'install': self.handle_install,
             'deploy': self.handle_deploy,
+            'converge': self.handle_converge,
             'run': self.handle_start,
             'start': self.handle_start,
             'stop': self.handle_stop,
             'shutdown': self.handle_shutdown,
-            'useradd': self.handle_useradd
+            'restart': self.handle_restart,
+            'trash': self.handle_trash,
+            'useradd': self.handle_useradd,
+            'status': self.handle_status,
+            'preflight': self.handle_preflight
         }
-        self.init_fabric_env_auth_settings(cluster)
+        self.status_cache = None
+        self.remote_initialized = False
 
     @staticmethod
     def handle_help(command, cluster):
+        from colorama import Fore
         print("\nCommands supported are:")
         print(Fore.CYAN + "\thelp" + Fore.RESET + "\t\t - print this help message.")
         print(Fore.CYAN + "\tquit" + Fore.RESET + "\t\t - quit this shell.")
         print(Fore.CYAN + "\tconfig" + Fore.RESET + "\t\t - print the current cluster configration.")
         print(Fore.CYAN + "\tnamenodes" + Fore.RESET + "\t - print the list of namenodes.")
         print(Fore.CYAN + "\tdatanodes" + Fore.RESET + "\t - print the list of datanodes.")
+        print(Fore.CYAN + "\tpreflight [refresh]" + Fore.RESET + "\t - check that every host is ready for an install")
         print(Fore.CYAN + "\tprepare" + Fore.RESET + "\t\t - prepare the cluster for a new installation")
         print(Fore.CYAN + "\tinstall" + Fore.RESET + "\t\t - install the cluster and start all services")
+        print(Fore.CYAN + "\tconverge [--dry-run]" + Fore.RESET + "\t - update an installed cluster to match the configuration")
         print(Fore.CYAN + "\tstart [dfs|yarn|ozone|namenodes|datanodes]" + Fore.RESET + "\t\t - start all or some services")
         print(Fore.CYAN + "\tstop [dfs|yarn|ozone|namenodes|datanodes]" + Fore.RESET + "\t\t - stop all or some services")
         print(Fore.CYAN + "\tshutdown" + Fore.RESET + "\t - stop all running services\n")
-        print(Fore.CYAN + "\tuseradd <user> <password>" + Fore.RESET + "\t - create a new user on all nodes\n")
+        print(Fore.CYAN + "\trestart --rolling [namenodes|datanodes|journalnodes|nodemanagers] [N]" +
+              Fore.RESET + "\t - restart N hosts at a time without downtime\n")
+        print(Fore.CYAN + "\ttrash status" + Fore.RESET + "\t - show storage directories still being deleted after a fast wipe\n")
+        print(Fore.CYAN + "\tstatus [refresh] [verbose]" + Fore.RESET + "\t - show the daemons running on each host\n")
+        print(Fore.CYAN + "\tuseradd <user> <password> <group>" + Fore.RESET + "\t - create a new user on all nodes\n")
+        print(Fore.CYAN + "\tuseradd --csv <file>" + Fore.RESET + "\t - create the users listed in a CSV file on all nodes\n")
         print(Fore.CYAN + "\tuserdel <user>" + Fore.RESET + "\t - Delete the user on all nodes\n")
         print("To install the cluster, please edit the file " + Fore.CYAN +
               cluster.get_config_file() + Fore.RESET + " and set appropriate values.")
@@ -84,7 +94,7 @@ class BmanCommandHandler:
 
     @staticmethod
     def handle_datanode(command, cluster):
-        print("DataNodes : {}".format(cluster.get_worker_nodes()))
+        print("DataNodes : {}".format(list(cluster.get_worker_nodes())))
 
     @staticmethod
     def handle_journalnode(command, cluster):
@@ -92,6 +102,9 @@ class BmanCommandHandler:
 
     @staticmethod
     def handle_prepare_cluster(command, cluster):
+        from fabric.api import env
+        from bman.remote_tasks import prepare_cluster
+        from bman.utils import is_true
         env.output_prefix = False
         # Convert from string to binary
         prepare_cluster(cluster=cluster, force=is_true(cluster.config[constants.KEY_FORCE_WIPE]))
@@ -99,6 +112,7 @@ class BmanCommandHandler:
 
     @staticmethod
     def handle_install(command, cluster, stop_services=True):
+        from bman.deployment_manager import install_cluster
         install_cluster(cluster=cluster, stop_services=stop_services)
         get_logger().debug("Finished installing.")
 
@@ -106,14 +120,30 @@ class BmanCommandHandler:
     def handle_deploy(command, cluster):
         BmanCommandHandler.handle_install(command, cluster, stop_services=False)
 
+    @staticmethod
+    def handle_converge(command, cluster):
+        from bman.converge import converge_cluster
+        args = command.split()[1:]
+        if args not in ([], ['--dry-run']):
+            print("Usage: converge [--dry-run]")
+            return
+        if converge_cluster(cluster, dry_run=bool(args)):
+            get_logger().info("Done converging the cluster.")
+
     @staticmethod
     def handle_start(command, cluster):
+        from fabric.api import local, hide
+        from bman.readiness import wait_for_namenodes
+        from bman.remote_tasks import run_hdfs, run_yarn, run_ozone, start_stop_datanodes, \
+            start_stop_namenodes, start_stop_journalnodes
         service = command.split()[1:2]
         nodes = command.split()[2:]
         cmds = []
         if not service or service[0].lower() == "all":
             run_hdfs(cluster)
-            do_sleep(20)
+            if not wait_for_namenodes(cluster):
+                get_logger().error("HDFS did not come up, not starting YARN.")
+                return
             if cluster.is_yarn_enabled():
                 run_yarn(cluster)
         elif service[0].lower() in {'dfs', 'hdfs'}:
@@ -137,6 +167,9 @@ class BmanCommandHandler:
 
     @staticmethod
     def handle_stop(command, cluster):
+        from fabric.api import local, hide
+        from bman.remote_tasks import shutdown, start_stop_datanodes, start_stop_namenodes, \
+            start_stop_journalnodes
         service = command.split()[1:2]
         nodes = command.split()[2:]
         cmds = []
@@ -159,19 +192,63 @@ class BmanCommandHandler:
 
     @staticmethod
     def handle_shutdown(command, cluster):
+        from bman.remote_tasks import shutdown
         try:
             shutdown(cluster)
         except Exception as e:
             get_logger().error(e)
             raise
 
+    @staticmethod
+    def handle_restart(command, cluster):
+        from bman.rolling_restart import rolling_restart
+        args = command.split()[1:]
+        if len(args) not in {2, 3} or args[0] != '--rolling' or \
+                (len(args) == 3 and (not args[2].isdigit() or int(args[2]) < 1)):
+            print("Usage: restart --rolling <namenodes|datanodes|journalnodes|nodemanagers> [N]")
+            print("    N hosts are restarted at a time (default: RollingRestartWindow).")
+            return
+        window = args[2] if len(args) == 3 else None
+        if rolling_restart(cluster, args[1].lower(), window=window):
+            get_logger().info("Done restarting {}.".format(args[1]))
+
+    @staticmethod
+    def handle_trash(command, cluster):
+        from bman.storage_tasks import print_trash_status
+        if command.split()[1:] != ['status']:
+            print("Usage: trash status")
+            return
+        print_trash_status(cluster)
+
     @staticmethod
     def handle_useradd(command, cluster):
-        if len(command.split()) != 4:
+        from bman.remote_tasks import add_user, add_users
+        args = command.split()[1:]
+        if len(args) == 2 and args[0] == '--csv':
+            add_users(cluster, config.load_users_csv(args[1]))
+            return
+        if len(args) != 3:
             print("Usage: useradd <username> <password> <groupname>")
-            print("    The group will be created if it doesn't exist.")
+            print("       useradd --csv <file>")
+            print("    The group will be created if it doesn't exist. The CSV file has one")
+            print("    name,password,group line per user.")
             return
-        add_user(cluster, config.UserConfig(*command.split()[1:]))
+        add_user(cluster, config.UserConfig(*args))
+
+    def handle_status(self, command, cluster):
+        from bman.cluster_status import ClusterStatusCache, print_cluster_status
+        if self.status_cache is None:
+            self.status_cache = ClusterStatusCache()
+        options = {o.lower() for o in command.split()[1:]}
+        all_status = self.status_cache.get(cluster, refresh='refresh' in options)
+        print_cluster_status(cluster, all_status, verbose='verbose' in options)
+
+    @staticmethod
+    def handle_preflight(command, cluster):
+        from bman.preflight import run_preflight
+        options = {o.lower() for o in command.split()[1:]}
+        if run_preflight(cluster, refresh='refresh' in options):
+            get_logger().info("All hosts passed the preflight checks.")
 
     def handle_command(self, command, cluster):
         if not command:
@@ -182,8 +259,23 @@ class BmanCommandHandler:
             get_logger().error("Unknown command: {}\n".format(command))
             return False
 
-        try:
+        if commands[0] in LOCAL_COMMANDS:
             self.handlers[commands[0]](command, cluster)
+            return
+
+        if commands[0] not in {'status', 'preflight'} and self.status_cache:
+            # Any other command may start or stop services.
+            self.status_cache.invalidate()
+
+        import fabric.network
+        from bman.utils import hdfs_ticket_session
+        if not self.remote_initialized:
+            self.init_fabric_env_auth_settings(cluster)
+            self.remote_initialized = True
+        try:
+            # Commands that run HDFS commands share one Kerberos login.
+            with hdfs_ticket_session(cluster):
+                self.handlers[commands[0]](command, cluster)
         except Exception as e:
             get_logger().error(e)
             raise
@@ -194,6 +286,8 @@ class BmanCommandHandler:
 
     @staticmethod
     def init_fabric_env_auth_settings(cluster):
+        from fabric.api import env
+        from prompt_toolkit import prompt
         # Make sure we have no implicit dependency on keys in the user's
         # .ssh/ directory. Credentials must be specified explicitly in the
         # YAML file.
@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import csv
 import getpass
+import hashlib
+import json
 import os
-import pprint
+import pickle
 import re
 import sys
 
@@ -29,10 +32,24 @@ from bman.constants import *
 # hdfs_site.xml.template and then pass the value to template processing in
 # local_tasks.py#generate_hdfs_site
 from bman.hdfs_master_configs import HdfsMasterConfigs, ConfigurationError
+from bman.host_ranges import iter_hosts, get_include_files
+from bman.host_roles import HostRoleIndex, ROLE_NAMENODE, ROLE_SECONDARY_NAMENODE, ROLE_JOURNALNODE, \
+    ROLE_DATANODE, ROLE_RESOURCEMANAGER, ROLE_NODEMANAGER
 from bman.kerberos_config_manager import KerberosConfigGenerator
-from bman.kerberos_setup import KEY_KADMIN_SERVER, KEY_KADMIN_PRINCIPAL, KEY_KADMIN_PASSWORD
 from bman.logger import get_logger
 
+# The libyaml based loader is much faster, fall back to the pure Python one
+# if PyYAML was built without it.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# Modules that define the cached Cluster model. Changing any of them, e.g.
+# by installing another bman version, invalidates the config cache.
+CLUSTER_MODEL_MODULES = ['bman.bman_config', 'bman.constants', 'bman.hdfs_master_configs',
+                         'bman.host_ranges', 'bman.host_roles', 'bman.kerberos_config_manager']
+
 
 class Cluster(object):
     """
@@ -47,7 +64,10 @@ class Cluster(object):
         self.config = {}
         self.all_site_settings = {}
         self.hdfs_master_configs = None
-        self.worker_nodes, self.rm_hosts, = [], []
+        self.rm_hosts = []
+        self.role_index = None
+        self.host_override_layers = {}
+        self.host_config_sets = None
         self.config_file = config_file
         self.cluster_constructor(values)
         # TODO: Use randomly generated passwords instead. Currently the password
@@ -72,6 +92,7 @@ class Cluster(object):
         self.dump_node_configuration()
 
     def __repr__(self):
+        import pprint
         return pprint.pformat(self.config, indent=4)
 
     def get_config(self, key):
@@ -146,6 +167,7 @@ class Cluster(object):
         self.read_config_value_with_default(values, KEY_JAVA_HOME, DEFAULT_JAVA_HOME)
         self.hdfs_master_configs = HdfsMasterConfigs(self.all_site_settings)
         self.init_host_lists()
+        self.init_role_index()
 
         self.read_config_value_with_default(values, KEY_OZONE_ENABLED, False)
         # If ozone is enabled then we must know where to place ozone metadata.
@@ -161,6 +183,7 @@ class Cluster(object):
         # Key values with defaults. If user does not specify a value,
         # we will use the defaults.
         self.read_config_value_with_default(values, KEY_FORCE_WIPE, 'False')
+        self.read_config_value_with_default(values, KEY_FAST_WIPE, 'False')
         self.read_config_value_with_default(values, KEY_SCM_DATANODE_ID, "/data/disk1/scm/meta/node/datanode.id")
         self.read_config_value_with_default(values, KEY_CBLOCK_CACHE, 'True')
         self.read_config_value_with_default(values, KEY_CBLOCK_TRACE, 'False')
@@ -168,11 +191,26 @@ class Cluster(object):
         self.read_config_value_with_default(values, KEY_USER, getpass.getuser())
         self.read_config_value_with_default(values, KEY_PASSWORD)
         self.read_config_value_with_default(values, KEY_SSH_KEYFILE)
+        self.read_config_value_with_default(values, KEY_READINESS_TIMEOUT, DEFAULT_READINESS_TIMEOUT)
+        self.read_config_value_with_default(values, KEY_DATANODE_START_WAVE_SIZE, 0)
+        self.read_config_value_with_default(values, KEY_DATANODE_START_MAX_RPC_QUEUE_TIME,
+                                            DEFAULT_DATANODE_START_MAX_RPC_QUEUE_TIME)
+        self.read_config_value_with_default(values, KEY_DAEMON_STOP_TIMEOUT, DEFAULT_DAEMON_STOP_TIMEOUT)
+        self.read_config_value_with_default(values, KEY_ROLLING_RESTART_WINDOW, 1)
+        self.read_config_value_with_default(values, KEY_HDFS_PATHS, [])
+        self.read_config_value_with_default(values, KEY_USE_WEBHDFS, 'False')
+        self.read_config_value_with_default(values, KEY_TEZ_LIB_REPLICATION, None)
+        self.read_config_value_with_default(values, KEY_SORT_SITE_SETTINGS, 'False')
+        self.read_config_value_with_default(values, KEY_HOST_GROUPS, {})
+        self.read_config_value_with_default(values, KEY_HOST_OVERRIDES, {})
+        self.init_host_overrides()
 
         # Read kadmin server settings.
         self.read_config_value_with_default(values, KEY_KADMIN_SERVER)
         self.read_config_value_with_default(values, KEY_KADMIN_PRINCIPAL)
         self.read_config_value_with_default(values, KEY_KADMIN_PASSWORD)
+        self.read_config_value_with_default(values, KEY_KADMIN_BATCH_SIZE, DEFAULT_KADMIN_BATCH_SIZE)
+        self.read_config_value_with_default(values, KEY_KEYTAB_FACTORY_HOST, one_nn)
         self.read_config_value_with_default(values, KEY_JCE_POLICY_FILES_LOCATION)
         self.read_config_value_with_default(values, KEY_REALM)
 
@@ -181,24 +219,96 @@ class Cluster(object):
         Initialize list of NN, DN, JN, RM hostnames for quick access.
         :return:
         """
-        self.worker_nodes = self.get_config(KEY_WORKERS)
         if self.is_yarn_enabled():
             self.rm_hosts.append(
                 self.get_site_setting('yarn.resourcemanager.address').split(':')[0])
 
+    def init_role_index(self):
+        """
+        Build the index of the roles of every host. The index is not updated
+        afterwards.
+        """
+        master_config = self.get_hdfs_master_config()
+        # Workers may be given as range expressions and include files. They
+        # are expanded straight into the index.
+        workers = iter_hosts(self.get_config(KEY_WORKERS), self.get_config_dir())
+        worker_roles = (ROLE_DATANODE, ROLE_NODEMANAGER) if self.is_yarn_enabled() else ROLE_DATANODE
+        role_hosts = [(ROLE_NAMENODE, master_config.get_nn_hosts()),
+                      (worker_roles, workers),
+                      (ROLE_JOURNALNODE, master_config.get_jn_hosts())]
+        if self.is_yarn_enabled():
+            role_hosts.append((ROLE_RESOURCEMANAGER, self.rm_hosts))
+        if any(not ns.is_ha() for ns in master_config.get_nameservices()):
+            role_hosts.append((ROLE_SECONDARY_NAMENODE, master_config.get_snn_hosts()))
+        self.role_index = HostRoleIndex(role_hosts)
+
+    def get_role_index(self):
+        return self.role_index
+
+    def init_host_overrides(self):
+        """
+        Index the HostGroups and HostOverrides layers by host, in the order
+        they are applied.
+        """
+        def check_layer(name, layer):
+            unknown = set(layer) - set(HOST_OVERRIDE_SITE_FILES) - {KEY_HOSTS}
+            if unknown:
+                raise ConfigurationError("{} can only override {} but has {}".format(
+                    name, ', '.join(sorted(HOST_OVERRIDE_SITE_FILES)), ', '.join(sorted(unknown))))
+
+        all_hosts = set(self.get_all_hosts())
+        for name, group in (self.get_config(KEY_HOST_GROUPS) or {}).items():
+            check_layer('HostGroup {}'.format(name), group)
+            if not isinstance(group.get(KEY_HOSTS), list):
+                raise ConfigurationError("HostGroup {} must have a list of {}".format(name, KEY_HOSTS))
+            for host in group[KEY_HOSTS]:
+                self.host_override_layers.setdefault(host, []).append(group)
+        for host, overrides in (self.get_config(KEY_HOST_OVERRIDES) or {}).items():
+            check_layer('HostOverrides for {}'.format(host), overrides)
+            self.host_override_layers.setdefault(host, []).append(overrides)
+
+        for host in sorted(set(self.host_override_layers) - all_hosts):
+            get_logger().warn("Ignoring config overrides for {}, which is not in the cluster".format(host))
+
+    def get_host_overrides(self, host):
+        """
+        Return the site settings that replace the cluster-wide ones on host.
+
+        :return: dict mapping settings key, e.g. HdfsSiteSettings -> dict of
+                 overridden settings. Empty if the host has no overrides.
+        """
+        overrides = {}
+        for layer in self.host_override_layers.get(host, []):
+            for key in HOST_OVERRIDE_SITE_FILES:
+                if layer.get(key):
+                    overrides.setdefault(key, {}).update(layer[key])
+        return overrides
+
     def get_worker_nodes(self):
-        return self.worker_nodes
+        return self.role_index.get_hosts(ROLE_DATANODE)
+
+    def get_include_files(self):
+        """ :return: the include files of the Workers list. """
+        return get_include_files(self.get_config(KEY_WORKERS), self.get_config_dir())
+
+    def get_config_dir(self):
+        return os.path.dirname(os.path.abspath(self.config_file)) if self.config_file else ''
 
     def get_rm_hosts(self):
         return self.rm_hosts
 
+    def get_rm_http_address(self):
+        if self.has_site_setting('yarn.resourcemanager.webapp.address'):
+            return self.get_site_setting('yarn.resourcemanager.webapp.address')
+        return '{}:{}'.format(self.rm_hosts[0], DEFAULT_RESOURCEMANAGER_HTTP_PORT)
+
+    def get_datanode_http_port(self):
+        if self.has_site_setting('dfs.datanode.http.address'):
+            return int(self.get_site_setting('dfs.datanode.http.address').split(':')[1])
+        return DEFAULT_DATANODE_HTTP_PORT
+
     def get_all_hosts(self):
-        # Make sure we dedup the final list as there will be multiple
-        # components on each host!
-        return list(set(self.get_hdfs_master_config().get_nn_hosts() +
-                        self.worker_nodes +
-                        self.get_hdfs_master_config().get_jn_hosts() +
-                        self.rm_hosts))
+        return list(self.role_index.get_all_hosts())
 
     def is_kerberized(self):
         return self.has_site_setting('hadoop.security.authentication') and \
@@ -218,8 +328,23 @@ class Cluster(object):
         tarball_name = os.path.basename(self.get_config(KEY_TEZ_TARBALL))
         return re.sub(r"(.tgz|.tar.gz|.tar.bz2|.tar.bzip2|tar.Z|.tar.xz)$", "", tarball_name)
 
-    def get_datanode_dirs(self):
-        return self.get_site_setting('dfs.datanode.data.dir').split(',')
+    def get_datanode_dirs(self, host=None):
+        """
+        Return the DataNode directories. If host is given, HostGroups and
+        HostOverrides of dfs.datanode.data.dir for that host are applied.
+        """
+        hdfs_overrides = self.get_host_overrides(host).get(KEY_HDFS_SITE_SETTINGS, {}) if host else {}
+        return hdfs_overrides.get('dfs.datanode.data.dir',
+                                  self.get_site_setting('dfs.datanode.data.dir')).split(',')
+
+    def get_storage_dirs(self, host=None):
+        """
+        Return the NameNode, DataNode, JournalNode and Secondary NameNode
+        storage directories, with the DataNode directories of host if given.
+        """
+        master_config = self.get_hdfs_master_config()
+        return master_config.get_nn_dirs() + self.get_datanode_dirs(host) + \
+            master_config.get_jn_dirs() + master_config.get_snn_dirs()
 
     def is_yarn_enabled(self):
         return self.get_config(KEY_YARN_SITE_SETTINGS)
@@ -274,6 +399,36 @@ class Cluster(object):
             os.path.expanduser('~'), '.config', 'bman',
             '.conf-generated-{}-tez'.format(self.get_config(KEY_NAME)))
 
+    def get_generated_config_sets_dir(self):
+        """
+        Get the directory that holds the generated config sets of hosts
+        with HostGroups or HostOverrides.
+        :return:
+        """
+        return os.path.join(
+            os.path.expanduser('~'), '.config', 'bman',
+            '.conf-generated-{}-hadoop-sets'.format(self.get_config(KEY_NAME)))
+
+    def get_host_hadoop_conf_tmp_dir(self, host):
+        """
+        Get the generated Hadoop config directory for host: its config set
+        if it has overrides, otherwise the cluster-wide directory.
+        :return:
+        """
+        if self.host_config_sets is None:
+            try:
+                with open(os.path.join(self.get_generated_config_sets_dir(),
+                                       HOST_CONFIG_SETS_FILE_NAME)) as f:
+                    self.host_config_sets = json.load(f)
+            except IOError:
+                self.host_config_sets = {}
+        if host in self.host_config_sets:
+            return os.path.join(self.get_generated_config_sets_dir(), self.host_config_sets[host])
+        return self.get_generated_hadoop_conf_tmp_dir()
+
+    def get_hadoop_pid_dir(self):
+        return os.path.join(self.get_hadoop_install_dir(), HADOOP_PID_DIR_NAME)
+
     def get_hadoop_conf_dir(self):
         return os.path.join(self.get_hadoop_install_dir(), 'etc', 'hadoop')
 
@@ -285,17 +440,29 @@ class Cluster(object):
         Write node configuration to debug logs.
         """
         get_logger().debug("NN hosts are {}".format(self.get_hdfs_master_config().get_nn_hosts()))
-        get_logger().debug("Worker hosts are {}".format(self.worker_nodes))
+        get_logger().debug("{} worker hosts".format(len(self.get_worker_nodes())))
         get_logger().debug("JN hosts are {}".format(self.get_hdfs_master_config().get_jn_hosts()))
         get_logger().debug("RM hosts are {}".format(self.rm_hosts))
 
     def is_tez_enabled(self):
         return self.get_config(KEY_TEZ_TARBALL)
 
+    def get_tez_lib_path(self):
+        return '/apps/{}/{}'.format(self.get_tez_distro_name(), os.path.basename(self.get_config(KEY_TEZ_TARBALL)))
+
     def get_tez_lib_uris_paths(self):
+        if len(self.get_hdfs_master_config().get_nameservices()) > 1:
+            # The tarball is published to every nameservice. A path without
+            # a scheme lets each job read the copy in its default filesystem.
+            return self.get_tez_lib_path()
         default_fs = re.sub('/$', '', self.get_site_setting('fs.defaultFS'))  # Remove trailing '/', if any.
-        return '{}/apps/{}/{}'.format(
-            default_fs, self.get_tez_distro_name(), os.path.basename(self.get_config(KEY_TEZ_TARBALL)))
+        return default_fs + self.get_tez_lib_path()
+
+    def get_tez_lib_replication(self):
+        """ Replication for the Tez tarball in HDFS, so many NodeManagers can localize it at once. """
+        if self.get_config(KEY_TEZ_LIB_REPLICATION):
+            return int(self.get_config(KEY_TEZ_LIB_REPLICATION))
+        return max(1, min(10, len(self.get_worker_nodes())))
 
 
 def get_default_config_file():
@@ -305,6 +472,9 @@ def get_default_config_file():
 def load_config(config_file=None):
     """
     Reads the default YAML Config.
+
+    The validated Cluster is cached, so later invocations with an unchanged
+    config file skip parsing and validation.
     :param config_file: YAML File to read.
     :return: Cluster class
     """
@@ -313,11 +483,85 @@ def load_config(config_file=None):
     if not os.path.exists(config_file):
         get_logger().error("Error: config file {} does not exist\n".format(config_file))
         sys.exit(1)
-    with open(config_file, 'r') as stream:
-        cluster = Cluster(yaml.safe_load(stream), config_file)
+    with open(config_file, 'rb') as stream:
+        data = stream.read()
+
+    cache_file = get_config_cache_file(config_file)
+    cache_key = get_config_cache_key(data)
+    cluster = read_config_cache(cache_file, cache_key)
+    if cluster is None:
+        cluster = Cluster(yaml.load(data, Loader=YamlLoader), config_file)
+        write_config_cache(cache_file, cache_key, cluster)
+    cluster.config_file = config_file
     return cluster
 
 
+def get_config_cache_file(config_file):
+    name = hashlib.sha256(os.path.abspath(config_file).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.config', 'bman', '.cache',
+                        'cluster-{}.pickle'.format(name))
+
+
+def get_config_cache_key(data):
+    """
+    Hash of the config file contents, the Python version and the modules
+    that define the Cluster model.
+    """
+    digest = hashlib.sha256(data)
+    digest.update(sys.version.encode('utf-8'))
+    for module in CLUSTER_MODEL_MODULES:
+        stat = os.stat(sys.modules[module].__file__)
+        digest.update('{}:{}:{}'.format(module, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_include_digests(include_files):
+    """ :return: dict mapping include file -> hash of its contents, or None if one is missing. """
+    digests = {}
+    for path in include_files:
+        try:
+            with open(path, 'rb') as f:
+                digests[path] = hashlib.sha256(f.read()).hexdigest()
+        except IOError:
+            return None
+    return digests
+
+
+def read_config_cache(cache_file, cache_key):
+    """
+    :return: the cached Cluster, or None if there is no valid cache entry.
+             An entry is valid if its key matches and the include files it
+             was built from are unchanged.
+    """
+    try:
+        with open(cache_file, 'rb') as f:
+            key, include_digests, cluster = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        get_logger().debug("Ignoring unreadable config cache {}: {}".format(cache_file, e))
+        return None
+    if key != cache_key or include_digests is None or \
+            get_include_digests(include_digests) != include_digests:
+        return None
+    return cluster
+
+
+def write_config_cache(cache_file, cache_key, cluster):
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+        # The config may hold passwords, so keep the cache private.
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            pickle.dump((cache_key, get_include_digests(cluster.get_include_files()), cluster), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        get_logger().debug("Could not write config cache {}: {}".format(cache_file, e))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
 class UserConfig(object):
     def __init__(self, name, password, group):
         self.name = name
@@ -325,5 +569,25 @@ class UserConfig(object):
         self.group = group
 
 
+def load_users_csv(csv_file):
+    """
+    Read users for bulk creation from a CSV file with one
+    'name,password,group' row per user. Blank lines and lines starting
+    with '#' are skipped.
+
+    :return: list of UserConfig objects.
+    """
+    users = []
+    with open(csv_file, 'r') as stream:
+        for line_number, row in enumerate(csv.reader(stream), 1):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            if len(row) != 3:
+                raise ConfigurationError("{}:{}: expected name,password,group but got {}".format(
+                    csv_file, line_number, row))
+            users.append(UserConfig(*[field.strip() for field in row]))
+    return users
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,201 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Support for the 'status' command.
+
+The state of every host is collected in a single parallel sweep. Each host
+runs one remote command that reports running JVMs (jps), listening TCP ports
+and Hadoop daemon pid files.
+"""
+
+import time
+
+from colorama import Fore
+from fabric.api import task, sudo, hide, settings, execute
+from fabric.decorators import parallel
+
+import bman.constants as constants
+from bman.host_roles import ROLE_DATANODE, ALL_ROLES
+from bman.logger import get_logger
+from bman.utils import get_pid_file_patterns
+
+# The secure DataNode runs under jsvc with a different main class.
+JPS_NAMES = {
+    'SecureDataNodeStarter': ROLE_DATANODE,
+}
+
+SECTION_MARKER = '--bman-'
+
+
+def get_expected_roles(cluster):
+    """
+    Return a dict mapping each cluster host to the set of daemon roles that
+    should be running on it.
+    """
+    index = cluster.get_role_index()
+    return {host: set(index.get_roles(host)) for host in index.get_all_hosts()}
+
+
+def get_status_command(cluster):
+    """
+    A single shell command that reports everything the status sweep needs.
+    """
+    jps = '{}/bin/jps'.format(cluster.get_config(constants.KEY_JAVA_HOME))
+    return ' ; '.join([
+        'echo {}jps'.format(SECTION_MARKER),
+        '(jps 2>/dev/null || {} 2>/dev/null)'.format(jps),
+        'echo {}ports'.format(SECTION_MARKER),
+        '(ss -ltnH 2>/dev/null || netstat -ltn 2>/dev/null)',
+        'echo {}pids'.format(SECTION_MARKER),
+        'for f in {} ; do [ -f "$f" ] && echo "$f $(cat $f)" ; done'.format(
+            ' '.join(get_pid_file_patterns(cluster))),
+        'true'])
+
+
+def parse_status_output(output):
+    """
+    Parse the output of the status command into a dict with the keys
+    'daemons' (role -> pid), 'ports' (sorted list) and 'pidfiles' (path -> pid).
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith(SECTION_MARKER):
+            current = line[len(SECTION_MARKER):]
+            sections[current] = []
+        elif line and current:
+            sections[current].append(line)
+
+    daemons = {}
+    for line in sections.get('jps', []):
+        fields = line.split()
+        if len(fields) == 2 and fields[0].isdigit():
+            daemons[JPS_NAMES.get(fields[1], fields[1])] = int(fields[0])
+
+    ports = set()
+    for line in sections.get('ports', []):
+        for field in line.split():
+            # The local address is the first field that looks like addr:port.
+            if ':' in field and field.rsplit(':', 1)[1].isdigit():
+                ports.add(int(field.rsplit(':', 1)[1]))
+                break
+
+    pidfiles = {}
+    for line in sections.get('pids', []):
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+            pidfiles[fields[0]] = int(fields[1])
+
+    return {'daemons': daemons, 'ports': sorted(ports), 'pidfiles': pidfiles}
+
+
+@task
+@parallel
+def get_host_status(cluster=None):
+    """ Collect the daemon status of one host with a single remote command. """
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_status_command(cluster), pty=False)
+    return parse_status_output(result.stdout)
+
+
+def collect_cluster_status(cluster):
+    """
+    Collect the status of all cluster hosts in one parallel sweep.
+    :return: dict mapping hostname -> status dict, or None if the host
+             could not be reached.
+    """
+    targets = cluster.get_all_hosts()
+    get_logger().debug("Collecting daemon status from {} hosts".format(len(targets)))
+    with hide('everything'), settings(skip_bad_hosts=True, warn_only=True):
+        results = execute(get_host_status, hosts=targets, cluster=cluster)
+    return {host: (status if isinstance(status, dict) else None)
+            for host, status in results.items()}
+
+
+class ClusterStatusCache(object):
+    """
+    Caches the result of the last status sweep for a short time, so that
+    repeated queries from the interactive shell are instant.
+    """
+
+    def __init__(self, ttl=constants.STATUS_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.status = None
+        self.timestamp = 0
+
+    def get(self, cluster, refresh=False):
+        if refresh or self.status is None or time.monotonic() - self.timestamp > self.ttl:
+            self.status = collect_cluster_status(cluster)
+            self.timestamp = time.monotonic()
+        return self.status
+
+    def invalidate(self):
+        self.status = None
+
+
+def format_status_cell(role, expected_roles, status):
+    """ Return a colored cell for one role on one host. """
+    if status is None:
+        return Fore.RED + '?' + Fore.RESET
+    running = role in status['daemons']
+    if role in expected_roles:
+        if running:
+            return Fore.GREEN + str(status['daemons'][role]) + Fore.RESET
+        return Fore.RED + 'DOWN' + Fore.RESET
+    if running:
+        return Fore.YELLOW + str(status['daemons'][role]) + Fore.RESET
+    return '-'
+
+
+def print_cluster_status(cluster, all_status, verbose=False):
+    """
+    Print a role-by-host matrix. Each cell shows the daemon PID (green if it
+    is expected, yellow if not), DOWN for expected daemons that are not
+    running, or '?' for unreachable hosts.
+    """
+    expected = get_expected_roles(cluster)
+    roles = [r for r in ALL_ROLES if any(r in e for e in expected.values())]
+    host_width = max(len(h) for h in expected) + 2
+    col_width = max(len(r) for r in roles) + 2
+
+    print(''.ljust(host_width) + ''.join(r.ljust(col_width) for r in roles))
+    down = 0
+    for host in sorted(expected):
+        status = all_status.get(host)
+        row = host.ljust(host_width)
+        for role in roles:
+            cell = format_status_cell(role, expected[host], status)
+            # Pad on the visible text so colour codes don't break alignment.
+            visible = cell.replace(Fore.RED, '').replace(Fore.GREEN, '').replace(
+                Fore.YELLOW, '').replace(Fore.RESET, '')
+            row += cell + ' ' * (col_width - len(visible))
+            if status is not None and role in expected[host] and role not in status['daemons']:
+                down += 1
+        print(row)
+        if verbose and status is not None:
+            print('    ports: {}'.format(', '.join(str(p) for p in status['ports'])))
+            running_pids = set(status['daemons'].values())
+            for pidfile, pid in sorted(status['pidfiles'].items()):
+                print('    {} {}{}'.format(
+                    pidfile, pid, '' if pid in running_pids else ' (stale)'))
+
+    unreachable = [h for h in expected if all_status.get(h) is None]
+    print("\n{} hosts, {} expected daemons down, {} hosts unreachable.".format(
+        len(expected), down, len(unreachable)))
+
+
+if __name__ == '__main__':
+    pass
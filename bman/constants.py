@@ -40,12 +40,46 @@ KEY_MAPRED_SITE_SETTINGS = 'MapredSiteSettings'
 KEY_OZONE_SITE_SETTINGS = 'OzoneSiteSettings'
 KEY_TEZ_SITE_SETTINGS = 'TezSiteSettings'
 KEY_FORCE_WIPE = 'ForceWipe'
+KEY_FAST_WIPE = 'FastWipe'
+KEY_HDFS_PATHS = 'HdfsPaths'
+KEY_USE_WEBHDFS = 'UseWebHdfs'
+KEY_TEZ_LIB_REPLICATION = 'TezLibReplication'
+KEY_SORT_SITE_SETTINGS = 'SortSiteSettings'
+KEY_HOST_GROUPS = 'HostGroups'
+KEY_HOST_OVERRIDES = 'HostOverrides'
+KEY_HOSTS = 'Hosts'
 KEY_JCE_POLICY_FILES_LOCATION = 'JcePolicyFilesLocation'
+KEY_KADMIN_SERVER = 'KadminServer'
+KEY_KADMIN_PRINCIPAL = 'KadminPrincipal'
+KEY_KADMIN_PASSWORD = 'KadminPassword'
+KEY_KADMIN_BATCH_SIZE = 'KadminBatchSize'
+KEY_KEYTAB_FACTORY_HOST = 'KeytabFactoryHost'
 KEY_REALM = 'KerberosRealm'
+KEY_READINESS_TIMEOUT = 'ReadinessTimeoutSeconds'
+KEY_DATANODE_START_WAVE_SIZE = 'DataNodeStartWaveSize'
+KEY_DATANODE_START_MAX_RPC_QUEUE_TIME = 'DataNodeStartMaxRpcQueueTimeMs'
+KEY_ROLLING_RESTART_WINDOW = 'RollingRestartWindow'
+KEY_DAEMON_STOP_TIMEOUT = 'DaemonStopTimeoutSeconds'
 
 KEY_JAVA_HOME = 'JavaHome'
 DEFAULT_JAVA_HOME = '/usr/java/latest'
 JSVC_HOME = '/usr/lib/jsvc'
+DEFAULT_READINESS_TIMEOUT = 300
+DEFAULT_DATANODE_START_MAX_RPC_QUEUE_TIME = 50
+DEFAULT_DAEMON_STOP_TIMEOUT = 30
+DEFAULT_KADMIN_BATCH_SIZE = 200
+# Site settings that HostGroups and HostOverrides may override, and the files they go to.
+HOST_OVERRIDE_SITE_FILES = {KEY_CORE_SITE_SETTINGS: 'core-site.xml',
+                            KEY_HDFS_SITE_SETTINGS: 'hdfs-site.xml',
+                            KEY_YARN_SITE_SETTINGS: 'yarn-site.xml',
+                            KEY_MAPRED_SITE_SETTINGS: 'mapred-site.xml'}
+STATUS_CACHE_TTL_SECONDS = 10  # How long the interactive shell reuses the last 'status' sweep.
+HDFS_TICKET_LIFETIME_SECONDS = 3600  # Lifetime requested for the hdfs superuser's ticket session.
+HDFS_TICKET_RENEW_MARGIN_SECONDS = 300  # Log in again when the ticket is this close to expiry.
+HOST_FACTS_TTL_SECONDS = 600  # How long 'preflight' and 'install' reuse the facts collected from hosts.
+PREFLIGHT_MAX_CLOCK_SKEW_SECONDS = 60  # Kerberos rejects requests from hosts with a larger skew.
+PREFLIGHT_MIN_STORAGE_FREE_MB = 1024  # Free space needed on each storage directory of a host.
+PREFLIGHT_EXTRACTED_TARBALL_FACTOR = 3  # Space for the extracted tarballs, as a multiple of their size.
 
 HDFS_USER = 'hdfs'
 YARN_USER = 'yarn'
@@ -53,9 +87,20 @@ MAPREDUCE_USER = 'mapred'
 TEZ_USER = 'tez'
 HADOOP_GROUP = 'hadoop'
 HADOOP_LOG_DIR_NAME = 'logs'  # Directory name under HADOOP_HOME where service logs will be stored.
+HADOOP_PID_DIR_NAME = 'pids'  # Directory name under HADOOP_HOME where daemon pid files will be stored.
+INSTALLED_TARBALL_MD5_FILE_NAME = '.bman-tarball.md5'
+GENERATED_CONFIG_FINGERPRINT_FILE_NAME = '.bman-fingerprint'  # Inputs of the last generate_configs run.
+HOST_CONFIG_SETS_FILE_NAME = 'hosts.json'  # Maps hosts with overrides to their generated config set.
+TEZ_LIB_MD5_XATTR = 'user.bman.md5'  # Records the MD5 of the local Tez tarball on its HDFS copy.
 
+DEFAULT_NAMENODE_RPC_PORT = 8020
 DEFAULT_NAMENODE_HTTP_PORT = 9870
+DEFAULT_JOURNALNODE_RPC_PORT = 8485
+DEFAULT_DATANODE_HTTP_PORT = 9864
+DEFAULT_RESOURCEMANAGER_HTTP_PORT = 8088
 DEFAULT_SECONDARY_NAMENODE_HTTP_PORT = 9869
+KDC_PORT = 88
+KADMIN_PORT = 749
 
 DEFAULT_SSH_KEY_NAME = 'id_rsa'  # The default key name that sshd understands
 
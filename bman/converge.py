@@ -0,0 +1,402 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Support for the 'converge' command.
+
+Converge brings an existing cluster to the state described by the config
+file without starting over. The current state of every host (service users,
+storage and log directories, installed tarball, config file hashes and
+keytab KVNOs) is collected in one parallel sweep. The differences are then
+turned into a plan and only the planned actions are run, each batched
+across all the hosts that need it.
+"""
+
+import glob
+import hashlib
+import os
+from collections import defaultdict
+
+from fabric.api import task, sudo, hide, settings, execute, env
+from fabric.decorators import parallel
+
+import bman.constants as constants
+from bman.deployment_manager import make_base_install_dir, extract_tarball, make_hadoop_log_dirs, \
+    mark_installed_tarball
+from bman.kerberos_setup import KadminUtil, make_headless_principals, get_service_keytabs, \
+    create_principals, export_keytabs, get_kdc_kvnos, get_keytab_kvnos_command, parse_keytab_kvnos
+from bman.local_tasks import generate_configs
+from bman.logger import get_logger
+from bman.remote_tasks import sync_users, check_sync_users_results
+from bman.storage_tasks import run_per_disk
+from bman.utils import copy_hadoop_config_files, get_tarball_destination, put_to_all_nodes
+
+SECTION_MARKER = '--bman-'
+
+ACTION_ADD_USER = 'add-user'
+ACTION_INSTALL = 'install'
+ACTION_FIX_DIR = 'fix-dir'
+ACTION_COPY_CONFIGS = 'copy-configs'
+ACTION_EXPORT_KEYTAB = 'export-keytab'
+
+
+def get_local_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class DesiredHostState(object):
+    """
+    The state that one host should be in.
+
+    dirs is a list of (path, mode, owner, group) tuples where owner may be
+    None if any owner is acceptable. keytabs is a list of
+    (keytab file, principal) tuples with _HOST already substituted.
+    """
+
+    def __init__(self, users, dirs, tarball_md5, config_md5s, keytabs):
+        self.users = users
+        self.dirs = dirs
+        self.tarball_md5 = tarball_md5
+        self.config_md5s = config_md5s
+        self.keytabs = keytabs
+
+
+def get_desired_state(cluster):
+    """
+    Compute the desired state of each host from the cluster configuration.
+    Generates the config files locally, to compare their hashes.
+
+    :return: dict mapping hostname -> DesiredHostState.
+    """
+    master_config = cluster.get_hdfs_master_config()
+    master_dirs = [(d, '755', constants.HDFS_USER, constants.HADOOP_GROUP)
+                   for d in master_config.get_nn_dirs() + master_config.get_snn_dirs() +
+                   master_config.get_jn_dirs()]
+    service_dirs = [(d, '775', None, constants.HADOOP_GROUP) for d in [
+        os.path.join(cluster.get_hadoop_install_dir(), constants.HADOOP_LOG_DIR_NAME),
+        cluster.get_hadoop_pid_dir()]]
+
+    def get_dirs(host):
+        # DataNode dirs may be overridden per host.
+        return master_dirs + [(d, '700', constants.HDFS_USER, constants.HADOOP_GROUP)
+                              for d in cluster.get_datanode_dirs(host)] + service_dirs
+
+    users = [(u.name, u.group) for u in cluster.get_service_users()]
+    tarball_md5 = get_local_md5(cluster.get_config(constants.KEY_HADOOP_TARBALL))
+
+    generate_configs(cluster)
+    # Hosts with overrides have their own config set. Hash each set once.
+    config_md5s = {}
+    for host in cluster.get_all_hosts():
+        conf_dir = cluster.get_host_hadoop_conf_tmp_dir(host)
+        if conf_dir not in config_md5s:
+            config_md5s[conf_dir] = {os.path.basename(f): get_local_md5(f) for f in glob.glob(
+                os.path.join(conf_dir, '*'))}
+
+    keytabs = defaultdict(list)
+    if cluster.is_kerberized():
+        for host, service_keytabs in get_service_keytabs(cluster).items():
+            keytabs[host].extend(k[:2] for k in service_keytabs)
+        realm = KadminUtil(cluster).get_default_realm()
+        keytab_dir = os.path.dirname(cluster.get_site_setting('dfs.namenode.keytab.file'))
+        for host in cluster.get_all_hosts():
+            for name, _ in users:
+                keytabs[host].append((os.path.join(keytab_dir, '{}.headless.keytab'.format(name)),
+                                      '{}@{}'.format(name, realm)))
+
+    return {host: DesiredHostState(users, get_dirs(host), tarball_md5,
+                                   config_md5s[cluster.get_host_hadoop_conf_tmp_dir(host)], keytabs[host])
+            for host in cluster.get_all_hosts()}
+
+
+def get_state_command(cluster, desired):
+    """
+    A single shell command that reports the current state of a host for
+    comparison with desired, a DesiredHostState.
+    """
+    users = ' '.join(name for name, _ in desired.users)
+    dirs = ' '.join(d[0] for d in desired.dirs)
+    keytabs = sorted({k for k, _ in desired.keytabs})
+    return '\n'.join([
+        'echo {}users'.format(SECTION_MARKER),
+        'for u in {}; do id -gn $u 2>/dev/null | sed "s/^/$u /"; done'.format(users),
+        'echo {}dirs'.format(SECTION_MARKER),
+        'for d in {}; do [ -d "$d" ] && stat -c "%n %a %U %G" "$d"; done'.format(dirs),
+        'echo {}tarball'.format(SECTION_MARKER),
+        'cat {} 2>/dev/null'.format(os.path.join(cluster.get_hadoop_install_dir(),
+                                                 constants.INSTALLED_TARBALL_MD5_FILE_NAME)),
+        'echo {}configs'.format(SECTION_MARKER),
+        'md5sum {}/* 2>/dev/null'.format(cluster.get_hadoop_conf_dir()),
+        'echo {}keytabs'.format(SECTION_MARKER),
+        get_keytab_kvnos_command(keytabs)])
+
+
+def parse_state_output(output):
+    """
+    Parse the output of the state command into a dict with the keys
+    'users' (name -> group), 'dirs' (path -> (mode, owner, group)),
+    'tarball' (md5 or None), 'configs' (filename -> md5) and
+    'keytabs' ((keytab, principal) -> highest KVNO).
+    """
+    sections = defaultdict(list)
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith(SECTION_MARKER):
+            current = line[len(SECTION_MARKER):]
+        elif line and current:
+            sections[current].append(line.split())
+
+    state = {'users': {}, 'dirs': {}, 'tarball': None, 'configs': {}, 'keytabs': {}}
+    for fields in sections['users']:
+        if len(fields) == 2:
+            state['users'][fields[0]] = fields[1]
+    for fields in sections['dirs']:
+        if len(fields) == 4:
+            state['dirs'][fields[0]] = tuple(fields[1:])
+    for fields in sections['tarball']:
+        state['tarball'] = fields[0]
+    for fields in sections['configs']:
+        if len(fields) == 2:
+            state['configs'][os.path.basename(fields[1])] = fields[0]
+    state['keytabs'] = parse_keytab_kvnos(' '.join(fields) for fields in sections['keytabs'])
+    return state
+
+
+@task
+@parallel
+def get_host_state(cluster=None, desired=None):
+    """ Collect the state of one host with a single remote command. """
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_state_command(cluster, desired[env.host]), pty=False)
+    return parse_state_output(result.stdout)
+
+
+def collect_state(cluster, desired):
+    """
+    :return: dict mapping hostname -> parsed state, or None if the host
+             could not be reached.
+    """
+    with hide('everything'), settings(skip_bad_hosts=True, warn_only=True):
+        results = execute(get_host_state, hosts=list(desired), cluster=cluster, desired=desired)
+    return {host: (state if isinstance(state, dict) else None) for host, state in results.items()}
+
+
+def plan_host(desired, state, kdc_kvnos):
+    """
+    Compare the desired and current state of a host.
+
+    :return: list of actions. Each action is a tuple whose first element is
+             one of the ACTION_ constants.
+    """
+    actions = []
+    for name, group in desired.users:
+        if state['users'].get(name) != group:
+            actions.append((ACTION_ADD_USER, name))
+
+    reinstall = state['tarball'] != desired.tarball_md5
+    if reinstall:
+        actions.append((ACTION_INSTALL,))
+
+    for path, mode, owner, group in desired.dirs:
+        current = state['dirs'].get(path)
+        # The log and pid dirs are recreated by a reinstall.
+        if reinstall and owner is None:
+            continue
+        if current is None or current[0] != mode or current[2] != group or \
+                (owner is not None and current[1] != owner):
+            actions.append((ACTION_FIX_DIR, path, mode, owner, group))
+
+    # Files shipped in the tarball but not generated by bman are ignored.
+    if reinstall or any(state['configs'].get(f) != md5 for f, md5 in desired.config_md5s.items()):
+        actions.append((ACTION_COPY_CONFIGS,))
+
+    for keytab, principal in desired.keytabs:
+        kvno = state['keytabs'].get((keytab, principal))
+        if kvno is None or kvno != kdc_kvnos.get(principal):
+            actions.append((ACTION_EXPORT_KEYTAB, keytab, principal))
+    return actions
+
+
+@task
+@parallel
+def fix_dirs(plan=None):
+    """ Fix the directories planned for this host, in parallel across disks. """
+    by_attrs = defaultdict(list)
+    for action in plan[env.host]:
+        if action[0] == ACTION_FIX_DIR:
+            by_attrs[action[2:]].append(action[1])
+    success = True
+    for (mode, owner, group), dirs in by_attrs.items():
+        ownership = 'chown -R {}:{}'.format(owner, group) if owner else 'chgrp {}'.format(group)
+        success = run_per_disk(dirs, 'install -d -m {} "$d" && {} "$d"'.format(mode, ownership),
+                               'fixed') and success
+    return success
+
+
+def hosts_with(plan, action_type):
+    return sorted(h for h, actions in plan.items() if any(a[0] == action_type for a in actions))
+
+
+def check_results(results, step):
+    """
+    Log the hosts that a step failed on.
+
+    :param results: dict mapping host -> task result, as returned by execute.
+    :return: True if the step succeeded on every host.
+    """
+    failed = sorted(host for host, success in results.items()
+                    if not success or isinstance(success, BaseException))
+    if failed:
+        get_logger().error("Failed to {} on {}".format(step, ', '.join(failed)))
+    return not failed
+
+
+def apply_plan(cluster, plan, desired):
+    """
+    Run the planned actions, each batched across the hosts that need it.
+    Stops at the first action that fails on any host.
+
+    :return: True if every action succeeded.
+    """
+    hosts = hosts_with(plan, ACTION_ADD_USER)
+    if hosts:
+        get_logger().info("Adding service users on {} hosts".format(len(hosts)))
+        with settings(skip_bad_hosts=True, warn_only=True):
+            results = execute(sync_users, hosts=hosts, users=list(cluster.get_service_users()))
+        if not check_sync_users_results(results):
+            return False
+
+    hosts = hosts_with(plan, ACTION_INSTALL)
+    if hosts:
+        get_logger().info("Installing {} on {} hosts".format(
+            cluster.get_config(constants.KEY_HADOOP_TARBALL), len(hosts)))
+        source_file = cluster.get_config(constants.KEY_HADOOP_TARBALL)
+        remote_file = get_tarball_destination(source_file)
+        if not put_to_all_nodes(cluster=cluster, source_file=source_file, remote_file=remote_file,
+                                targets=hosts):
+            get_logger().error("Failed to copy {}".format(source_file))
+            return False
+        if not check_results(execute(make_base_install_dir, hosts=hosts, cluster=cluster),
+                             'make the install dir'):
+            return False
+        if not extract_tarball(cluster=cluster, targets=hosts, remote_file=remote_file,
+                               target_folder=cluster.get_hadoop_install_dir(), strip_level=1):
+            return False
+        if not check_results(execute(make_hadoop_log_dirs, hosts=hosts, cluster=cluster),
+                             'make the log dirs'):
+            return False
+        # The marker is written last, so that a failed install is retried.
+        if not check_results(execute(mark_installed_tarball, hosts=hosts, cluster=cluster,
+                                     md5=desired[hosts[0]].tarball_md5), 'record the installed tarball'):
+            return False
+
+    hosts = hosts_with(plan, ACTION_FIX_DIR)
+    if hosts:
+        get_logger().info("Fixing storage directories on {} hosts".format(len(hosts)))
+        if not check_results(execute(fix_dirs, hosts=hosts, plan=plan), 'fix directories'):
+            return False
+
+    hosts = hosts_with(plan, ACTION_COPY_CONFIGS)
+    if hosts:
+        get_logger().info("Copying changed config files to {} hosts".format(len(hosts)))
+        if not check_results(execute(copy_hadoop_config_files, hosts=hosts, cluster=cluster),
+                             'copy config files'):
+            return False
+
+    stale_keytabs = {a[1:] for actions in plan.values() for a in actions if a[0] == ACTION_EXPORT_KEYTAB}
+    if stale_keytabs:
+        return apply_keytab_actions(cluster, plan, stale_keytabs)
+    return True
+
+
+def apply_keytab_actions(cluster, plan, stale_keytabs):
+    """
+    Re-export stale keytabs. A headless keytab is shared by all hosts, so
+    exporting it again invalidates every copy; it is regenerated and
+    redistributed everywhere.
+
+    :return: True if all stale keytabs were exported and installed.
+    """
+    users = [user for user in cluster.get_service_users()
+             if any(principal.split('@')[0] == user.name for _, principal in stale_keytabs)]
+    if users:
+        get_logger().info("Regenerating the headless keytabs for {}".format(
+            ', '.join(user.name for user in users)))
+        if not make_headless_principals(cluster, users):
+            get_logger().error("Failed to regenerate the headless keytabs")
+            return False
+
+    host_keytabs = {host: [k for k in keytabs if (ACTION_EXPORT_KEYTAB, k[0], k[1]) in plan.get(host, ())]
+                    for host, keytabs in get_service_keytabs(cluster).items()}
+    principals = [k[1] for keytabs in host_keytabs.values() for k in keytabs]
+    if not principals:
+        return True
+    if not create_principals(cluster, principals):
+        get_logger().error("Failed to create principals, not exporting keytabs")
+        return False
+    if not export_keytabs(cluster, host_keytabs):
+        get_logger().error("Failed to export keytabs")
+        return False
+    return True
+
+
+def print_plan(plan):
+    for host in sorted(plan):
+        for action in plan[host]:
+            # Fix-dir actions have no owner for the log and pid dirs.
+            print("{}: {}".format(host, ' '.join(str(field) for field in action if field is not None)))
+
+
+def converge_cluster(cluster, dry_run=False):
+    """
+    Bring the cluster to its configured state, running only the actions
+    that are needed. Running services are not restarted.
+
+    :param dry_run: if True, only print the plan.
+    :return: True if the cluster was already converged or all actions succeeded.
+    """
+    desired = get_desired_state(cluster)
+    get_logger().info("Collecting the current state of {} hosts".format(len(desired)))
+    state = collect_state(cluster, desired)
+    unreachable = sorted(h for h, s in state.items() if s is None)
+    if unreachable:
+        get_logger().error("Cannot converge, unreachable hosts: {}".format(', '.join(unreachable)))
+        return False
+
+    kdc_kvnos = get_kdc_kvnos(cluster, {p for d in desired.values() for _, p in d.keytabs})
+    plan = {host: plan_host(desired[host], state[host], kdc_kvnos) for host in desired}
+    plan = {host: actions for host, actions in plan.items() if actions}
+    if not plan:
+        get_logger().info("All {} hosts are up to date.".format(len(desired)))
+        return True
+
+    print_plan(plan)
+    if dry_run:
+        return True
+    with hide('status', 'warnings', 'running', 'stdout', 'stderr', 'user', 'commands'):
+        if not apply_plan(cluster, plan, desired):
+            get_logger().error("Converge failed, run it again once the errors are fixed.")
+            return False
+    if hosts_with(plan, ACTION_COPY_CONFIGS) or hosts_with(plan, ACTION_EXPORT_KEYTAB):
+        get_logger().info("Restart the affected services for config and keytab changes to take effect.")
+    return True
+
+
+if __name__ == '__main__':
+    pass
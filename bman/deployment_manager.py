@@ -12,23 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import os
 import uuid
 
 import fabric
 from fabric.api import hide, execute, show
 from fabric.contrib.files import exists as remote_exists
-from fabric.decorators import task
+from fabric.decorators import task, parallel
 from fabric.operations import sudo, put
 from fabric.state import env
 
 import bman.constants as constants
+from bman.hdfs_namespace import provision_namespaces, publish_tez_tarball
 from bman.kerberos_setup import do_kerberos_install
 from bman.local_tasks import generate_configs, sshkey_gen, sshkey_install, copy_private_key
 from bman.logger import get_logger
-from bman.remote_tasks import do_active_transitions, stop_dfs, stop_yarn, shutdown, start_yarn, run_yarn
-from bman.utils import get_tarball_destination, start_stop_service, do_untar, \
-    run_dfs_command, do_sleep, put_to_all_nodes, copy_hadoop_config_files, copy_tez_config_files
+from bman.preflight import run_preflight
+from bman.readiness import wait_for_namenodes, wait_for_journalnode_quorum, wait_for_safemode_exit
+from bman.remote_tasks import transition_to_active, stop_dfs, stop_yarn, shutdown, start_yarn, run_yarn, \
+    start_datanodes_in_waves
+from bman.storage_tasks import run_per_disk
+from bman.utils import get_tarball_destination, start_stop_service, do_untar, get_md5, run_in_processes, \
+    put_to_all_nodes, copy_hadoop_config_files, copy_tez_config_files
 
 """
 This module contains support methods for performing cluster deployment
@@ -64,6 +70,11 @@ def install_cluster(cluster_id=uuid.uuid4(), cluster=None, stop_services=True):
               'user', 'commands'):
         setup_passwordless_ssh(cluster, cluster.get_all_hosts())
 
+    # Reuses the facts of a recent 'preflight' run instead of asking the hosts again.
+    if not run_preflight(cluster, verbose=False):
+        get_logger().error("Preflight checks failed. Fix the problems and run 'preflight refresh'.")
+        return False
+
     make_install_dir(cluster=cluster)
     deploy_hadoop_tarball(cluster=cluster)
     deploy_tez_tarball(cluster=cluster)
@@ -105,15 +116,17 @@ def install_cluster(cluster_id=uuid.uuid4(), cluster=None, stop_services=True):
     else:
         get_logger().info("Cluster is not kerberized.")
 
-    format_hdfs_nameservices(cluster, cluster_id)
+    if not format_hdfs_nameservices(cluster, cluster_id):
+        get_logger().error("Failed to format HDFS.")
+        return False
 
-    if not execute(start_stop_service, hosts=cluster.get_worker_nodes(), cluster=cluster,
-                   action='start', service_name='datanode'):
+    if not start_datanodes_in_waves(cluster, cluster.get_worker_nodes()):
         get_logger().error("Failed to start one or more DataNodes.")
         return False
 
-    if cluster.is_tez_enabled():
-        deploy_tez(cluster)
+    if cluster.is_tez_enabled() and not deploy_tez(cluster):
+        get_logger().error("Failed to deploy Tez.")
+        return False
 
     get_logger().info("Done deploying Hadoop to {} nodes.".format(len(targets)))
 
@@ -163,6 +176,19 @@ def deploy_hadoop_tarball(cluster=None):
                     remote_file=remote_file,
                     target_folder=cluster.get_hadoop_install_dir(),
                     strip_level=1)
+    execute(mark_installed_tarball, hosts=cluster.get_all_hosts(), cluster=cluster,
+            md5=get_md5(source_file, True))
+
+
+@task
+@parallel
+def mark_installed_tarball(cluster=None, md5=None):
+    """
+    Record the MD5 of the Hadoop tarball in the install directory, so that
+    'converge' can tell whether the installed version is current.
+    """
+    md5_file = os.path.join(cluster.get_hadoop_install_dir(), constants.INSTALLED_TARBALL_MD5_FILE_NAME)
+    return sudo('echo {} > {}'.format(md5, md5_file)).succeeded
 
 
 def deploy_tez_tarball(cluster=None):
@@ -178,32 +204,30 @@ def deploy_tez_tarball(cluster=None):
 
 @task
 def make_hdfs_dirs(cluster):
-    """ Creates NameNode and DataNode directories."""
+    """ Creates NameNode and DataNode directories, in parallel across disks."""
     hdfs_master_config = cluster.get_hdfs_master_config()
-    for d in hdfs_master_config.get_nn_dirs():
-        sudo('install -d -m 0755 {}'.format(d))
-        sudo('chown -R hdfs:hadoop {}'.format(d))
-    for d in hdfs_master_config.get_snn_dirs():
-        sudo('install -d -m 0755 {}'.format(d))
-        sudo('chown -R hdfs:hadoop {}'.format(d))
-    for d in hdfs_master_config.get_jn_dirs():
-        sudo('install -d -m 0755 {}'.format(d))
-        sudo('chown -R hdfs:hadoop {}'.format(d))
-    for d in cluster.get_datanode_dirs():
-        sudo('install -d -m 0700 {}'.format(d))
-        sudo('chown -R hdfs:hadoop {}'.format(d))
+    master_dirs = hdfs_master_config.get_nn_dirs() + hdfs_master_config.get_snn_dirs() + \
+        hdfs_master_config.get_jn_dirs()
+    success = run_per_disk(master_dirs, 'install -d -m 0755 "$d" && chown -R hdfs:hadoop "$d"',
+                           'created')
+    success = run_per_disk(cluster.get_datanode_dirs(env.host),
+                           'install -d -m 0700 "$d" && chown -R hdfs:hadoop "$d"',
+                           'created') and success
     if cluster.get_config(constants.KEY_OZONE_ENABLED):
         sudo('install -d -m 0755 {}'.format(cluster.get_config(constants.KEY_OZONE_METADIR)))
         sudo('chown -R hdfs:hadoop {}'.format(cluster.get_config(constants.KEY_OZONE_METADIR)))
     # Ensure that the hdfs user has permissions to reach its storage
     # directories.
+    parents = set()
     for d in cluster.get_hdfs_master_config().get_nn_dirs() + \
-            cluster.get_datanode_dirs() + \
+            cluster.get_datanode_dirs(env.host) + \
             cluster.get_hdfs_master_config().get_snn_dirs():
         while os.path.dirname(d) != d:
             d = os.path.dirname(d)
-            sudo('chmod 755 {}'.format(d))
-    return True
+            parents.add(d)
+    if parents:
+        sudo('chmod 755 {}'.format(' '.join(sorted(parents))))
+    return success
 
 
 def copy_jscsi_helper(cluster):
@@ -242,48 +266,73 @@ def format_namenode(cluster, cluster_id):
 
 def format_hdfs_nameservices(cluster, cluster_id):
     """
-    Run steps to format an HDFS HA cluster.
-        1. Start JournalNodes.
-        2. Format active NameNodes.
-        3. Start active NameNodes.
-        4. Boostrap standby NameNodes.
-        5. Shutdown active NameNodes.
-        6. Shutdown JournalNodes.
+    Run steps to format an HDFS cluster.
+        1. Start all JournalNodes.
+        2. Run format_nameservice for every nameservice at the same time,
+           so each one proceeds on its own timeline.
+        3. Create the initial namespace.
     :param cluster_id:
     :param cluster:
     :return:
     """
     start_stop_all_journalnodes(cluster, action='start')
-    # Format and start the active NNs.
-    actives = cluster.get_hdfs_master_config().choose_active_nns()
+
+    nameservices = cluster.get_hdfs_master_config().get_nameservices()
+    results = run_in_processes({ns.get_id(): functools.partial(format_nameservice, cluster, ns, cluster_id)
+                                for ns in nameservices})
+    failed = sorted(nsid for nsid, success in results.items() if not success)
+    if failed:
+        get_logger().error("Failed to format nameservices: {}".format(', '.join(failed)))
+        return False
+    return provision_namespaces(cluster)
+
+
+def format_nameservice(cluster, ns, cluster_id):
+    """
+    Format and start the NameNodes of one nameservice.
+        1. Wait for a quorum of its JournalNodes.
+        2. Format the active NameNode, start it and wait until it is up.
+        3. Bootstrap and start the standby NameNodes and wait until they are up.
+        4. Transition the active NameNode and wait for it to leave safe mode.
+           This works without DataNodes as there are no files/blocks in the
+           system yet.
+    :return: True if the nameservice is up.
+    """
+    if not wait_for_journalnode_quorum(cluster, nameservices=[ns]):
+        get_logger().error("JournalNodes of {} did not come up.".format(ns.get_id()))
+        return False
+
+    active_nns = ns.choose_active_nn()
+    actives = [nn.get_hostname() for nn in active_nns]
     if not execute(format_namenode, hosts=actives, cluster=cluster, cluster_id=cluster_id):
-        get_logger().error("Failed to format one or more active NameNodes.")
+        get_logger().error("Failed to format the active NameNode of {}.".format(ns.get_id()))
         return False
     if not execute(start_stop_service, hosts=actives, cluster=cluster,
                    action='start', service_name='namenode', user=constants.HDFS_USER):
-        get_logger().error("Failed to start one or more active NameNodes.")
+        get_logger().error("Failed to start the active NameNode of {}.".format(ns.get_id()))
+        return False
+    if not wait_for_namenodes(cluster, nns=active_nns):
+        get_logger().error("The active NameNode of {} did not come up.".format(ns.get_id()))
         return False
 
-    do_sleep(10)
-
-    # Bootstrap the standby NNs.
-    standbys = cluster.get_hdfs_master_config().choose_standby_nns()
+    standby_nns = ns.choose_standby_nns()
+    standbys = [nn.get_hostname() for nn in standby_nns]
     if standbys:
         if not execute(bootstrap_standby, hosts=standbys, cluster=cluster):
-            get_logger().error("Failed to bootstrap standby NameNodes.")
+            get_logger().error("Failed to bootstrap the standby NameNode of {}.".format(ns.get_id()))
             return False
         execute(start_stop_service, hosts=standbys, cluster=cluster,
                 action='start', service_name='namenode', user=constants.HDFS_USER)
-        do_sleep(10)
+        if not wait_for_namenodes(cluster, nns=standby_nns):
+            get_logger().error("The standby NameNode of {} did not come up.".format(ns.get_id()))
+            return False
 
-    # While the NNs are up, let's create tmp directories necessary for
-    # running YARN jobs. This works without DataNodes as there are no files/blocks in
-    # the system, so NN exits safe mode without restarting the DataNode.
-    do_active_transitions(cluster)
-    make_hdfs_dir(cluster, '/tmp', '1777')
-    make_hdfs_dir(cluster, '/apps', '755')
-    make_hdfs_dir(cluster, '/home', '755')
-    make_home_dirs(cluster)
+    if ns.is_ha():
+        transition_to_active(cluster, ns)
+    if not wait_for_safemode_exit(cluster, active_nns):
+        get_logger().error("The active NameNode of {} did not leave safe mode.".format(ns.get_id()))
+        return False
+    return True
 
 
 @task
@@ -300,10 +349,13 @@ def extract_tarball(cluster=None, targets=None, remote_file=None,
     get_logger().info("Extracting {} on all nodes".format(remote_file))
     with hide('status', 'warnings', 'running', 'stdout', 'stderr',
               'user', 'commands'):
-        if not execute(do_untar, hosts=targets, tarball=remote_file,
-                       target_folder=target_folder, strip_level=strip_level):
-            get_logger().error("Failed to untar {}".format(remote_file))
-            return False
+        results = execute(do_untar, hosts=targets, tarball=remote_file,
+                          target_folder=target_folder, strip_level=strip_level)
+    failed = sorted(host for host, success in results.items() if not success)
+    if failed:
+        get_logger().error("Failed to untar {} on {}".format(remote_file, ', '.join(failed)))
+        return False
+    return True
 
 
 def setup_passwordless_ssh(cluster, targets):
@@ -326,46 +378,21 @@ def make_hadoop_log_dirs(cluster=None):
     sudo('mkdir -p {}'.format(logging_root))
     sudo('chgrp {} {}'.format(constants.HADOOP_GROUP, logging_root))
     sudo('chmod 775 {}'.format(logging_root))
-
-
-def make_hdfs_dir(cluster, path, perm, owner=constants.HDFS_USER):
-    """
-    Create the specified directory in each HDFS namespace.
-    """
-    get_logger().debug("Creating HDFS directory {}".format(path))
-    if len(cluster.get_hdfs_master_config().get_nameservices()) == 1:
-        # Single namespace, so don't specify it explicitly. It may be a
-        # pseudo-namespace for non-HA, non-federated cluster.
-        cmd = 'hadoop fs -mkdir -p {0} && hadoop fs -chmod {1} {0} && hadoop fs -chown {2} {0}'.format(path, perm, owner)
-        run_dfs_command(cluster=cluster, cmd=cmd)
-        return
-
-    for ns in cluster.get_hdfs_master_config().get_nameservices():
-        cmd = 'hadoop fs -mkdir -p {0}{1} && hadoop fs -chmod {2} {0}{1} && hadoop fs -chown {3} {0}{1}'.format(
-            ns.get_uri(), path, perm, owner)
-        run_dfs_command(cluster=cluster, cmd=cmd)
-
-
-def make_home_dirs(cluster):
-    """
-    Create a homedir for service users in each namespace.
-    :param cluster:
-    :return:
-    """
-    for user in cluster.get_service_users():
-        make_hdfs_dir(cluster, '/home/{}'.format(user.name), 700, owner=user.name)
+    pid_dir = cluster.get_hadoop_pid_dir()
+    sudo('mkdir -p {}'.format(pid_dir))
+    sudo('chgrp {} {}'.format(constants.HADOOP_GROUP, pid_dir))
+    sudo('chmod 775 {}'.format(pid_dir))
+    return True
 
 
 def deploy_tez(cluster):
     """
     Run steps to deploy Apache Tez on the cluster.
     """
-    result = execute(run_dfs_command, cluster=cluster,
-                     cmd='hadoop fs -mkdir -p /apps/{0} && hadoop fs -chmod 755 /apps && '
-                         'hadoop fs -put {1} /apps/{0} && '
-                         'hadoop fs -chown -R tez /apps/{0} && hadoop fs -chgrp -R hadoop /apps/{0}'.format(
-                            cluster.get_tez_distro_name(),
-                            get_tarball_destination(cluster.get_config(constants.KEY_TEZ_TARBALL))))
+    if not publish_tez_tarball(cluster):
+        get_logger().error("Failed to publish the Tez tarball to HDFS.")
+        return False
+    return True
 
 
 if __name__ == '__main__':
@@ -24,3 +24,6 @@ class PrincipalException(Exception):
 class KerberosConfigError(Exception):
     pass
 
+
+class WebHdfsError(Exception):
+    pass
@@ -13,12 +13,20 @@
 # limitations under the License.
 
 import re
+from collections import OrderedDict
 from urllib import parse as url_parser
 
+from bman.constants import DEFAULT_NAMENODE_HTTP_PORT, DEFAULT_NAMENODE_RPC_PORT, \
+    DEFAULT_JOURNALNODE_RPC_PORT
 from bman.exceptions import ConfigurationError
 from bman.logger import get_logger
 
 
+def unique(items):
+    """ :return: the distinct items, in the order they were first seen. """
+    return list(OrderedDict.fromkeys(items))
+
+
 class HdfsMasterConfigs:
     """
     This class is used to parse and store NameNode configuration for all of the
@@ -39,6 +47,15 @@ class HdfsMasterConfigs:
 
         self.snn_dirs = self.init_snn_dirs(config_values)
 
+        # The nameservices do not change after parsing, so collect the
+        # hosts and directories of all of them once.
+        self.nn_configs = tuple(nn for ns in self.nameservices for nn in ns.nn_configs)
+        self.nn_hosts = tuple(unique(nn.hostname for nn in self.nn_configs))
+        self.jn_hosts = tuple(unique(host for ns in self.nameservices for host in ns.jn_hosts))
+        self.snn_hosts = tuple(unique(host for ns in self.nameservices for host in ns.snn_hosts))
+        self.nn_dirs = tuple(d for nn in self.nn_configs for d in nn.dirs)
+        self.jn_dirs = tuple(unique(d for ns in self.nameservices for d in ns.jn_edits_dirs))
+
     def parse_nameservices(self, values):
         """
         Extract HA config from the given key-value pairs which represent
@@ -59,54 +76,48 @@ class HdfsMasterConfigs:
             return
 
     def get_nn_hosts(self):
-        all_nn_configs = []
-        for ns in self.nameservices:
-            all_nn_configs += ns.nn_configs
-        return list({x.hostname for x in all_nn_configs})
+        return list(self.nn_hosts)
 
     def get_jn_hosts(self):
-        all_jn_hosts = []
-        for ns in self.nameservices:
-            all_jn_hosts += ns.jn_hosts
-        return list(set(all_jn_hosts))
+        return list(self.jn_hosts)
+
+    def get_nn_configs(self):
+        """Return the NameNodeInfo objects for all NameNodes in all nameservices."""
+        return list(self.nn_configs)
 
     def get_snn_hosts(self):
-        all_snn_hosts = []
-        for ns in self.nameservices:
-            all_snn_hosts += ns.snn_hosts
-        return list(set(all_snn_hosts))
+        return list(self.snn_hosts)
 
-    def choose_active_nns(self):
+    def choose_active_nn_configs(self):
         # Arbitrarily choose one NN in each namespace as the active.
         # Currently we choose the NN whose hostname is first in lexical order.
         active_nns = []
         for ns in self.nameservices:
             active_nns += ns.choose_active_nn()
-        return [x.hostname for x in active_nns]
+        return active_nns
 
-    def choose_standby_nns(self):
+    def choose_standby_nn_configs(self):
         # Arbitrarily choose one NN in each namespace as the standby.
         # Currently we choose the NN whose hostname is second in lexical order.
         standby_nns = []
         for ns in self.nameservices:
             standby_nns += ns.choose_standby_nns()
-        return [x.hostname for x in standby_nns]
+        return standby_nns
+
+    def choose_active_nns(self):
+        return [x.hostname for x in self.choose_active_nn_configs()]
+
+    def choose_standby_nns(self):
+        return [x.hostname for x in self.choose_standby_nn_configs()]
 
     def get_nn_dirs(self):
-        dirs = []
-        for ns in self.nameservices:
-            for nn in ns.nn_configs:
-                dirs += nn.dirs
-        return dirs
+        return list(self.nn_dirs)
 
     def get_snn_dirs(self):
         return self.snn_dirs
 
     def get_jn_dirs(self):
-        jn_dirs = []
-        for ns in self.nameservices:
-            jn_dirs += ns.jn_edits_dirs
-        return list(set(jn_dirs))
+        return list(self.jn_dirs)
 
     @staticmethod
     def init_snn_dirs(config_values):
@@ -136,6 +147,8 @@ class NameNodeInfo:
         self.hostname = hostname
         self.dirs = []
         self.dirs = self.parse_nn_dirs(values)
+        self.rpc_port = self.parse_rpc_port(values)
+        self.http_address = self.parse_http_address(values)
 
     def __lt__(self, other):
         return self.hostname < other.hostname
@@ -157,12 +170,45 @@ class NameNodeInfo:
                 break
         return dirs
 
+    def get_address_keys(self, base_key):
+        """
+        Return the candidate keys for a per-NameNode address setting, most
+        specific first.
+        """
+        return ['{}.{}.{}'.format(base_key, self.ns_id, self.nn_id),
+                '{}.{}'.format(base_key, self.ns_id),
+                base_key]
+
+    def parse_rpc_port(self, values):
+        for conf_key in self.get_address_keys('dfs.namenode.rpc-address'):
+            if conf_key in values and ':' in values[conf_key]:
+                return int(values[conf_key].split(':')[1])
+        if 'fs.defaultFS' in values:
+            fs_url = url_parser.urlparse(values['fs.defaultFS'])
+            if fs_url.port and fs_url.hostname == self.hostname:
+                return fs_url.port
+        return DEFAULT_NAMENODE_RPC_PORT
+
+    def parse_http_address(self, values):
+        for conf_key in self.get_address_keys('dfs.namenode.http-address'):
+            if conf_key in values and ':' in values[conf_key]:
+                # The configured host may be a wildcard address. Always use the
+                # NameNode's hostname to reach it.
+                return '{}:{}'.format(self.hostname, values[conf_key].split(':')[1])
+        return '{}:{}'.format(self.hostname, DEFAULT_NAMENODE_HTTP_PORT)
+
     def get_id(self):
         return self.nn_id
 
     def get_hostname(self):
         return self.hostname
 
+    def get_rpc_port(self):
+        return self.rpc_port
+
+    def get_http_address(self):
+        return self.http_address
+
 
 class NameService(object):
     """
@@ -172,6 +218,7 @@ class NameService(object):
         self.nsid = nsid if nsid else 'pseudo'  # Our nameserviceId
         self.nn_configs = []
         self.jn_hosts = []
+        self.jn_addresses = []  # (hostname, rpc port) tuples.
         self.snn_hosts = []  # Secondary NameNodes are valid for non-HA nameservices only.
         self.jn_edits_dirs = []
         self.need_snn_config = False
@@ -209,13 +256,23 @@ class NameService(object):
             hosts.add(host.split(':')[0])
         return list(hosts)
 
+    @staticmethod
+    def get_jn_addresses_from_key(value):
+        pattern = re.compile('^qjournal://([^/]+)/.+$', re.IGNORECASE)
+        addresses = set()
+        for address in pattern.match(value).group(1).split(';'):
+            parts = address.split(':')
+            port = int(parts[1]) if len(parts) > 1 else DEFAULT_JOURNALNODE_RPC_PORT
+            addresses.add((parts[0], port))
+        return sorted(addresses)
+
     def init_snn_nodes(self, values):
         if self.nsid.lower() == 'pseudo':
             snn_host_key = 'dfs.namenode.secondary.http-address'
         else:
             snn_host_key = 'dfs.namenode.secondary.http-address.{}'.format(self.nsid)
         if snn_host_key in values:
-            self.snn_hosts = [values[snn_host_key]]
+            self.snn_hosts = [values[snn_host_key].split(':')[0]]
         else:
             # Else collocate with the primary NN
             # TODO: it will be better to pick a non-NN host here but that is complex.
@@ -255,6 +312,9 @@ class NameService(object):
     def get_nn_configs(self):
         return self.nn_configs
 
+    def get_jn_addresses(self):
+        return self.jn_addresses
+
     def get_uri(self):
         if self.is_ha():
             return 'hdfs://{}'.format(self.nsid)
@@ -290,6 +350,7 @@ class NameService(object):
             jn_key = 'dfs.namenode.shared.edits.dir'
         if jn_key in values:
             self.jn_hosts = self.get_jn_hosts_from_key(values[jn_key])
+            self.jn_addresses = self.get_jn_addresses_from_key(values[jn_key])
 
         # Initialize the JournalNode edits directories.
         if self.jn_hosts:
@@ -0,0 +1,220 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provisioning of the initial HDFS namespace, e.g. /tmp, user home
+directories and the Tez tarball.
+
+The directories are described declaratively as (path, mode, owner, group)
+tuples. Each nameservice gets one script that logs in once and applies all
+paths with a handful of 'hadoop fs' invocations: a single -mkdir for every
+path, then one -chmod per distinct mode and one -chown per distinct owner.
+All nameservices are provisioned in parallel, each from one of its own
+NameNodes. With UseWebHdfs the same paths are applied over WebHDFS directly
+from the bman host instead.
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from fabric.api import task, sudo, execute, env, settings
+from fabric.decorators import parallel
+
+import bman.constants as constants
+from bman.logger import get_logger
+from bman.utils import get_kinit_command, is_true, get_md5, get_tarball_destination
+from bman.webhdfs import get_webhdfs_client
+
+
+def get_namespace_paths(cluster):
+    """
+    Return the (path, mode, owner, group) tuples for the initial namespace:
+    the default directories, a home directory for each service user and any
+    HdfsPaths from the config file. A group of None leaves the group as is.
+    """
+    paths = [('/tmp', '1777', constants.HDFS_USER, None),
+             ('/apps', '755', constants.HDFS_USER, None),
+             ('/home', '755', constants.HDFS_USER, None)]
+    for user in cluster.get_service_users():
+        paths.append(('/home/{}'.format(user.name), '700', user.name, None))
+    for entry in cluster.get_config(constants.KEY_HDFS_PATHS):
+        paths.append((entry['path'], str(entry.get('mode', '755')),
+                      entry.get('owner', constants.HDFS_USER), entry.get('group')))
+    return paths
+
+
+def get_namespace_commands(paths, uri=''):
+    """
+    Commands that create the given paths and set their permissions and
+    owners. Paths with the same mode or owner share one invocation.
+
+    :param uri: filesystem URI prepended to each path, or '' to use the
+                default filesystem.
+    """
+    modes = OrderedDict()
+    owners = OrderedDict()
+    for path, mode, owner, group in paths:
+        modes.setdefault(mode, []).append(uri + path)
+        owners.setdefault(owner + (':' + group if group else ''), []).append(uri + path)
+
+    commands = ['hadoop fs -mkdir -p {}'.format(' '.join(uri + p[0] for p in paths))]
+    commands += ['hadoop fs -chmod {} {}'.format(mode, ' '.join(targets)) for mode, targets in modes.items()]
+    commands += ['hadoop fs -chown {} {}'.format(owner, ' '.join(targets)) for owner, targets in owners.items()]
+    return commands
+
+
+def get_nameservice_scripts(cluster, get_commands):
+    """
+    Build one script per nameservice that logs in once and runs the
+    commands returned by get_commands(uri).
+
+    :return: dict mapping the NameNode host that runs a script -> script.
+    """
+    nameservices = cluster.get_hdfs_master_config().get_nameservices()
+    scripts = {}
+    for ns in nameservices:
+        # A single namespace may be a pseudo-namespace for a non-HA,
+        # non-federated cluster, so don't specify it explicitly.
+        uri = ns.get_uri() if len(nameservices) > 1 else ''
+        host = sorted(ns.get_nn_configs())[0].get_hostname()
+        scripts.setdefault(host, []).extend(get_commands(uri))
+
+    login = [get_kinit_command(cluster)] if cluster.is_kerberized() else []
+    logout = ['kdestroy'] if cluster.is_kerberized() else []
+    return {host: ' && '.join(login + commands + logout) for host, commands in scripts.items()}
+
+
+@task
+@parallel
+def run_nameservice_script(scripts=None):
+    get_logger().debug("Running HDFS commands from {}".format(env.host))
+    with settings(warn_only=True):
+        return sudo(scripts[env.host], user=constants.HDFS_USER).succeeded
+
+
+def run_in_nameservices(cluster, get_commands, description):
+    """
+    Run the commands returned by get_commands(uri) against every
+    nameservice, in parallel from one NameNode of each.
+
+    :return: True if the commands succeeded in all nameservices.
+    """
+    scripts = get_nameservice_scripts(cluster, get_commands)
+    results = execute(run_nameservice_script, hosts=sorted(scripts), scripts=scripts)
+    failed = sorted(host for host, success in results.items() if not success)
+    if failed:
+        get_logger().error("Failed to {} from {}".format(description, ', '.join(failed)))
+        return False
+    return True
+
+
+def run_in_nameservices_webhdfs(cluster, fn, description):
+    """
+    Call fn(client) with a WebHdfsClient for every nameservice, in parallel
+    threads on this host.
+
+    :return: True if fn succeeded for all nameservices.
+    """
+    nameservices = cluster.get_hdfs_master_config().get_nameservices()
+    with ThreadPoolExecutor(max_workers=len(nameservices)) as pool:
+        futures = {ns.get_id(): pool.submit(fn, get_webhdfs_client(cluster, ns)) for ns in nameservices}
+    failed = []
+    for nsid, future in sorted(futures.items()):
+        if future.exception():
+            get_logger().error("Failed to {} in {}: {}".format(description, nsid, future.exception()))
+            failed.append(nsid)
+    return not failed
+
+
+def provision_namespace_webhdfs(client, paths):
+    for path, mode, owner, group in paths:
+        client.mkdirs(path)
+        client.set_permission(path, mode)
+        client.set_owner(path, owner=owner, group=group)
+
+
+def provision_namespaces(cluster, paths=None):
+    """
+    Create the given HDFS paths in every nameservice, in parallel.
+
+    :param paths: (path, mode, owner, group) tuples. Defaults to
+                  get_namespace_paths(cluster).
+    :return: True if all nameservices were provisioned.
+    """
+    paths = paths if paths is not None else get_namespace_paths(cluster)
+    get_logger().info("Creating {} HDFS directories in {} nameservices".format(
+        len(paths), len(cluster.get_hdfs_master_config().get_nameservices())))
+    if is_true(cluster.get_config(constants.KEY_USE_WEBHDFS)):
+        return run_in_nameservices_webhdfs(
+            cluster, lambda client: provision_namespace_webhdfs(client, paths), 'create HDFS directories')
+    return run_in_nameservices(cluster, lambda uri: get_namespace_commands(paths, uri),
+                               'create HDFS directories')
+
+
+def get_publish_tez_commands(cluster, local_file, md5, uri=''):
+    """
+    Command that uploads the Tez tarball unless the HDFS copy is tagged
+    with the MD5 of the local tarball.
+    """
+    lib_dir = uri + os.path.dirname(cluster.get_tez_lib_path())
+    dest = uri + cluster.get_tez_lib_path()
+    xattr = '{}="{}"'.format(constants.TEZ_LIB_MD5_XATTR, md5)
+    return ['if hadoop fs -getfattr -n {x} -e text {dest} 2>/dev/null | grep -qx \'{xattr}\'; then '
+            'echo "{dest} is up to date"; else '
+            'hadoop fs -mkdir -p {dir} && hadoop fs -chmod 755 {uri}/apps && '
+            'hadoop fs -D dfs.replication={r} -put -f {local} {dest} && '
+            'hadoop fs -setfattr -n {x} -v {md5} {dest} && '
+            'hadoop fs -chown -R {owner} {dir}; fi'.format(
+                x=constants.TEZ_LIB_MD5_XATTR, xattr=xattr, dest=dest, dir=lib_dir, uri=uri, md5=md5,
+                r=cluster.get_tez_lib_replication(), local=local_file,
+                owner='{}:{}'.format(constants.TEZ_USER, constants.HADOOP_GROUP))]
+
+
+def publish_tez_webhdfs(cluster, client, md5):
+    path = cluster.get_tez_lib_path()
+    if client.get_xattr(path, constants.TEZ_LIB_MD5_XATTR) == md5:
+        get_logger().debug("{} is up to date".format(path))
+        return
+    client.mkdirs(os.path.dirname(path))
+    client.set_permission('/apps', '755')
+    client.upload(cluster.get_config(constants.KEY_TEZ_TARBALL), path,
+                  replication=cluster.get_tez_lib_replication())
+    client.set_xattr(path, constants.TEZ_LIB_MD5_XATTR, md5)
+    for p in (os.path.dirname(path), path):
+        client.set_owner(p, owner=constants.TEZ_USER, group=constants.HADOOP_GROUP)
+
+
+def publish_tez_tarball(cluster):
+    """
+    Publish the Tez tarball to every nameservice in parallel, with a higher
+    replication so that many NodeManagers can localize it at once. The
+    upload is skipped where the HDFS copy already matches the local tarball.
+
+    :return: True if every nameservice has a current copy.
+    """
+    md5 = get_md5(cluster.get_config(constants.KEY_TEZ_TARBALL), True)
+    get_logger().info("Publishing {} to {} nameservices".format(
+        cluster.get_tez_lib_path(), len(cluster.get_hdfs_master_config().get_nameservices())))
+    if is_true(cluster.get_config(constants.KEY_USE_WEBHDFS)):
+        return run_in_nameservices_webhdfs(
+            cluster, lambda client: publish_tez_webhdfs(cluster, client, md5), 'publish Tez')
+    # deploy_tez_tarball has already copied the tarball to every host.
+    local_file = get_tarball_destination(cluster.get_config(constants.KEY_TEZ_TARBALL))
+    return run_in_nameservices(cluster, lambda uri: get_publish_tez_commands(cluster, local_file, md5, uri),
+                               'publish Tez')
+
+
+if __name__ == '__main__':
+    pass
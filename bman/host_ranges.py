@@ -0,0 +1,109 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact host lists for large inventories.
+
+A host list entry is either a hostname, a range expression or an include
+file. A range expression has one or more bracketed numeric ranges, e.g.
+dn[0001-2000].rack[1-40].example.com, and expands to every combination.
+A range may list several comma separated numbers and intervals, e.g.
+[1-3,7]. Leading zeros of the start of an interval set the width of its
+numbers. An include file is given as {include: path} and has one hostname
+or range expression per line. Blank lines and '#' comments are skipped.
+Relative paths are resolved against the directory of the config file.
+
+Hosts are generated one at a time, so the full list is only built once,
+by whoever consumes it.
+"""
+
+import itertools
+import os
+import re
+
+from bman.exceptions import ConfigurationError
+
+RANGE_PATTERN = re.compile(r'\[([^\[\]]*)\]')
+INTERVAL_PATTERN = re.compile(r'^(\d+)(?:-(\d+))?$')
+KEY_INCLUDE = 'include'
+
+
+def parse_range(text, expression):
+    """ :return: the numbers of one bracketed range, as strings. """
+    numbers = []
+    for interval in text.split(','):
+        match = INTERVAL_PATTERN.match(interval.strip())
+        if not match:
+            raise ConfigurationError("Bad range [{}] in host expression {}".format(text, expression))
+        start, end = match.group(1), match.group(2) or match.group(1)
+        if int(end) < int(start):
+            raise ConfigurationError("Descending range [{}] in host expression {}".format(text, expression))
+        width = len(start) if start.startswith('0') else 0
+        numbers.extend(str(n).zfill(width) for n in range(int(start), int(end) + 1))
+    return numbers
+
+
+def expand_host_range(expression):
+    """
+    Generate the hostnames of a range expression. A plain hostname yields
+    itself.
+    """
+    parts = RANGE_PATTERN.split(expression.strip())
+    for literal in parts[::2]:
+        if '[' in literal or ']' in literal:
+            raise ConfigurationError("Unbalanced brackets in host expression {}".format(expression))
+    choices = [parse_range(part, expression) if i % 2 else [part] for i, part in enumerate(parts)]
+    for combination in itertools.product(*choices):
+        yield ''.join(combination)
+
+
+def get_include_path(entry, base_dir):
+    return os.path.join(base_dir, os.path.expanduser(str(entry[KEY_INCLUDE])))
+
+
+def get_include_files(entries, base_dir):
+    """ :return: the paths of the include files in a host list. """
+    return [get_include_path(e, base_dir) for e in entries or [] if isinstance(e, dict)]
+
+
+def read_include_file(path):
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    yield line
+    except IOError as e:
+        raise ConfigurationError("Cannot read host include file {}: {}".format(path, e))
+
+
+def iter_hosts(entries, base_dir=''):
+    """
+    Generate the hostnames of a host list. entries may also be a single
+    hostname or range expression.
+    """
+    if isinstance(entries, str):
+        entries = [entries]
+    for entry in entries or []:
+        if isinstance(entry, dict):
+            if set(entry) != {KEY_INCLUDE}:
+                raise ConfigurationError("Unknown host list entry {}".format(entry))
+            for line in read_include_file(get_include_path(entry, base_dir)):
+                yield from expand_host_range(line)
+        else:
+            yield from expand_host_range(str(entry))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,133 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An index of the daemon roles of every cluster host.
+
+The index is built once when the config is loaded and never changes
+afterwards. Looking up the hosts of a role or the roles of a host is a
+dict lookup, so callers need not rebuild host lists from the nameservices.
+"""
+
+from array import array
+from collections import OrderedDict
+
+# Role names. These match the jps main class name of each daemon.
+ROLE_NAMENODE = 'NameNode'
+ROLE_SECONDARY_NAMENODE = 'SecondaryNameNode'
+ROLE_JOURNALNODE = 'JournalNode'
+ROLE_DATANODE = 'DataNode'
+ROLE_RESOURCEMANAGER = 'ResourceManager'
+ROLE_NODEMANAGER = 'NodeManager'
+
+ALL_ROLES = [ROLE_NAMENODE, ROLE_SECONDARY_NAMENODE, ROLE_JOURNALNODE,
+             ROLE_DATANODE, ROLE_RESOURCEMANAGER, ROLE_NODEMANAGER]
+
+
+class HostRecord(object):
+    """ The roles of one host. """
+
+    __slots__ = ('hostname', 'roles')
+
+    def __init__(self, hostname, roles):
+        self.hostname = hostname
+        self.roles = roles
+
+    def __repr__(self):
+        return '{} {}'.format(self.hostname, sorted(self.roles))
+
+
+class HostRoleIndex(object):
+    """
+    Maps hosts to roles and roles to hosts. Hosts are kept in the order they
+    were first seen.
+    """
+
+    __slots__ = ('records', 'role_hosts', 'all_hosts')
+
+    def __init__(self, role_hosts):
+        """
+        :param role_hosts: (role, hostnames) pairs. A host may have any number
+                           of roles, and a role may be given more than once.
+                           The role may also be a tuple of roles that all
+                           the hosts have, so that hostnames can be an
+                           iterator that is consumed once.
+        """
+        roles_by_host = OrderedDict()
+        hosts_by_role = OrderedDict()
+        # Most hosts have the same few role combinations, so they share
+        # one frozenset each.
+        shared_roles = {}
+        combined_roles = {}
+        no_roles = frozenset()
+        for roles, hosts in role_hosts:
+            roles = frozenset((roles,) if isinstance(roles, str) else roles)
+            role_sets = [hosts_by_role.setdefault(role, OrderedDict()) for role in roles]
+            for host in hosts:
+                for role_set in role_sets:
+                    role_set[host] = None
+                current = roles_by_host.get(host, no_roles)
+                combined = combined_roles.get((current, roles))
+                if combined is None:
+                    combined = shared_roles.setdefault(current | roles, current | roles)
+                    combined_roles[(current, roles)] = combined
+                roles_by_host[host] = combined
+
+        self.records = {host: HostRecord(host, roles) for host, roles in roles_by_host.items()}
+        # Roles with the same hosts, e.g. DataNode and NodeManager, share
+        # one tuple.
+        shared_hosts = {}
+        self.role_hosts = {}
+        for role, hosts in hosts_by_role.items():
+            hosts = tuple(hosts)
+            self.role_hosts[role] = shared_hosts.setdefault(hosts, hosts)
+        self.all_hosts = tuple(roles_by_host)
+
+    def __getstate__(self):
+        # Pickle the role combinations once and one small number per host
+        # instead of a record object per host.
+        combinations = list(OrderedDict.fromkeys(record.roles for record in self.records.values()))
+        numbers = {roles: i for i, roles in enumerate(combinations)}
+        codes = array('I', (numbers[self.records[host].roles] for host in self.all_hosts))
+        return self.role_hosts, self.all_hosts, combinations, codes
+
+    def __setstate__(self, state):
+        self.role_hosts, self.all_hosts, combinations, codes = state
+        self.records = {host: HostRecord(host, combinations[code])
+                        for host, code in zip(self.all_hosts, codes)}
+
+    def __len__(self):
+        return len(self.all_hosts)
+
+    def __contains__(self, host):
+        return host in self.records
+
+    def get_all_hosts(self):
+        return self.all_hosts
+
+    def get_hosts(self, role):
+        """ :return: a tuple of the hosts with the given role. """
+        return self.role_hosts.get(role, ())
+
+    def get_roles(self, host):
+        """ :return: a frozenset of the roles of host, empty if it is not in the cluster. """
+        record = self.records.get(host)
+        return record.roles if record else frozenset()
+
+    def has_role(self, host, role):
+        return role in self.get_roles(host)
+
+
+if __name__ == '__main__':
+    pass
@@ -13,12 +13,18 @@
 # limitations under the License.
 
 import glob
+import io
 import os
 import re
+import shutil
+import tarfile
+import tempfile
+from collections import defaultdict, OrderedDict
 
+from fabric.context_managers import hide, settings
 from fabric.contrib.files import exists
-from fabric.decorators import task
-from fabric.operations import sudo, put
+from fabric.decorators import task, parallel
+from fabric.operations import sudo, run, put, get
 from fabric.state import env
 from fabric.tasks import execute
 from pkg_resources import resource_filename
@@ -27,13 +33,12 @@ from bman.constants import *
 from bman.exceptions import *
 from bman.kerberos_config_manager import make_principal_configuration
 from bman.logger import get_logger
-from bman.utils import copy, run_cmd, fast_copy
+from bman.utils import copy
 
-KEY_KADMIN_SERVER = 'KadminServer'
-KEY_KADMIN_PRINCIPAL = 'KadminPrincipal'
-KEY_KADMIN_PASSWORD = 'KadminPassword'
+KEYTAB_BUNDLE_CIPHER = '-aes-256-cbc -md sha256'  # Also understood by OpenSSL 1.0.x on Centos 7.
 
 HOST_SUBSTITUTION_PATTERN = '_HOST'
+KADMIN_PROMPT_PATTERN = re.compile(r'^\s*kadmin(\.local)?:\s*')
 
 
 class KadminUtil(object):
@@ -47,136 +52,430 @@ class KadminUtil(object):
         self.kadmin_password = cluster.get_config(KEY_KADMIN_PASSWORD)
         self.cluster = cluster
 
-    def get_get_principal_command(self, principal):
-        return 'kadmin -s {} -p {} -w {} get_principal {}'.format(
-            self.kadmin_server, self.kadmin_principal, self.kadmin_password, principal)
+    def get_kadmin_command(self):
+        return 'kadmin -s {} -p {} -w {}'.format(
+            self.kadmin_server, self.kadmin_principal, self.kadmin_password)
 
-    def get_create_principal_command(self, principal):
-        return 'kadmin -s {} -p {} -w {} add_principal -randkey {}'.format(
-            self.kadmin_server, self.kadmin_principal, self.kadmin_password, principal)
-
-    def export_keytab_command(self, principal, keytab_file):
-        return 'kadmin -s {} -p {} -w {} ktadd -k {} {}'.format(
-            self.kadmin_server, self.kadmin_principal, self.kadmin_password,
-            keytab_file, principal)
+    def make_batch(self):
+        return KadminBatch(self.get_kadmin_command(), self.cluster.get_config(KEY_KADMIN_BATCH_SIZE))
 
     def get_default_realm(self):
         return re.sub('^.*@', '', self.cluster.get_site_setting(
             'dfs.namenode.kerberos.principal'))
 
 
-def make_headless_principals(cluster):
-    kadmin_util = KadminUtil(cluster)
-    for user in cluster.get_service_users():
-        make_headless_principal(cluster, kadmin_util, user)
+class KadminBatch(object):
+    """
+    Queues kadmin queries and runs them through as few kadmin sessions as
+    possible. Each session authenticates once and reads up to batch_size
+    queries from stdin, and sessions in one script run one after another.
+    """
 
+    def __init__(self, kadmin_command, batch_size=DEFAULT_KADMIN_BATCH_SIZE):
+        self.kadmin_command = kadmin_command
+        self.batch_size = int(batch_size)
+        self.queries = []
 
-def do_kerberos_install(cluster=None):
+    def add_principal(self, principal):
+        self.queries.append('add_principal -randkey {}'.format(principal))
 
-    get_logger().info("Installing jsvc and Linux container executor on all cluster hosts")
-    copy_jce_policy_files(cluster)
-    execute(install_jsvc, hosts=cluster.get_all_hosts())
-    execute(install_container_executor, hosts=cluster.get_all_hosts(), cluster=cluster)
-    make_headless_principals(cluster)
-    generate_hdfs_principals_and_keytabs(cluster=cluster)
+    def get_principal(self, principal):
+        self.queries.append('get_principal {}'.format(principal))
 
+    def list_principals(self):
+        self.queries.append('list_principals')
 
-def make_headless_principal(cluster=None, kadmin_util=None, user=None):
+    def ktadd(self, keytab_file, principal):
+        self.queries.append('ktadd -k {} {}'.format(keytab_file, principal))
+
+    def get_script(self):
+        sessions = []
+        for i in range(0, len(self.queries), self.batch_size):
+            sessions.append("{} <<'BMAN_EOF'\n{}\nBMAN_EOF".format(
+                self.kadmin_command, '\n'.join(self.queries[i:i + self.batch_size])))
+        return '\n'.join(sessions)
+
+
+def get_kadmin_errors(output):
     """
-    Create a headless principal and keytab.
+    kadmin reports failed queries as '<query>: <message> while <context>'
+    and carries on with the next query. Creating a principal that already
+    exists is not an error.
     """
-    if not cluster.has_site_setting('dfs.namenode.kerberos.principal'):
-        # Not a kerberised cluster, potentially.
-        return
+    return [line.strip() for line in output.splitlines()
+            if ' while ' in line and 'already exists' not in line]
 
-    if not kadmin_util:
-        kadmin_util = KadminUtil(cluster)
 
-    realm = kadmin_util.get_default_realm()
-    keytab_dir = os.path.dirname(cluster.get_site_setting('dfs.namenode.keytab.file'))
-    keytab_file = os.path.join(keytab_dir, '{}.headless.keytab'.format(user.name))
+def parse_principal_kvnos(output):
+    """
+    Parse the output of a batch of get_principal queries.
 
-    one_nn = cluster.get_hdfs_master_config().get_nn_hosts()[0:1]
+    :return: dict mapping principal -> highest key version number.
+    """
+    kvnos = {}
+    principal = None
+    for line in output.splitlines():
+        fields = line.replace(',', ' ').split()
+        if 'Principal:' in fields:
+            principal = fields[fields.index('Principal:') + 1]
+        elif principal and fields[:2] == ['Key:', 'vno'] and fields[2].isdigit():
+            kvnos[principal] = max(int(fields[2]), kvnos.get(principal, 0))
+    return kvnos
 
-    # The headless principal can be created on any host. Just use any one NameNode.
-    execute(make_principal, hosts=one_nn,
-            kadmin_util=kadmin_util, principal='{}@{}'.format(user.name, realm))
 
-    # Now export a keytab on the same host.
-    execute(export_keytab, hosts=one_nn,
-            kadmin_util=kadmin_util, principal='{}@{}'.format(user.name, realm),
-            keytab_file=keytab_file, keytab_file_owner=user.name,
-            keytab_file_group=user.group,
-            keytab_perms='600')
+def parse_principal_list(output):
+    """ :return: the set of principals in the output of list_principals. """
+    # Without a terminal, kadmin prints its prompt before the first line of output.
+    lines = (KADMIN_PROMPT_PATTERN.sub('', line).strip() for line in output.splitlines())
+    return {line for line in lines if '@' in line and ' ' not in line}
 
-    # Now copy the keytab to each remaining host. Don't regenerate the keytab
-    # multiple times
-    get_logger().info("Distributing {} to all cluster nodes.".format(keytab_file))
-    targets = set(cluster.get_all_hosts()).symmetric_difference(one_nn)
-    execute(run_cmd, hosts=targets,
-            cmd_string='mkdir -p {0} && chmod 755 {0}'.format(keytab_dir))
-    execute(fast_copy, hosts=one_nn, cluster=cluster, remote_file=keytab_file)
-    execute(run_cmd, hosts=targets,
-            cmd_string='chown {0}.{1} {2} && chmod 600 {2}'.format(
-                user.name, user.group, keytab_file))
 
+def get_keytab_kvnos_command(keytab_files):
+    """ Command that prints 'keytab kvno principal' for every key in the given keytabs. """
+    return ('for k in {}; do [ -f "$k" ] && klist -kt "$k" 2>/dev/null | '
+            'awk -v k="$k" \'$1 ~ /^[0-9]+$/ {{print k, $1, $NF}}\'; done; true'.format(' '.join(keytab_files)))
 
-def generate_hdfs_principals_and_keytabs(cluster=None):
+
+def parse_keytab_kvnos(lines):
     """
-    Generate HDFS principals and keytabs on all hosts.
-    :param cluster:
-    :return:
+    Parse the output of get_keytab_kvnos_command.
+
+    :return: dict mapping (keytab, principal) -> highest KVNO.
     """
-    kadmin_util = KadminUtil(cluster)
-    principal_configs = make_principal_configuration(cluster)
+    kvnos = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 3 and fields[1].isdigit():
+            key = (fields[0], fields[2])
+            kvnos[key] = max(int(fields[1]), kvnos.get(key, 0))
+    return kvnos
 
-    for pc in principal_configs:
-        # Ensure that kerberos config exists for this service.
-        if pc.hosts and cluster.has_site_setting(pc.principal_key):
-            principal = cluster.get_site_setting(pc.principal_key)
-            execute(make_principal, hosts=pc.hosts, kadmin_util=kadmin_util, principal=principal)
-            if cluster.has_site_setting(pc.keytab_file_key):
-                keytab_file = cluster.get_site_setting(pc.keytab_file_key)
-                execute(export_keytab, hosts=pc.hosts, kadmin_util=kadmin_util,
-                        principal=principal, keytab_file=keytab_file,
-                        keytab_file_owner=pc.keytab_file_owner,
-                        keytab_file_group=pc.keytab_file_group,
-                        keytab_perms=pc.keytab_perms)
+
+@task
+@parallel
+def get_host_keytab_kvnos(keytab_files=None):
+    """ Read the KVNOs of this host's keytabs in one remote command. """
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_keytab_kvnos_command(keytab_files[env.host]), pty=False)
+    return parse_keytab_kvnos(result.stdout.splitlines())
 
 
 @task
-def make_principal(kadmin_util=None, principal=None):
+def get_kadmin_output(script=None):
+    with hide('everything'), settings(warn_only=True):
+        return sudo(script, pty=False).stdout
+
+
+def list_principals(cluster):
+    """ :return: the set of all principals in the realm, read with a single query. """
+    batch = KadminUtil(cluster).make_batch()
+    batch.list_principals()
+    factory = cluster.get_config(KEY_KEYTAB_FACTORY_HOST)
+    return parse_principal_list(execute(get_kadmin_output, hosts=[factory], script=batch.get_script())[factory])
+
+
+def get_kdc_kvnos(cluster, principals):
     """
-    Create a principal via kadmin, substituting _HOST in the principal name with the current
-    hostname.
+    Look up the current KVNO of each principal in the KDC with a single
+    kadmin batch from the keytab factory host.
+
+    :return: dict mapping principal -> KVNO. Missing principals are omitted.
     """
-    principal = principal.replace(HOST_SUBSTITUTION_PATTERN, env.host)
+    batch = KadminUtil(cluster).make_batch()
+    for principal in sorted(set(principals)):
+        batch.get_principal(principal)
+    if not batch.queries:
+        return {}
+    factory = cluster.get_config(KEY_KEYTAB_FACTORY_HOST)
+    return parse_principal_kvnos(execute(get_kadmin_output, hosts=[factory], script=batch.get_script())[factory])
 
-    get_logger().debug(" >> Creating principal {} on host {}".format(principal, env.host))
-    cmd = kadmin_util.get_create_principal_command(principal)
-    result = sudo(cmd, warn_only=True, quiet=True)
-    if result.failed:
-        # Failure is okay if the principal already exists.
-        result2 = sudo(kadmin_util.get_get_principal_command(principal), warn_only=True)
-        if result2.failed:
-            raise PrincipalException(result)
+
+@task
+def run_kadmin_script(script=None):
+    """ :return: the errors reported by kadmin while running script. """
+    get_logger().debug(" >> Running kadmin script on host {}".format(env.host))
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(script, pty=False)
+    errors = get_kadmin_errors(result.stdout)
+    if result.failed and not errors:
+        errors.append(result.stdout.strip() or 'exit code {}'.format(result.return_code))
+    return errors
+
+
+def run_on_keytab_factory(cluster, script, description):
+    """
+    Run a kadmin script on the keytab factory host, the only host that
+    talks to kadmin.
+
+    :return: True if no kadmin query failed.
+    """
+    factory = cluster.get_config(KEY_KEYTAB_FACTORY_HOST)
+    errors = execute(run_kadmin_script, hosts=[factory], script=script)[factory]
+    for error in errors:
+        get_logger().error("Failed to {} on {}: {}".format(description, factory, error))
+    return not errors
+
+
+def create_principals(cluster, principals):
+    """
+    Create the given principals with a single batch from the keytab
+    factory host. Principals that already exist are left as they are.
+    """
+    batch = KadminUtil(cluster).make_batch()
+    for principal in sorted(set(principals)):
+        batch.add_principal(principal)
+    if not batch.queries:
+        return True
+    get_logger().info("Creating {} principals".format(len(batch.queries)))
+    return run_on_keytab_factory(cluster, batch.get_script(), 'create principals')
+
+
+def put_bundle_key(bundle_key):
+    """
+    Copy the bundle key to a new file on the current host. mktemp creates
+    the file with mode 0600 before the key is written, and the key never
+    appears on a command line.
+
+    :return: the remote path of the key file. The caller removes it.
+    """
+    key_file = run('mktemp /tmp/bman-keytabs-key.XXXXXXXX').strip()
+    put(io.BytesIO(bundle_key.encode('ascii')), key_file)
+    return key_file
+
+
+def get_keytab_factory_script(kadmin_util, host_keytabs, staging_dir, key_file):
+    """
+    Script that exports the keytabs of every host in one kadmin batch and
+    packs them into one encrypted bundle per host.
+
+    Each host's keytabs are staged under staging_dir/<host>/ at their
+    final paths, with their final owners and permissions. A keytab file
+    with the same principals on several hosts is exported once and copied,
+    since every export bumps the KVNO and invalidates earlier copies. The
+    bundles are encrypted with the key in key_file and collected in
+    staging_dir/bundles.tar.
+
+    :param host_keytabs: dict mapping host -> list of (keytab file,
+                         principal, owner, group, perms) tuples.
+    """
+    groups = OrderedDict()
+    for host in sorted(host_keytabs):
+        principals = defaultdict(list)
+        for keytab_file, principal, _, _, _ in host_keytabs[host]:
+            principals[keytab_file].append(principal)
+        for keytab_file, file_principals in sorted(principals.items()):
+            groups.setdefault((keytab_file, tuple(sorted(set(file_principals)))), []).append(host)
+
+    batch = kadmin_util.make_batch()
+    copies = []
+    for (keytab_file, principals), hosts in groups.items():
+        for principal in principals:
+            batch.ktadd(staging_dir + '/' + hosts[0] + keytab_file, principal)
+        copies += ['cp {0}/{1}{3} {0}/{2}{3}'.format(staging_dir, hosts[0], host, keytab_file)
+                   for host in hosts[1:]]
+
+    lines = ['umask 077', 'set -e -o pipefail',
+             'mkdir -p {}/bundles {}'.format(staging_dir, ' '.join(sorted(
+                 {'{}/{}{}'.format(staging_dir, host, os.path.dirname(k[0]))
+                  for host, keytabs in host_keytabs.items() for k in keytabs}))),
+             batch.get_script()] + copies
+    for host in sorted(host_keytabs):
+        for keytab_file, owner, group, perms in sorted({k[:1] + k[2:] for k in host_keytabs[host]}):
+            lines.append('chown {0}:{1} {3} && chmod {2} {3}'.format(
+                owner, group, perms, staging_dir + '/' + host + keytab_file))
+        # Only regular files are bundled, so extracting a bundle never changes
+        # the owner or mode of existing directories like /etc.
+        lines.append('(cd {0}/{1} && find . -type f | tar --no-recursion -czf - -T - | '
+                     'openssl enc {2} -pass file:{3} -out {0}/bundles/{1}.enc)'.format(
+                         staging_dir, host, KEYTAB_BUNDLE_CIPHER, key_file))
+    lines.append('tar -C {0}/bundles -cf {0}/bundles.tar .'.format(staging_dir))
+    return '\n'.join(lines)
 
 
 @task
-def export_keytab(kadmin_util=None, principal=None, keytab_file=None,
-                  keytab_file_owner=None, keytab_file_group=None,
-                  keytab_perms=None):
-    principal = principal.replace(HOST_SUBSTITUTION_PATTERN, env.host)
-
-    keytab_dir = os.path.dirname(keytab_file)
-    sudo('mkdir -p {0} && chmod 755 {0}'.format(keytab_dir))
-    sudo('rm -f {}'.format(keytab_file))
-    get_logger().debug(" >> Exporting keytab {} on host {}".format(keytab_file, env.host))
-    cmd = kadmin_util.export_keytab_command(principal, keytab_file)
-    sudo(cmd)
-    get_logger().debug(" >> Setting keytab owner to {}.{}".format(keytab_file_owner, 'hadoop'))
-    sudo('chown {}.{} {}'.format(keytab_file_owner, keytab_file_group, keytab_file))
-    sudo('chmod {} {}'.format(keytab_perms, keytab_file))
+@parallel
+def install_keytab_bundle(bundle_dir=None, bundle_key=None, keytab_dirs=None):
+    """
+    Install this host's keytab bundle. The keytabs are extracted in place
+    with their owners and permissions.
+    """
+    remote_bundle = '/tmp/bman-keytabs-{}.enc'.format(os.path.basename(bundle_dir))
+    with hide('everything'), settings(warn_only=True):
+        put(os.path.join(bundle_dir, '{}.enc'.format(env.host)), remote_bundle, use_sudo=True, mode=0o600)
+        key_file = put_bundle_key(bundle_key)
+        result = sudo('set -o pipefail; mkdir -p {0} && chmod 755 {0} && '
+                      'openssl enc -d {1} -pass file:{3} -in {2} | tar -xzpf - -C /; '
+                      'rc=$?; rm -f {2} {3}; exit $rc'.format(
+                          ' '.join(keytab_dirs[env.host]), KEYTAB_BUNDLE_CIPHER, remote_bundle, key_file))
+    return result.succeeded
+
+
+def export_keytabs(cluster, host_keytabs):
+    """
+    Export keytabs for many hosts. The keytab factory host exports all of
+    them in one kadmin batch and packs one encrypted bundle per host. The
+    bundles are fetched here and installed on all hosts in parallel, so
+    the other hosts never need kadmin credentials.
+
+    :param host_keytabs: dict mapping host -> list of (keytab file,
+                         principal, owner, group, perms) tuples.
+    :return: True if all keytabs were installed.
+    """
+    host_keytabs = {host: keytabs for host, keytabs in host_keytabs.items() if keytabs}
+    if not host_keytabs:
+        return True
+    factory = cluster.get_config(KEY_KEYTAB_FACTORY_HOST)
+    bundle_key = os.urandom(32).hex()
+    bundle_dir = tempfile.mkdtemp(prefix='bman-keytabs-')
+    staging_dir = '/tmp/{}'.format(os.path.basename(bundle_dir))
+    key_file = None
+    get_logger().info("Exporting keytabs for {} hosts on {}".format(len(host_keytabs), factory))
+    try:
+        with hide('everything'), settings(host_string=factory):
+            key_file = put_bundle_key(bundle_key)
+        script = get_keytab_factory_script(KadminUtil(cluster), host_keytabs, staging_dir, key_file)
+        if not run_on_keytab_factory(cluster, script, 'export keytabs'):
+            return False
+        with hide('everything'), settings(host_string=factory):
+            get('{}/bundles.tar'.format(staging_dir), os.path.join(bundle_dir, 'bundles.tar'), use_sudo=True)
+        with tarfile.open(os.path.join(bundle_dir, 'bundles.tar')) as bundles:
+            bundles.extractall(bundle_dir)
+
+        keytab_dirs = {host: sorted({os.path.dirname(k[0]) for k in keytabs})
+                       for host, keytabs in host_keytabs.items()}
+        get_logger().info("Installing keytab bundles on {} hosts".format(len(host_keytabs)))
+        results = execute(install_keytab_bundle, hosts=sorted(host_keytabs), bundle_dir=bundle_dir,
+                          bundle_key=bundle_key, keytab_dirs=keytab_dirs)
+        failed = sorted(host for host, success in results.items() if not success)
+        if failed:
+            get_logger().error("Failed to install keytabs on {}".format(', '.join(failed)))
+            return False
+        return True
+    finally:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        with hide('everything'), settings(host_string=factory, warn_only=True):
+            sudo('rm -rf {} {}'.format(staging_dir, key_file or ''))
+
+
+def get_service_keytabs(cluster):
+    """
+    :return: dict mapping host -> list of (keytab file, principal, owner,
+             group, perms) tuples for the service principals of that host,
+             with _HOST substituted.
+    """
+    host_keytabs = defaultdict(list)
+    for pc in make_principal_configuration(cluster):
+        # Ensure that kerberos config exists for this service.
+        if not (pc.hosts and cluster.has_site_setting(pc.principal_key) and
+                cluster.has_site_setting(pc.keytab_file_key)):
+            continue
+        principal = cluster.get_site_setting(pc.principal_key)
+        keytab_file = cluster.get_site_setting(pc.keytab_file_key)
+        for host in pc.hosts:
+            host_keytabs[host].append((keytab_file, principal.replace(HOST_SUBSTITUTION_PATTERN, host),
+                                       pc.keytab_file_owner, pc.keytab_file_group, pc.keytab_perms))
+    return host_keytabs
+
+
+def select_stale_keytabs(host_keytabs, host_kvnos, kdc_kvnos):
+    """
+    Choose the keytab files that must be exported again: those with a
+    key that is missing or older than the KDC's. Exporting a principal
+    invalidates its keys in every other keytab, so the files that hold a
+    principal being exported are included too, until nothing changes.
+
+    :param host_keytabs: dict mapping host -> list of (keytab file,
+                         principal, owner, group, perms) tuples.
+    :param host_kvnos: dict mapping host -> {(keytab, principal): KVNO}.
+    :param kdc_kvnos: dict mapping principal -> KVNO.
+    :return: the subset of host_keytabs to export.
+    """
+    stale = {(host, k[0]) for host, keytabs in host_keytabs.items() for k in keytabs
+             if host_kvnos.get(host, {}).get(k[:2]) != kdc_kvnos.get(k[1])}
+    while True:
+        principals = {k[1] for host, keytabs in host_keytabs.items() for k in keytabs if (host, k[0]) in stale}
+        more = {(host, k[0]) for host, keytabs in host_keytabs.items() for k in keytabs if k[1] in principals}
+        if more <= stale:
+            break
+        stale |= more
+    return {host: [k for k in keytabs if (host, k[0]) in stale] for host, keytabs in host_keytabs.items()}
+
+
+def provision_keytabs(cluster, host_keytabs):
+    """
+    Make sure every host has current keytabs for its principals.
+
+    The realm's principal list is read once and only missing principals
+    are created. Keytabs are exported only where the copy on the host,
+    checked with one parallel 'klist -kt' sweep, is missing or stale, so
+    current keytabs keep their KVNO.
+
+    :param host_keytabs: dict mapping host -> list of (keytab file,
+                         principal, owner, group, perms) tuples.
+    :return: True if all keytabs are current.
+    """
+    required = {k[1] for keytabs in host_keytabs.values() for k in keytabs}
+    if not required:
+        return True
+    if not create_principals(cluster, required - list_principals(cluster)):
+        return False
+
+    kdc_kvnos = get_kdc_kvnos(cluster, required)
+    keytab_files = {host: sorted({k[0] for k in keytabs}) for host, keytabs in host_keytabs.items() if keytabs}
+    with settings(skip_bad_hosts=True):
+        results = execute(get_host_keytab_kvnos, hosts=sorted(keytab_files), keytab_files=keytab_files)
+    host_kvnos = {host: (kvnos if isinstance(kvnos, dict) else {}) for host, kvnos in results.items()}
+
+    stale = select_stale_keytabs(host_keytabs, host_kvnos, kdc_kvnos)
+    get_logger().info("{} of {} keytabs are missing or stale".format(
+        sum(len(keytabs) for keytabs in stale.values()),
+        sum(len(keytabs) for keytabs in host_keytabs.values())))
+    return export_keytabs(cluster, stale)
+
+
+def make_headless_principals(cluster, users=None):
+    """
+    Create headless principals and keytabs for the given users, by
+    default the service users. Each keytab is exported once and installed
+    on every host that lacks a current copy.
+    """
+    if not cluster.has_site_setting('dfs.namenode.kerberos.principal'):
+        # Not a kerberised cluster, potentially.
+        return True
+
+    users = list(users if users is not None else cluster.get_service_users())
+    realm = KadminUtil(cluster).get_default_realm()
+    keytab_dir = os.path.dirname(cluster.get_site_setting('dfs.namenode.keytab.file'))
+    keytabs = [(os.path.join(keytab_dir, '{}.headless.keytab'.format(user.name)),
+                '{}@{}'.format(user.name, realm), user.name, user.group, '600') for user in users]
+    return provision_keytabs(cluster, {host: keytabs for host in cluster.get_all_hosts()})
+
+
+def make_headless_principal(cluster=None, kadmin_util=None, user=None):
+    """
+    Create a headless principal and keytab.
+    """
+    return make_headless_principals(cluster, [user])
+
+
+def do_kerberos_install(cluster=None):
+
+    get_logger().info("Installing jsvc and Linux container executor on all cluster hosts")
+    copy_jce_policy_files(cluster)
+    execute(install_jsvc, hosts=cluster.get_all_hosts())
+    execute(install_container_executor, hosts=cluster.get_all_hosts(), cluster=cluster)
+    make_headless_principals(cluster)
+    generate_hdfs_principals_and_keytabs(cluster=cluster)
+
+
+def generate_hdfs_principals_and_keytabs(cluster=None):
+    """
+    Generate HDFS principals and keytabs on all hosts. Only missing
+    principals are created and only missing or stale keytabs exported.
+    :param cluster:
+    :return:
+    """
+    return provision_keytabs(cluster, get_service_keytabs(cluster))
 
 
 @task
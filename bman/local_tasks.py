@@ -14,20 +14,30 @@
 
 # This file contains local tasks used command shell and the script.
 
+import filecmp
+import functools
+import hashlib
+import io
+import json
 import os
 import re
 import shutil
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from os.path import expanduser
 from string import Template
+from xml.sax.saxutils import escape
 
 from fabric.api import task, local, hide, settings
 from fabric.operations import put, sudo
 from fabric.state import env
-from pkg_resources import resource_string, resource_listdir
+from pkg_resources import resource_string, resource_listdir, get_distribution, DistributionNotFound
 
 import bman.constants as constants
 from bman.bman_config import load_config
 from bman.logger import get_logger
+from bman.utils import is_true
 
 
 @task
@@ -151,18 +161,44 @@ def update_tez_configs(cluster):
 
 @task
 def generate_configs(cluster=None):
+    """
+    Generate the Hadoop and Tez config files for the cluster.
+
+    Generation is skipped if the config file, the bundled templates and
+    the bman version all match the previous run. Otherwise only files whose
+    content changed are rewritten, so unchanged files keep their mtime.
+    """
     if cluster is None:
         cluster = load_config()
 
-    get_logger().info("Generating Hadoop configuration files")
     try:
+        # Fill in defaults first. Other modules read them from the cluster
+        # even when the files are up to date.
+        update_hdfs_configs(cluster)
+        if cluster.is_yarn_enabled():
+            update_mapred_configs(cluster)
+            update_yarn_configs(cluster)
+        if cluster.is_tez_enabled():
+            update_tez_configs(cluster)
+
+        check_for_generated_dirs(cluster)
+        fingerprint = get_config_fingerprint(cluster)
+        fingerprint_file = os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(),
+                                        constants.GENERATED_CONFIG_FINGERPRINT_FILE_NAME)
+        if fingerprint and read_file(fingerprint_file) == fingerprint and os.path.isfile(
+                os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(), 'core-site.xml')):
+            get_logger().info("Hadoop configuration files are up to date")
+            return
+        if os.path.exists(fingerprint_file):
+            os.remove(fingerprint_file)
+
+        get_logger().info("Generating Hadoop configuration files")
+        _written_paths.clear()
         # We create configuration files in the generated directory. Once that
         # is done, we process specific files that need template processing
         # and over write them. In other words the copy of all files need to be
         # first.
-        check_for_generated_dirs(cluster)
         copy_all_configs(cluster)
-        update_hdfs_configs(cluster)
         generate_site_config(cluster, filename='core-site.xml',
                              settings_key=constants.KEY_CORE_SITE_SETTINGS,
                              output_dir=cluster.get_generated_hadoop_conf_tmp_dir())
@@ -171,8 +207,6 @@ def generate_configs(cluster=None):
                              output_dir=cluster.get_generated_hadoop_conf_tmp_dir())
 
         if cluster.is_yarn_enabled():
-            update_mapred_configs(cluster)
-            update_yarn_configs(cluster)
             generate_site_config(cluster, filename='yarn-site.xml',
                                  settings_key=constants.KEY_YARN_SITE_SETTINGS,
                                  output_dir=cluster.get_generated_hadoop_conf_tmp_dir())
@@ -181,7 +215,6 @@ def generate_configs(cluster=None):
                                  output_dir=cluster.get_generated_hadoop_conf_tmp_dir())
 
         if cluster.is_tez_enabled():
-            update_tez_configs(cluster)
             generate_site_config(cluster, filename='tez-site.xml',
                                  settings_key=constants.KEY_TEZ_SITE_SETTINGS,
                                  output_dir=cluster.get_generated_tez_conf_tmp_dir())
@@ -192,10 +225,89 @@ def generate_configs(cluster=None):
         generate_hadoop_env(cluster)
         generate_logging_properties(cluster)
 
+        remove_stale_files([cluster.get_generated_hadoop_conf_tmp_dir(),
+                            cluster.get_generated_tez_conf_tmp_dir()])
+        cluster.host_config_sets = generate_host_config_sets(cluster)
+        if fingerprint:
+            with open(fingerprint_file, 'w') as f:
+                f.write(fingerprint)
+
     except Exception as e:
         get_logger().exception(e)
 
 
+def get_bman_version():
+    try:
+        return get_distribution('bman').version
+    except DistributionNotFound:
+        return ''
+
+
+def get_config_fingerprint(cluster):
+    """
+    Hash of the inputs of generate_configs: the config file and the host
+    lists it includes, the bundled templates and the bman version.
+
+    :return: the hex digest, or None if there is no config file.
+    """
+    config_file = cluster.get_config_file()
+    if not config_file or not os.path.isfile(config_file):
+        return None
+    digest = hashlib.sha256(get_bman_version().encode('utf-8'))
+    for path in [config_file] + cluster.get_include_files():
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for name in sorted(resource_listdir('bman.resources.conf', '')):
+        if name.endswith('.template'):
+            digest.update(name.encode('utf-8'))
+            digest.update(resource_string('bman.resources.conf', name))
+    return digest.hexdigest()
+
+
+def read_file(path):
+    """ :return: the contents of a text file, or None if it does not exist. """
+    try:
+        with open(path) as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+# Files written by open_if_changed during the current generate_configs run.
+_written_paths = set()
+
+
+@contextmanager
+def open_if_changed(path):
+    """
+    Open a file for writing. The new content goes to a temporary file that
+    only replaces path if the content differs, so unchanged files keep
+    their mtime.
+    """
+    tmp_path = os.path.join(os.path.dirname(path), '.{}.tmp'.format(os.path.basename(path)))
+    try:
+        with open(tmp_path, 'w') as f:
+            yield f
+        if os.path.isfile(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _written_paths.add(path)
+
+
+def remove_stale_files(dirs):
+    """ Remove files that the last run of generate_configs did not write. """
+    for d in dirs:
+        for name in os.listdir(d):
+            path = os.path.join(d, name)
+            if os.path.isfile(path) and not name.startswith('.') and path not in _written_paths:
+                get_logger().debug("Removing stale config file {}".format(path))
+                os.remove(path)
+
+
 def get_config_file_header():
     return """<?xml version="1.0" encoding="UTF-8"?>
 <?xml-stylesheet type="text/xsl" href="configuration.xsl"?>
@@ -225,18 +337,17 @@ def get_config_file_footer():
 def check_for_generated_dirs(cluster=None):
     for d in [cluster.get_generated_hadoop_conf_tmp_dir(),
               cluster.get_generated_tez_conf_tmp_dir(),
+              cluster.get_generated_config_sets_dir(),
               cluster.get_ssh_keys_tmp_dir()]:
-        if os.path.exists(d):
-            shutil.rmtree(d)
-        os.makedirs(d)
+        os.makedirs(d, exist_ok=True)
 
 
 def generate_site_config(cluster, filename=None, settings_key=None, output_dir=None):
     """ Create an XML config file."""
-    with open(os.path.join(output_dir, filename), "w") as site:
+    with open_if_changed(os.path.join(output_dir, filename)) as site:
         site.write(get_config_file_header())
-        site.write(generate_custom_settings(
-            cluster.get_config(settings_key)))
+        write_custom_settings(site, cluster.get_config(settings_key),
+                              is_true(cluster.get_config(constants.KEY_SORT_SITE_SETTINGS)))
         site.write(get_config_file_footer())
 
 
@@ -253,24 +364,145 @@ def generate_ozone_site(cluster):
         cBlockTraceEnabled=cluster.get_config(constants.KEY_CBLOCK_TRACE),
         CBlockCachePath=cluster.get_config(constants.KEY_CBLOCK_CACHE_PATH),
         OzoneCustomConfig=generate_custom_settings(
-            cluster.get_config(constants.KEY_OZONE_SITE_SETTINGS)))
+            cluster.get_config(constants.KEY_OZONE_SITE_SETTINGS),
+            is_true(cluster.get_config(constants.KEY_SORT_SITE_SETTINGS))))
 
-    with open(os.path.join(
-            cluster.get_generated_hadoop_conf_tmp_dir(), "ozone-site.xml"), "w") as ozone_site:
+    with open_if_changed(os.path.join(
+            cluster.get_generated_hadoop_conf_tmp_dir(), "ozone-site.xml")) as ozone_site:
         ozone_site.write(ozone_str)
 
 
-def generate_custom_settings(custom_values):
-    generated_val = ''
-    for k in custom_values:
-        generated_val += \
-            """
+PROPERTY_FORMAT = """
   <property>
     <name>{}</name>
     <value>{}</value>
   </property>
-""".format(k, custom_values[k])
-    return generated_val
+"""
+
+
+def xml_escape(value):
+    # Most values need no escaping, so check before copying them.
+    if '&' in value or '<' in value or '>' in value:
+        return escape(value)
+    return value
+
+
+def write_custom_settings(out, custom_values, sort_keys=False):
+    """
+    Write a <property> element for each setting to out in a single pass.
+    Names and values are XML-escaped.
+
+    :param sort_keys: write the settings sorted by name, for stable diffs.
+    """
+    write = out.write
+    for k in (sorted(custom_values, key=str) if sort_keys else custom_values):
+        write(PROPERTY_FORMAT.format(xml_escape(str(k)), xml_escape(str(custom_values[k]))))
+
+
+def generate_custom_settings(custom_values, sort_keys=False):
+    buf = io.StringIO()
+    write_custom_settings(buf, custom_values, sort_keys)
+    return buf.getvalue()
+
+
+def render_site_files(site_settings, sort_keys=False):
+    """
+    Render XML config files. This runs in a worker process.
+
+    :param site_settings: dict mapping file name -> settings.
+    :return: dict mapping file name -> content.
+    """
+    rendered = {}
+    for filename, custom_values in site_settings.items():
+        buf = io.StringIO()
+        buf.write(get_config_file_header())
+        write_custom_settings(buf, custom_values, sort_keys)
+        buf.write(get_config_file_footer())
+        rendered[filename] = buf.getvalue()
+    return rendered
+
+
+def get_config_set_name(files):
+    """ :return: a name for a config set derived from the content of its files. """
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha256(files[name]).digest())
+    return digest.hexdigest()[:16]
+
+
+def generate_host_config_sets(cluster):
+    """
+    Generate the config sets of hosts with HostGroups or HostOverrides.
+
+    A config set is a copy of the cluster-wide Hadoop config directory with
+    the overridden site files re-rendered. Hosts with the same overrides
+    share one rendering, and the distinct renderings run in a process pool.
+    Each set is stored in a directory named by the hash of its content, so
+    an unchanged set is neither rewritten nor stored twice.
+
+    :return: dict mapping host -> config set name, for hosts with overrides.
+    """
+    base_dir = cluster.get_generated_hadoop_conf_tmp_dir()
+    sets_dir = cluster.get_generated_config_sets_dir()
+
+    # Group the hosts by their overrides.
+    profiles = OrderedDict()
+    for host in sorted(cluster.get_all_hosts()):
+        overrides = cluster.get_host_overrides(host)
+        if overrides:
+            key = json.dumps(overrides, sort_keys=True, default=str)
+            profiles.setdefault(key, (overrides, []))[1].append(host)
+
+    base_files = {}
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        if os.path.isfile(path) and not name.startswith('.'):
+            with open(path, 'rb') as f:
+                base_files[name] = f.read()
+
+    jobs = []
+    for overrides, _ in profiles.values():
+        site_settings = {}
+        for key, filename in constants.HOST_OVERRIDE_SITE_FILES.items():
+            if key in overrides and filename in base_files:
+                site_settings[filename] = dict(cluster.get_config(key))
+                site_settings[filename].update(overrides[key])
+        jobs.append(site_settings)
+
+    rendered = []
+    if jobs:
+        get_logger().info("Rendering {} config sets for {} hosts with overrides".format(
+            len(jobs), sum(len(hosts) for _, hosts in profiles.values())))
+        render = functools.partial(render_site_files,
+                                   sort_keys=is_true(cluster.get_config(constants.KEY_SORT_SITE_SETTINGS)))
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            rendered = list(pool.map(render, jobs))
+
+    host_sets = {}
+    for (_, hosts), files in zip(profiles.values(), rendered):
+        files = dict(base_files, **{name: content.encode('utf-8') for name, content in files.items()})
+        set_name = get_config_set_name(files)
+        set_dir = os.path.join(sets_dir, set_name)
+        if not os.path.isdir(set_dir):
+            tmp_dir = os.path.join(sets_dir, '.{}.tmp'.format(set_name))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for name, content in files.items():
+                with open(os.path.join(tmp_dir, name), 'wb') as f:
+                    f.write(content)
+            os.rename(tmp_dir, set_dir)
+        host_sets.update((host, set_name) for host in hosts)
+
+    used = set(host_sets.values())
+    for name in os.listdir(sets_dir):
+        path = os.path.join(sets_dir, name)
+        if os.path.isdir(path) and name not in used:
+            get_logger().debug("Removing stale config set {}".format(path))
+            shutil.rmtree(path)
+    with open_if_changed(os.path.join(sets_dir, constants.HOST_CONFIG_SETS_FILE_NAME)) as f:
+        json.dump(host_sets, f, indent=2, sort_keys=True)
+    return host_sets
 
 
 def hadoop_env_tez_settings(cluster):
@@ -298,6 +530,7 @@ def generate_hadoop_env(cluster):
 
     env_str = env_str.safe_substitute(
         hadoop_home_config=cluster.get_hadoop_install_dir(),
+        hadoop_pid_dir_config=cluster.get_hadoop_pid_dir(),
         java_home=cluster.get_config(constants.KEY_JAVA_HOME),
         hdfs_datanode_secure_user=(constants.HDFS_USER if cluster.is_kerberized() else ''),
         hdfs_datanode_user=('root' if cluster.is_kerberized() else constants.HDFS_USER),
@@ -309,7 +542,7 @@ def generate_hadoop_env(cluster):
     if cluster.is_tez_enabled():
         env_str = env_str + hadoop_env_tez_settings(cluster)
 
-    with open(os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(), "hadoop-env.sh"), "w") as hadoop_env:
+    with open_if_changed(os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(), "hadoop-env.sh")) as hadoop_env:
         hadoop_env.write(env_str)
 
 
@@ -329,7 +562,8 @@ def generate_logging_properties(cluster):
         if cluster.get_config(constants.KEY_CBLOCK_TRACE):
             logging_templates.append(os.path.join("cblock.tracing.template"))
 
-    with open(os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(), "log4j.properties"), "w") as logging_prop:
+    with open_if_changed(os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(),
+                                      "log4j.properties")) as logging_prop:
         for log_template in logging_templates:
             template_str = resource_string('bman.resources.conf', log_template).decode('utf-8')
             logging_prop.write(template_str)
@@ -338,29 +572,30 @@ def generate_logging_properties(cluster):
 def copy_all_configs(cluster=None):
     """ Copy the remaining files as-is, removing the .template suffix """
     conf_generated_dir = cluster.get_generated_hadoop_conf_tmp_dir()
+    # These are rendered from their templates later. Skip the raw copy so
+    # that an unchanged file is not replaced twice.
+    rendered = {'hadoop-env.sh.template', 'log4j.properties.template'}
+    if cluster.get_config(constants.KEY_OZONE_ENABLED):
+        rendered.add('ozone-site.xml.template')
     get_logger().debug("Listing conf resources")
     for f in resource_listdir('bman.resources.conf', ''):
-        if f.endswith('.template'):
+        if f.endswith('.template') and f not in rendered:
             get_logger().debug("Got resource {}".format(f))
             resource_contents = resource_string('bman.resources.conf', f).decode('utf-8')
             filename = re.sub(".template$", "", f)
-            with open(os.path.join(conf_generated_dir, filename), "w") as output_file:
+            with open_if_changed(os.path.join(conf_generated_dir, filename)) as output_file:
                 output_file.write(resource_contents)
 
 
 def generate_workers_file(cluster):
     """Generates the workers file based on the machines in datanodes list."""
-    workers = cluster.get_config(constants.KEY_WORKERS)
+    workers = cluster.get_worker_nodes()
     conf_generated_dir = cluster.get_generated_hadoop_conf_tmp_dir()
-    with open(os.path.join(conf_generated_dir, 'workers'), 'w') as workers_file:
-        for host_name in workers:
-            workers_file.write(host_name)
-            workers_file.write('\n')
-
     # Also make a copy named 'slaves' for Hadoop versions 2.x.
     # TODO: Deprecate this eventually.
-    shutil.copy2(os.path.join(conf_generated_dir, 'workers'),
-                 os.path.join(conf_generated_dir, 'slaves'))
+    for filename in ['workers', 'slaves']:
+        with open_if_changed(os.path.join(conf_generated_dir, filename)) as workers_file:
+            workers_file.writelines('{}\n'.format(host_name) for host_name in workers)
 
 
 def get_keyname_for_user(user=None):
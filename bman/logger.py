@@ -14,7 +14,6 @@
 
 # This file contains local tasks used command shell and the script.
 
-import daiquiri
 import logging
 
 import os
@@ -37,7 +36,9 @@ def get_logger():
     if not logger:
         """
         Initialize the logger. Write log output to a file under logs/ and to STDERR.
+        daiquiri is slow to import, so it is only loaded once a command logs.
         """
+        import daiquiri
         log_dir = os.path.join(os.path.expanduser('~'), '.bman-logs')
         os.makedirs(log_dir, exist_ok=True)
         daiquiri.setup(
@@ -0,0 +1,298 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Support for the 'preflight' command.
+
+The facts of every host, e.g. CPUs, memory, free space on the paths bman
+writes to, the Java version and clock skew, are collected in a single
+parallel sweep. Each host runs one remote command. The facts are cached
+for HOST_FACTS_TTL_SECONDS so that a following install does not ask the
+hosts again, and are checked against what the install will need.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from fabric.api import task, sudo, hide, settings, execute
+from fabric.decorators import parallel
+
+import bman.constants as constants
+from bman.host_roles import ROLE_NAMENODE, ROLE_DATANODE, ROLE_JOURNALNODE
+from bman.logger import get_logger
+from bman.utils import get_tarball_destination
+
+SECTION_MARKER = '--bman-'
+
+
+def get_checked_paths(cluster):
+    """ The remote paths whose free space is checked. """
+    paths = [os.path.dirname(get_tarball_destination(cluster.get_config(constants.KEY_HADOOP_TARBALL))),
+             cluster.get_config(constants.KEY_HOMEDIR)]
+    paths += cluster.get_storage_dirs()
+    # DataNode dirs may be overridden per host.
+    for host in sorted(cluster.host_override_layers):
+        paths += cluster.get_datanode_dirs(host)
+    return sorted(set(paths), key=paths.index)
+
+
+def get_kerberos_endpoints(cluster):
+    """ The (host, port) of the KDC and kadmin services, if the cluster is kerberized. """
+    if not cluster.is_kerberized():
+        return []
+    server = cluster.get_config(constants.KEY_KADMIN_SERVER)
+    return [(server, constants.KDC_PORT), (server, constants.KADMIN_PORT)]
+
+
+def get_facts_command(cluster):
+    """
+    A single shell command that reports every fact the preflight checks
+    need.
+    """
+    java = '{}/bin/java'.format(cluster.get_config(constants.KEY_JAVA_HOME))
+    endpoints = ' '.join('{}:{}'.format(host, port) for host, port in get_kerberos_endpoints(cluster))
+    return ' ; '.join([
+        'echo {}cpus'.format(SECTION_MARKER),
+        'nproc',
+        'echo {}memory'.format(SECTION_MARKER),
+        "awk '/^MemTotal:/ {print $2}' /proc/meminfo",
+        'echo {}os'.format(SECTION_MARKER),
+        '((. /etc/os-release && echo "$PRETTY_NAME") 2>/dev/null || uname -sr)',
+        'echo {}java'.format(SECTION_MARKER),
+        '({} -version 2>&1 | head -1)'.format(java),
+        'echo {}disks'.format(SECTION_MARKER),
+        # Report the free space of the nearest existing parent of each path.
+        'for p in {} ; do d="$p" ; while [ ! -d "$d" ] ; do d=$(dirname "$d") ; done ; '
+        'echo "$p $(df -Pk "$d" | awk \'NR==2 {{print $4}}\')" ; done'.format(' '.join(get_checked_paths(cluster))),
+        'echo {}endpoints'.format(SECTION_MARKER),
+        'for a in {} ; do if timeout 3 bash -c "</dev/tcp/${{a%:*}}/${{a##*:}}" 2>/dev/null ; '
+        'then echo "$a up" ; else echo "$a down" ; fi ; done'.format(endpoints),
+        'echo {}time'.format(SECTION_MARKER),
+        'date +%s.%N',
+        'true'])
+
+
+def parse_facts_output(output):
+    """
+    Parse the output of the facts command into a dict with the keys 'cpus',
+    'memory_mb', 'os', 'java' (None if Java is missing), 'free_mb'
+    (path -> MB), 'endpoints' ('host:port' -> reachable) and 'time'
+    (the host's clock, in seconds).
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith(SECTION_MARKER):
+            current = line[len(SECTION_MARKER):]
+            sections[current] = []
+        elif line and current:
+            sections[current].append(line)
+
+    def first(name):
+        return sections.get(name, [None])[0]
+
+    java = first('java')
+    free_mb = {}
+    for line in sections.get('disks', []):
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+            free_mb[fields[0]] = int(fields[1]) // 1024
+    endpoints = {}
+    for line in sections.get('endpoints', []):
+        fields = line.split()
+        if len(fields) == 2:
+            endpoints[fields[0]] = fields[1] == 'up'
+    remote_time = first('time')
+    return {'cpus': int(first('cpus')) if (first('cpus') or '').isdigit() else None,
+            'memory_mb': int(first('memory')) // 1024 if (first('memory') or '').isdigit() else None,
+            'os': first('os'),
+            'java': java if java and 'version' in java else None,
+            'free_mb': free_mb,
+            'endpoints': endpoints,
+            'time': float(remote_time) if remote_time else None}
+
+
+@task
+@parallel
+def get_host_facts(cluster=None):
+    """ Collect the facts of one host with a single remote command. """
+    start = time.time()
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_facts_command(cluster), pty=False)
+    end = time.time()
+    facts = parse_facts_output(result.stdout)
+    # Compare the host's clock with the middle of the round trip.
+    facts['clock_skew'] = facts['time'] - (start + end) / 2 if facts['time'] else None
+    return facts
+
+
+def get_facts_cache_file(cluster):
+    return os.path.join(os.path.expanduser('~'), '.config', 'bman', '.cache',
+                        'facts-{}.json'.format(cluster.get_config(constants.KEY_NAME)))
+
+
+def read_facts_cache(cluster):
+    try:
+        with open(get_facts_cache_file(cluster)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_facts_cache(cluster, all_facts):
+    cache_file = get_facts_cache_file(cluster)
+    os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(all_facts, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+
+
+def collect_host_facts(cluster, refresh=False, ttl=constants.HOST_FACTS_TTL_SECONDS):
+    """
+    Return the facts of every cluster host. Cached facts are reused if they
+    are younger than ttl and were collected with the same command, i.e. for
+    the same paths and endpoints. The remaining hosts are asked in one
+    parallel sweep.
+
+    :return: dict mapping hostname -> facts dict, or None if the host
+             could not be reached.
+    """
+    command_digest = hashlib.sha256(get_facts_command(cluster).encode('utf-8')).hexdigest()
+    cached = {} if refresh else read_facts_cache(cluster)
+    now = time.time()
+    all_facts = {}
+    for host in cluster.get_all_hosts():
+        facts = cached.get(host)
+        if facts and facts.get('command') == command_digest and now - facts.get('collected', 0) < ttl:
+            all_facts[host] = facts
+
+    targets = [host for host in cluster.get_all_hosts() if host not in all_facts]
+    if targets:
+        get_logger().info("Collecting facts from {} hosts".format(len(targets)))
+        with hide('everything'), settings(skip_bad_hosts=True, warn_only=True):
+            results = execute(get_host_facts, hosts=targets, cluster=cluster)
+        for host, facts in results.items():
+            if isinstance(facts, dict):
+                facts.update(command=command_digest, collected=now)
+                all_facts[host] = facts
+            else:
+                all_facts[host] = None
+        # Unreachable hosts are not cached, so that they are asked again.
+        write_facts_cache(cluster, {h: f for h, f in all_facts.items() if f is not None})
+    return all_facts
+
+
+def get_required_free_mb(cluster, host):
+    """
+    :return: dict mapping path -> (MB needed, the roles that need it, or
+             None for every host). DataNode dirs are those of host.
+    """
+    def size_mb(key):
+        local_file = cluster.get_config(key)
+        return os.path.getsize(local_file) // (1024 * 1024) if local_file and os.path.isfile(local_file) else 0
+
+    tarballs_mb = size_mb(constants.KEY_HADOOP_TARBALL) + size_mb(constants.KEY_TEZ_TARBALL)
+    master_config = cluster.get_hdfs_master_config()
+    required = {
+        os.path.dirname(get_tarball_destination(cluster.get_config(constants.KEY_HADOOP_TARBALL))):
+            (tarballs_mb, None),
+        cluster.get_config(constants.KEY_HOMEDIR):
+            (tarballs_mb * constants.PREFLIGHT_EXTRACTED_TARBALL_FACTOR, None)}
+    for roles, dirs in [({ROLE_NAMENODE}, master_config.get_nn_dirs() + master_config.get_snn_dirs()),
+                        ({ROLE_JOURNALNODE}, master_config.get_jn_dirs()),
+                        ({ROLE_DATANODE}, cluster.get_datanode_dirs(host))]:
+        for d in dirs:
+            required.setdefault(d, (constants.PREFLIGHT_MIN_STORAGE_FREE_MB, roles))
+    return required
+
+
+def check_host_facts(cluster, all_facts):
+    """
+    Check the facts of every host against what the install needs.
+
+    :return: dict mapping hostname -> list of problems. Hosts without
+             problems are left out.
+    """
+    index = cluster.get_role_index()
+    endpoints = ['{}:{}'.format(host, port) for host, port in get_kerberos_endpoints(cluster)]
+    kdc, kadmin = (endpoints + [None, None])[:2]
+    factory_host = cluster.get_config(constants.KEY_KEYTAB_FACTORY_HOST)
+
+    problems = {}
+    for host in cluster.get_all_hosts():
+        facts = all_facts.get(host)
+        found = []
+        if facts is None:
+            problems[host] = ['unreachable']
+            continue
+        if not facts['java']:
+            found.append('no Java at {}'.format(cluster.get_config(constants.KEY_JAVA_HOME)))
+        for path, (needed_mb, roles) in sorted(get_required_free_mb(cluster, host).items()):
+            if roles and not roles & index.get_roles(host):
+                continue
+            free_mb = facts['free_mb'].get(path)
+            if free_mb is not None and free_mb < needed_mb:
+                found.append('{} has {} MB free, needs {} MB'.format(path, free_mb, needed_mb))
+        skew = facts.get('clock_skew')
+        if skew is not None and abs(skew) > constants.PREFLIGHT_MAX_CLOCK_SKEW_SECONDS:
+            found.append('clock is {:+.0f}s off'.format(skew))
+        if kdc and not facts['endpoints'].get(kdc):
+            found.append('cannot reach the KDC at {}'.format(kdc))
+        if kadmin and host == factory_host and not facts['endpoints'].get(kadmin):
+            found.append('cannot reach kadmin at {}'.format(kadmin))
+        if found:
+            problems[host] = found
+    return problems
+
+
+def print_host_facts(all_facts, problems):
+    """ Print one line of facts per host, followed by its problems. """
+    host_width = max(len(h) for h in all_facts) + 2
+    print('HOST'.ljust(host_width) + 'CPUS  MEMORY     SKEW    JAVA / OS')
+    for host in sorted(all_facts):
+        facts = all_facts[host]
+        if facts is None:
+            print(host.ljust(host_width) + '?')
+        else:
+            print('{}{:<6}{:<11}{:<8}{} / {}'.format(
+                host.ljust(host_width), facts['cpus'] or '?',
+                '{} MB'.format(facts['memory_mb']) if facts['memory_mb'] else '?',
+                '{:+.1f}s'.format(facts['clock_skew']) if facts.get('clock_skew') is not None else '?',
+                facts['java'] or '-', facts['os'] or '?'))
+        for problem in problems.get(host, []):
+            print('    ' + problem)
+    print("\n{} hosts, {} with problems.".format(len(all_facts), len(problems)))
+
+
+def run_preflight(cluster, refresh=False, verbose=True):
+    """
+    Collect the facts of every host, reusing cached ones, and check them.
+
+    :return: True if no problems were found.
+    """
+    all_facts = collect_host_facts(cluster, refresh=refresh)
+    problems = check_host_facts(cluster, all_facts)
+    if verbose:
+        print_host_facts(all_facts, problems)
+    for host, found in sorted(problems.items()):
+        get_logger().error("Preflight check failed on {}: {}".format(host, '; '.join(found)))
+    return not problems
+
+
+if __name__ == '__main__':
+    pass
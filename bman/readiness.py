@@ -0,0 +1,321 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Readiness probes for Hadoop services.
+
+The probes run on the bman host and talk directly to the service RPC and
+HTTP ports, so they don't need an ssh round-trip. All targets are polled
+concurrently with exponential backoff until they are ready or a deadline
+expires.
+"""
+
+import json
+import socket
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import bman.constants as constants
+from bman.logger import get_logger
+
+# Backoff bounds between consecutive probes of a single target.
+INITIAL_PROBE_DELAY_SECONDS = 0.5
+MAX_PROBE_DELAY_SECONDS = 8
+
+# Timeout for a single connection attempt or HTTP request.
+PROBE_TIMEOUT_SECONDS = 3
+
+# Upper bound on the number of probe threads.
+MAX_PROBE_THREADS = 64
+
+NAMENODE_STATUS_BEAN = 'Hadoop:service=NameNode,name=NameNodeStatus'
+NAMENODE_INFO_BEAN = 'Hadoop:service=NameNode,name=NameNodeInfo'
+NAMENODE_RPC_ACTIVITY_BEAN = 'Hadoop:service=NameNode,name=RpcActivityForPort{}'
+DATANODE_INFO_BEAN = 'Hadoop:service=DataNode,name=DataNodeInfo'
+RESOURCEMANAGER_NM_INFO_BEAN = 'Hadoop:service=ResourceManager,name=RMNMInfo'
+
+
+class JmxAccessDenied(Exception):
+    """ The JMX servlet requires authentication that bman cannot provide. """
+    pass
+
+
+def get_readiness_timeout(cluster):
+    return int(cluster.get_config(constants.KEY_READINESS_TIMEOUT))
+
+
+def wait_until_ready(targets, probe, description, timeout):
+    """
+    Poll probe(target) for every target concurrently until it returns True.
+
+    :param targets: list of objects to probe.
+    :param probe: a callable that returns True when its target is ready.
+    :param description: used for log messages.
+    :param timeout: deadline in seconds for all targets.
+    :return: list of targets that were not ready before the deadline.
+    """
+    targets = list(targets)
+    if not targets:
+        return []
+    deadline = time.monotonic() + timeout
+    get_logger().info("Waiting up to {}s for {} {}".format(timeout, len(targets), description))
+
+    def poll(target):
+        delay = INITIAL_PROBE_DELAY_SECONDS
+        while True:
+            try:
+                if probe(target):
+                    get_logger().debug("{} is ready: {}".format(description, target))
+                    return True
+            except Exception as e:
+                get_logger().debug("Probe for {} failed: {}".format(target, e))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, MAX_PROBE_DELAY_SECONDS)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(len(targets), MAX_PROBE_THREADS)) as pool:
+        results = list(pool.map(poll, targets))
+    not_ready = [t for t, ready in zip(targets, results) if not ready]
+    if not_ready:
+        get_logger().error("{} not ready after {}s: {}".format(description, timeout, not_ready))
+    else:
+        get_logger().info("{} ready in {:.1f}s".format(description, time.monotonic() - start))
+    return not_ready
+
+
+def is_port_open(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=PROBE_TIMEOUT_SECONDS):
+            return True
+    except OSError:
+        return False
+
+
+def get_jmx_bean(http_address, bean_name):
+    """
+    Fetch a single bean from the JMX servlet of a Hadoop service.
+
+    :return: the bean as a dict, or None if the bean is not (yet) registered.
+    """
+    url = 'http://{}/jmx?qry={}'.format(http_address, bean_name)
+    try:
+        with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT_SECONDS) as response:
+            beans = json.loads(response.read().decode('utf-8')).get('beans', [])
+    except urllib.error.HTTPError as e:
+        if e.code in (401, 403):
+            raise JmxAccessDenied(url)
+        raise
+    return beans[0] if beans else None
+
+
+def namenode_is_up(nn):
+    """
+    A NameNode is up once its RPC server accepts connections and it has
+    reached the active or standby state. If the JMX servlet is protected,
+    fall back to the RPC check alone.
+    """
+    if not is_port_open(nn.get_hostname(), nn.get_rpc_port()):
+        return False
+    try:
+        bean = get_jmx_bean(nn.get_http_address(), NAMENODE_STATUS_BEAN)
+    except JmxAccessDenied:
+        return True
+    return bean is not None and bean.get('State') in {'active', 'standby'}
+
+
+def namenode_is_out_of_safemode(nn):
+    try:
+        bean = get_jmx_bean(nn.get_http_address(), NAMENODE_INFO_BEAN)
+    except JmxAccessDenied:
+        return is_port_open(nn.get_hostname(), nn.get_rpc_port())
+    return bean is not None and not bean.get('Safemode')
+
+
+def wait_for_namenodes(cluster, nns=None):
+    """
+    Wait until the given NameNodes (default: all NameNodes) are up.
+    :param nns: list of NameNodeInfo objects.
+    :return: True if all NameNodes came up before the deadline.
+    """
+    if nns is None:
+        nns = cluster.get_hdfs_master_config().get_nn_configs()
+    return not wait_until_ready(nns, namenode_is_up, 'NameNodes', get_readiness_timeout(cluster))
+
+
+def wait_for_safemode_exit(cluster, nns):
+    """
+    Wait until the given NameNodes have left safe mode.
+    :param nns: list of NameNodeInfo objects.
+    :return: True if all NameNodes left safe mode before the deadline.
+    """
+    return not wait_until_ready(nns, namenode_is_out_of_safemode,
+                                'NameNodes out of safe mode', get_readiness_timeout(cluster))
+
+
+def is_same_host(host, name):
+    """ Compare hostnames allowing for short vs. fully qualified names. """
+    return host == name or name.startswith(host + '.') or host.startswith(name + '.')
+
+
+def get_live_datanode_hosts(nn):
+    """
+    Return the hostnames of the DataNodes that are registered with a NameNode.
+    """
+    bean = get_jmx_bean(nn.get_http_address(), NAMENODE_INFO_BEAN)
+    if bean is None:
+        return set()
+    # LiveNodes is a JSON string keyed by 'hostname:xferPort'.
+    return {name.split(':')[0] for name in json.loads(bean.get('LiveNodes') or '{}')}
+
+
+def get_rpc_queue_time(nn):
+    """
+    Return the average RPC queue time in milliseconds of a NameNode, or None
+    if it is not known yet.
+    """
+    bean = get_jmx_bean(nn.get_http_address(),
+                        NAMENODE_RPC_ACTIVITY_BEAN.format(nn.get_rpc_port()))
+    return bean.get('RpcQueueTimeAvgTime') if bean else None
+
+
+def wait_for_datanode_registrations(cluster, hosts, max_rpc_queue_time_ms):
+    """
+    Wait until every NameNode lists the DataNodes on the given hosts as live
+    and its average RPC queue time has settled below max_rpc_queue_time_ms,
+    i.e. the NameNode has worked through the initial block reports.
+    :return: True if all NameNodes settled before the deadline.
+    """
+    def settled(nn):
+        try:
+            live = get_live_datanode_hosts(nn)
+            if not all(any(is_same_host(h, name) for name in live) for h in hosts):
+                return False
+            queue_time = get_rpc_queue_time(nn)
+        except JmxAccessDenied:
+            return True
+        get_logger().debug("{} RPC queue time is {} ms".format(nn, queue_time))
+        return queue_time is None or queue_time <= max_rpc_queue_time_ms
+
+    return not wait_until_ready(cluster.get_hdfs_master_config().get_nn_configs(), settled,
+                                'NameNodes with {} new DataNodes'.format(len(hosts)),
+                                get_readiness_timeout(cluster))
+
+
+def get_namenode_state(nn):
+    """
+    Return the HA state ('active', 'standby', ...) of a NameNode, or None if
+    it cannot be determined.
+    """
+    try:
+        bean = get_jmx_bean(nn.get_http_address(), NAMENODE_STATUS_BEAN)
+    except Exception as e:
+        get_logger().debug("Unable to get the state of {}: {}".format(nn, e))
+        return None
+    return bean.get('State') if bean else None
+
+
+def wait_for_active_namenode(cluster, nn):
+    """
+    Wait until a NameNode reports itself as active, e.g. after a failover.
+    :param nn: NameNodeInfo object.
+    :return: True if the NameNode became active before the deadline.
+    """
+    return not wait_until_ready([nn], lambda n: get_namenode_state(n) == 'active',
+                                'active NameNode', get_readiness_timeout(cluster))
+
+
+def wait_for_datanodes(cluster, hosts):
+    """
+    Wait until the DataNodes on the given hosts have registered with all
+    their NameNodes, as reported by each DataNode's own JMX servlet.
+    :return: True if all DataNodes registered before the deadline.
+    """
+    http_port = cluster.get_datanode_http_port()
+
+    def registered(host):
+        try:
+            bean = get_jmx_bean('{}:{}'.format(host, http_port), DATANODE_INFO_BEAN)
+        except JmxAccessDenied:
+            return is_port_open(host, http_port)
+        if bean is None:
+            return False
+        actors = json.loads(bean.get('BPServiceActorInfo') or '[]')
+        return bool(actors) and all(a.get('ActorState') == 'RUNNING' for a in actors)
+
+    return not wait_until_ready(hosts, registered, 'DataNodes', get_readiness_timeout(cluster))
+
+
+def wait_for_nodemanagers(cluster, hosts):
+    """
+    Wait until the ResourceManager lists the NodeManagers on the given hosts
+    as RUNNING.
+    :return: True if all NodeManagers registered before the deadline.
+    """
+    def registered(host):
+        try:
+            bean = get_jmx_bean(cluster.get_rm_http_address(), RESOURCEMANAGER_NM_INFO_BEAN)
+        except JmxAccessDenied:
+            return True
+        if bean is None:
+            return False
+        return any(is_same_host(host, nm.get('HostName', '')) and nm.get('State') == 'RUNNING'
+                   for nm in json.loads(bean.get('LiveNodeManagers') or '[]'))
+
+    return not wait_until_ready(hosts, registered, 'NodeManagers', get_readiness_timeout(cluster))
+
+
+def wait_for_journalnodes(cluster, hosts):
+    """
+    Wait until the JournalNodes on the given hosts accept RPC connections.
+    :return: True if all JournalNodes came up before the deadline.
+    """
+    addresses = set()
+    for ns in cluster.get_hdfs_master_config().get_nameservices():
+        addresses.update(a for a in ns.get_jn_addresses() if a[0] in hosts)
+    return not wait_until_ready(sorted(addresses), lambda a: is_port_open(*a), 'JournalNodes',
+                                get_readiness_timeout(cluster))
+
+
+def wait_for_journalnode_quorum(cluster, nameservices=None):
+    """
+    Wait until a majority of the JournalNodes of every HA nameservice accept
+    RPC connections. JournalNodes beyond the quorum keep coming up in the
+    background.
+    :param nameservices: NameService objects to check. Defaults to all.
+    :return: True if every nameservice has a JournalNode quorum before the deadline.
+    """
+    quorums = {}
+    for ns in nameservices or cluster.get_hdfs_master_config().get_nameservices():
+        if ns.get_jn_addresses():
+            quorums[ns.get_id()] = ns.get_jn_addresses()
+    if not quorums:
+        return True
+
+    def has_quorum(nsid):
+        addresses = quorums[nsid]
+        with ThreadPoolExecutor(max_workers=len(addresses)) as pool:
+            up = sum(pool.map(lambda a: is_port_open(*a), addresses))
+        return up > len(addresses) // 2
+
+    return not wait_until_ready(sorted(quorums), has_quorum, 'JournalNode quorums',
+                                get_readiness_timeout(cluster))
+
+
+if __name__ == '__main__':
+    pass
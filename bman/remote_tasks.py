@@ -16,6 +16,7 @@
 
 import io
 import os
+import re
 
 import fabric
 from fabric.api import task, settings, sudo, hide, env, execute
@@ -23,9 +24,11 @@ from fabric.decorators import parallel
 
 import bman.constants as constants
 import bman.bman_config as config
-from bman.kerberos_setup import make_headless_principal
+from bman.kerberos_setup import make_headless_principals
 from bman.logger import get_logger
-from bman.utils import start_stop_service, prompt_for_yes_no, run_dfs_command
+from bman.readiness import wait_for_datanode_registrations
+from bman.storage_tasks import fast_wipe_dirs, run_per_disk
+from bman.utils import start_stop_service, prompt_for_yes_no, run_dfs_command, get_pid_file_patterns, is_true
 
 
 def prepare_cluster(cluster=None, force=False):
@@ -37,9 +40,8 @@ def prepare_cluster(cluster=None, force=False):
     targets = cluster.get_all_hosts()
     get_logger().info("Preparing {} nodes {}".format(len(targets), targets))
     with hide('status', 'warnings', 'running', 'stdout', 'stderr', 'user', 'commands'):
-        if not execute(killall_services, hosts=targets):
-            get_logger().error('killing all services failed.')
-            return False
+        if not stop_all_daemons(cluster, targets):
+            get_logger().warning('Some daemons had to be killed.')
 
         if not execute(clean_tmp, hosts=targets):
             get_logger().error('cleaning tmp failed.')
@@ -56,28 +58,29 @@ def prepare_cluster(cluster=None, force=False):
 
         # TODO: wipe the Tez install directory.
 
-        if not execute(delete_service_users, hosts=targets, cluster=cluster):
-            get_logger().info("Deleting users failed.")
-
-        for new_user in cluster.get_service_users():
-            add_user(cluster, new_user)
+        if not add_users(cluster, list(cluster.get_service_users()), recreate=True):
+            get_logger().error('Failed to recreate service users.')
+            return False
 
-        if not execute(wipe_cluster, hosts=targets, cluster=cluster, force=force):
+        if not all(execute(wipe_cluster, hosts=targets, cluster=cluster, force=force).values()):
             get_logger().error('Wipe cluster failed.')
             return False
     return True
 
 
+def transition_to_active(cluster, ns):
+    active_nn = ns.choose_active_nn()[0]
+    active_nn_id = active_nn.nn_id
+    get_logger().info("Transitioning {}.{} to active".format(ns.nsid, active_nn_id))
+    cmd = '{}/bin/hdfs haadmin -ns {} -transitionToActive {}'.format(
+        cluster.get_hadoop_install_dir(), ns.nsid, active_nn_id)
+    execute(run_dfs_command, hosts=[active_nn.get_hostname()], cluster=cluster, cmd=cmd)
+
+
 def do_active_transitions(cluster):
     for ns in cluster.get_hdfs_master_config().get_nameservices():
         if len(ns.get_nn_configs()) > 1:
-            active_nn_id = ns.choose_active_nn()[0].nn_id
-            get_logger().info("Transitioning {}.{} to active".format(ns.nsid, active_nn_id))
-            cmd = '{}/bin/hdfs haadmin -ns {} -transitionToActive {}'.format(
-                cluster.get_hadoop_install_dir(), ns.nsid, active_nn_id)
-            targets = cluster.get_hdfs_master_config().get_nn_hosts()[0:1]
-            execute(run_dfs_command, hosts=targets, cluster=cluster, cmd=cmd)
-    pass
+            transition_to_active(cluster, ns)
 
 
 @task
@@ -131,11 +134,47 @@ def start_stop_namenodes(action=None, nodes=None, cluster=None):
 
 def start_stop_datanodes(action=None, nodes=None, cluster=None):
     targets = nodes if nodes else cluster.get_worker_nodes()
+    if action == 'start':
+        return start_datanodes_in_waves(cluster, targets, user=constants.HDFS_USER)
     execute(start_stop_service, hosts=targets, cluster=cluster,
             action=action, service_name='datanode', user=constants.HDFS_USER)
     return True
 
 
+def start_datanodes_in_waves(cluster, targets, user=None):
+    """
+    Start DataNodes in waves of DataNodeStartWaveSize hosts, so that the
+    NameNodes are not flooded with initial block reports. The next wave is
+    started once the NameNodes list the current wave as live and their RPC
+    queue time has settled. If no wave size is configured, then all
+    DataNodes are started at once.
+
+    :return: True if the DataNode started on every host.
+    """
+    wave_size = int(cluster.get_config(constants.KEY_DATANODE_START_WAVE_SIZE))
+    if wave_size <= 0 or wave_size >= len(targets):
+        waves = [targets]
+    else:
+        waves = [targets[i:i + wave_size] for i in range(0, len(targets), wave_size)]
+
+    max_rpc_queue_time_ms = float(cluster.get_config(constants.KEY_DATANODE_START_MAX_RPC_QUEUE_TIME))
+    wave_settings = {'parallel': True, 'pool_size': wave_size} if len(waves) > 1 else {}
+    failed = []
+    for i, wave in enumerate(waves):
+        if len(waves) > 1:
+            get_logger().info("Starting DataNode wave {} of {} ({} nodes)".format(i + 1, len(waves), len(wave)))
+        with settings(skip_bad_hosts=True, warn_only=True, **wave_settings):
+            results = execute(start_stop_service, hosts=wave, cluster=cluster,
+                              action='start', service_name='datanode', user=user)
+        # Hosts that could not be reached are returned as exceptions.
+        failed += sorted(host for host, success in results.items() if success is not True)
+        if i + 1 < len(waves) and not wait_for_datanode_registrations(cluster, wave, max_rpc_queue_time_ms):
+            get_logger().warning("Starting the next DataNode wave without waiting any longer.")
+    if failed:
+        get_logger().error("Failed to start DataNodes on {}".format(', '.join(failed)))
+    return not failed
+
+
 def start_stop_journalnodes(action=None, nodes=None, cluster=None):
     targets = nodes if nodes else cluster.get_hdfs_master_config().get_jn_hosts()
     execute(start_stop_service, hosts=targets, cluster=cluster,
@@ -189,32 +228,96 @@ def create_fabric_rc(fabricconf, home, username, password):
         fabricrc.close()
 
 
+def get_stop_daemons_script(cluster, timeout):
+    """
+    Shell script that sends SIGTERM to every daemon with a pid file, waits
+    up to timeout seconds for them to exit and sends SIGKILL to stragglers.
+    It prints one line per daemon: <stopped|killed> <pidfile> <latency ms>.
+    """
+    return """
+now_ms() {{ echo $(( $(date +%s%N) / 1000000 )); }}
+declare -A pids
+declare -A started
+for f in {patterns}; do
+  [ -f "$f" ] || continue
+  pid=$(cat "$f")
+  if kill -0 "$pid" 2>/dev/null; then
+    kill -TERM "$pid"
+    pids["$f"]=$pid
+    started["$f"]=$(now_ms)
+  else
+    rm -f "$f"
+  fi
+done
+deadline=$(( $(now_ms) + {timeout_ms} ))
+while [ ${{#pids[@]}} -gt 0 ]; do
+  for f in "${{!pids[@]}}"; do
+    if ! kill -0 "${{pids[$f]}}" 2>/dev/null; then
+      echo "stopped $f $(( $(now_ms) - ${{started[$f]}} ))"
+      rm -f "$f"
+      unset pids["$f"]
+    fi
+  done
+  [ ${{#pids[@]}} -eq 0 ] && break
+  if [ $(now_ms) -ge $deadline ]; then
+    for f in "${{!pids[@]}}"; do
+      kill -KILL "${{pids[$f]}}" 2>/dev/null
+      echo "killed $f $(( $(now_ms) - ${{started[$f]}} ))"
+      rm -f "$f"
+    done
+    break
+  fi
+  sleep 0.2
+done
+true
+""".format(patterns=' '.join(get_pid_file_patterns(cluster)), timeout_ms=int(timeout) * 1000)
+
+
 @task
-def killall_services():
+@parallel
+def stop_daemons(cluster=None, timeout=constants.DEFAULT_DAEMON_STOP_TIMEOUT):
     """
-    Kills all services related to hadoop.
-    :return:
+    Gracefully stop the Hadoop daemons that have pid files on this host.
+    Unrelated JVMs are left alone.
+    :return: list of (daemon pid file, 'stopped'|'killed', latency in ms) tuples.
     """
-    # Need to add the full list of Hadoop proceess here.
-    # with settings(warn_only=True):
-    #     if is_namenode_running():
-    #         kill_namenode()
-    #     if is_datanode_running():
-    #         kill_datanode()
-    #     if is_scsi_server_running():
-    #         kill_scsi_server()
-    #     if is_scm_running():
-    #         kill_scm()
-    #     if is_cblock_running():
-    #         kill_cblock_server()
-    # return True
-
-    # Cheat for now and kill all Java process
-    get_logger().debug("Killing all services on host {}".format(env.host))
-    with settings(warn_only=True):
-        sudo('ps aux | grep -i [j]ava | awk \'{print $2}\' | xargs -r kill -9')
-    get_logger().debug("Killed all services on host {}".format(env.host))
-    return True
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_stop_daemons_script(cluster, timeout), pty=False)
+    stopped = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] in {'stopped', 'killed'} and fields[2].isdigit():
+            stopped.append((fields[1], fields[0], int(fields[2])))
+    return stopped
+
+
+def stop_all_daemons(cluster, targets=None):
+    """
+    Stop the Hadoop daemons on all hosts in parallel, escalating to SIGKILL
+    for daemons that don't exit within DaemonStopTimeoutSeconds.
+    :return: True if every daemon exited without SIGKILL on every
+             reachable host.
+    """
+    targets = targets if targets else cluster.get_all_hosts()
+    timeout = int(cluster.get_config(constants.KEY_DAEMON_STOP_TIMEOUT))
+    get_logger().info("Stopping Hadoop daemons on {} hosts".format(len(targets)))
+    with settings(skip_bad_hosts=True, warn_only=True):
+        results = execute(stop_daemons, hosts=targets, cluster=cluster, timeout=timeout)
+    all_stopped = True
+    for host, stopped in sorted(results.items()):
+        if not isinstance(stopped, list):
+            # Hosts that could not be reached are returned as exceptions.
+            get_logger().error("Failed to stop daemons on {}: {}".format(host, stopped))
+            all_stopped = False
+            continue
+        for pid_file, outcome, latency in stopped:
+            daemon = re.sub(r'\.pid$', '', os.path.basename(pid_file)).split('-')[-1]
+            if outcome == 'killed':
+                all_stopped = False
+                get_logger().warning("Killed {} on {} after {} ms".format(daemon, host, latency))
+            else:
+                get_logger().info("Stopped {} on {} in {} ms".format(daemon, host, latency))
+    return all_stopped
 
 
 def clean_tmp():
@@ -247,7 +350,6 @@ def wipe_cluster(cluster, force=False):
                   the storage directories. Default: hdfs
     """
     try:
-        master_config = cluster.get_hdfs_master_config()
         if not force:
             force = prompt_for_yes_no(
                 "Data will be irrecoverably lost from node {}. "
@@ -255,12 +357,14 @@ def wipe_cluster(cluster, force=False):
         if force:
             get_logger().warning('Wiping node {}'.format(env.host_string))
             get_logger().debug('running remove command on {}'.format(env.host_string))
-            for d in master_config.get_nn_dirs() + cluster.get_datanode_dirs() + \
-                    master_config.get_jn_dirs() + master_config.get_snn_dirs():
-                sudo('rm -fr {}/*'.format(d))
+            if is_true(cluster.get_config(constants.KEY_FAST_WIPE)):
+                wiped = fast_wipe_dirs(cluster.get_storage_dirs(env.host))
+            else:
+                wiped = run_per_disk(cluster.get_storage_dirs(env.host), 'rm -fr "$d"/*', 'wiped')
             if (cluster.get_config(constants.KEY_OZONE_ENABLED) and
                     os.path.isdir(cluster.get_config(constants.KEY_OZONE_METADIR))):
                 sudo('rm -fr {}/*'.format(os.path.isdir(cluster.get_config(constants.KEY_OZONE_METADIR))))
+            return wiped
         else:
             get_logger().warning('Skipping machine: %s', env.host_string)
         return True
@@ -285,26 +389,6 @@ def check_user_exists(username=None):
     return result.succeeded
 
 
-@task
-def delete_service_users(cluster=None):
-    """ Deletes a user. e.g. fab delete_user:username=hdfs
-    Options:
-        username: name of the user to delete.
-    This command logs into all the machines in the datanodes set and deletes
-    a new user.
-    """
-    for username in [x.name for x in cluster.get_service_users()]:
-        get_logger().debug("Deleting user '{}' on host {}".format(username, env.host))
-        if execute(check_user_exists, username=username):
-            with hide('status', 'aborts', 'warnings', 'running', 'stdout', 'stderr',
-                      'user', 'commands', 'output'), settings(warn_only=True):
-                result = sudo('userdel -f --remove {}'.format(username))
-                if not result.succeeded:
-                    get_logger().debug('deleting user {} failed'.format(username))
-                    return False
-    return True
-
-
 @task
 def make_shell_profile(install_dir):
     """
@@ -332,36 +416,104 @@ def passwd(username=None, password=None):
     return result
 
 
+def get_sync_users_script(users, recreate=False):
+    """
+    Shell script that applies a table of users to a host in one go. Missing
+    groups and users are created, users are moved to their configured primary
+    group and all passwords are set with a single chpasswd call. If recreate
+    is True, existing users are first deleted along with their home
+    directories.
+
+    Prints one '<status> <user>' line per user, where status is one of
+    added, updated, unchanged or failed.
+    """
+    names = ' '.join(u.name for u in users)
+    lines = []
+    if recreate:
+        lines.append('for u in {}; do id -u $u > /dev/null 2>&1 && userdel -f --remove $u; done'.format(names))
+    lines.append('for g in {}; do getent group $g > /dev/null || groupadd $g; done'.format(
+        ' '.join(sorted({u.group for u in users}))))
+    for u in users:
+        lines.append(
+            'if ! id -u {0} > /dev/null 2>&1; then useradd {0} -m -g {1} && echo "added {0}" || echo "failed {0}"; '
+            'elif [ "$(id -gn {0})" != {1} ]; then usermod -g {1} {0} && echo "updated {0}" || echo "failed {0}"; '
+            'else echo "unchanged {0}"; fi'.format(u.name, u.group))
+    passwords = ['{}:{}'.format(u.name, u.password) for u in users if u.password]
+    if passwords:
+        lines.append("chpasswd <<'BMAN_EOF' || echo chpasswd-failed\n{}\nBMAN_EOF".format('\n'.join(passwords)))
+    return '\n'.join(lines + ['true'])
+
+
 @task
 @parallel
-def add_user_task(new_user=None):
-    get_logger().debug("Adding user '{}' on host {}".format(new_user.name, env.host))
-    with settings(warn_only=True):
-        sudo('groupadd -f {}'.format(new_user.group))
-        result = sudo('useradd {} -m -g {}'.format(new_user.name, new_user.group))
+def sync_users(users=None, recreate=False):
+    """
+    Apply the given list of UserConfig objects to this host with a single
+    remote script.
 
-    if result.succeeded:
-        result = passwd(new_user.name, new_user.password)
+    :return: dict mapping user name -> status. Users the script did not
+             report on are marked failed.
+    """
+    get_logger().debug("Syncing {} users on host {}".format(len(users), env.host))
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_sync_users_script(users, recreate), pty=False)
+    status = {u.name: 'failed' for u in users}
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1] in status:
+            status[fields[1]] = fields[0]
+        elif fields == ['chpasswd-failed']:
+            get_logger().error("Setting passwords on host {} failed.".format(env.host))
+    return status
+
+
+def check_sync_users_results(results):
+    """
+    Log the hosts and users that sync_users failed on.
 
-    if not result.succeeded:
-        get_logger().error(
-            "Adding user {} on host {} failed - {}".format(
-                new_user.name, env.host,
-                result.stdout if result.stdout else "No error message available."))
+    :param results: the result of executing sync_users under skip_bad_hosts.
+    :return: True if every user is present on every host.
+    """
+    # Hosts that could not be reached are returned as exceptions.
+    unreachable = sorted(host for host, status in results.items() if not isinstance(status, dict))
+    if unreachable:
+        get_logger().error('Failed to add users on {}'.format(', '.join(unreachable)))
+        return False
+    failed = sorted('{} on {}'.format(name, host) for host, status in results.items()
+                    for name, s in status.items() if s == 'failed')
+    if failed:
+        get_logger().error('Failed to create users: {}'.format(', '.join(failed)))
         return False
+    return True
+
+
+def add_users(cluster, users, recreate=False):
+    """
+    Creates or updates users on all cluster hosts, e.g. the service users or
+    unprivileged users to run HDFS commands and submit jobs. Each host
+    applies the whole list in one remote script, and all hosts run in
+    parallel.
+
+    :param recreate: if True, delete existing users with the same names first.
+    :return: True if every user is present on every host.
+    """
+    targets = cluster.get_all_hosts()
+    get_logger().info("Adding {} users on {} hosts".format(len(users), len(targets)))
+    with hide('status', 'warnings', 'running', 'stdout', 'stderr', 'user', 'commands'), \
+            settings(skip_bad_hosts=True, warn_only=True):
+        results = execute(sync_users, hosts=targets, users=users, recreate=recreate)
+    if not check_sync_users_results(results):
+        return False
+    if cluster.is_kerberized():
+        return make_headless_principals(cluster, users)
+    return True
 
 
 def add_user(cluster=None, new_user=None):
     """
     Creates an unprivileged user e.g. to run HDFS commands and submit jobs.
     """
-    targets = cluster.get_all_hosts()
-    with hide('status', 'warnings', 'running', 'stdout', 'stderr', 'user', 'commands'):
-        if not execute(add_user_task, hosts=targets, new_user=new_user):
-            get_logger().error('Failed to create user {}.'.format(new_user.name))
-            return False
-        if cluster.is_kerberized():
-            make_headless_principal(cluster, kadmin_util=None, user=new_user)
+    return add_users(cluster, [new_user])
 
 
 def is_service_running(service_name):
@@ -0,0 +1,153 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Rolling restart of Hadoop services.
+
+Worker daemons and JournalNodes are restarted a window of N hosts at a
+time. Each window must re-register before the next one is restarted, so
+the cluster stays available throughout. HA NameNodes are restarted
+standby-first with a failover in between.
+"""
+
+from fabric.api import execute, settings
+
+import bman.constants as constants
+from bman.logger import get_logger
+from bman.readiness import wait_for_datanodes, wait_for_nodemanagers, wait_for_journalnodes, \
+    wait_for_namenodes, wait_for_active_namenode, get_namenode_state
+from bman.utils import start_stop_service, run_dfs_command
+
+
+def restart_window(cluster, hosts, service_name, user, command='hdfs'):
+    """ Stop and start a service on a window of hosts in parallel. """
+    with settings(parallel=True, pool_size=len(hosts)):
+        execute(start_stop_service, hosts=hosts, cluster=cluster, action='stop',
+                service_name=service_name, user=user, command=command)
+        execute(start_stop_service, hosts=hosts, cluster=cluster, action='start',
+                service_name=service_name, user=user, command=command)
+
+
+def rolling_restart_workers(cluster, targets, window, service_name, user, wait_fn, command='hdfs'):
+    """
+    Restart a service window hosts at a time. wait_fn(cluster, hosts) must
+    return True once the restarted daemons have re-registered.
+    """
+    targets = list(targets)
+    windows = [targets[i:i + window] for i in range(0, len(targets), window)]
+    for i, hosts in enumerate(windows):
+        get_logger().info("Restarting {} on {} (window {} of {})".format(
+            service_name, hosts, i + 1, len(windows)))
+        restart_window(cluster, hosts, service_name, user, command=command)
+        if not wait_fn(cluster, hosts):
+            get_logger().error("Stopping the rolling restart as {} on {} did not come back.".format(
+                service_name, hosts))
+            return False
+    return True
+
+
+def restart_namenode(cluster, nn):
+    restart_window(cluster, [nn.get_hostname()], 'namenode', constants.HDFS_USER)
+    return wait_for_namenodes(cluster, nns=[nn])
+
+
+def rolling_restart_namenodes(cluster):
+    """
+    Restart the NameNodes of each nameservice. In HA nameservices the
+    standby is restarted first, then the active fails over to it and the
+    old active is restarted once the standby reports itself as active.
+    NameNodes of non-HA nameservices are restarted in place, which makes
+    their namespace briefly unavailable.
+    """
+    for ns in cluster.get_hdfs_master_config().get_nameservices():
+        nns = sorted(ns.get_nn_configs())
+        if not ns.is_ha():
+            get_logger().warning("Nameservice {} is not HA, it will be unavailable while {} restarts.".format(
+                ns.get_id(), nns[0]))
+            if not restart_namenode(cluster, nns[0]):
+                return False
+            continue
+
+        actives = [nn for nn in nns if get_namenode_state(nn) == 'active']
+        if not actives:
+            get_logger().error("No NameNode of {} reports itself as active, not restarting it.".format(
+                ns.get_id()))
+            return False
+        active = actives[0]
+        standbys = [nn for nn in nns if nn is not active]
+
+        for standby in standbys:
+            get_logger().info("Restarting standby NameNode {}.{} on {}".format(
+                ns.get_id(), standby.get_id(), standby.get_hostname()))
+            if not restart_namenode(cluster, standby):
+                return False
+
+        get_logger().info("Failing over {} from {} to {}".format(
+            ns.get_id(), active.get_id(), standbys[0].get_id()))
+        with settings(warn_only=True):
+            failed_over = run_dfs_command(cluster=cluster, cmd='{}/bin/hdfs haadmin -ns {} -failover {} {}'.format(
+                cluster.get_hadoop_install_dir(), ns.get_id(), active.get_id(), standbys[0].get_id()))
+        # The former active is only restarted once the standby has taken over.
+        if not failed_over or not wait_for_active_namenode(cluster, standbys[0]):
+            get_logger().error("Failover of {} to {} failed, not restarting {}.".format(
+                ns.get_id(), standbys[0].get_id(), active.get_id()))
+            return False
+
+        get_logger().info("Restarting former active NameNode {}.{} on {}".format(
+            ns.get_id(), active.get_id(), active.get_hostname()))
+        if not restart_namenode(cluster, active):
+            return False
+    return True
+
+
+def rolling_restart(cluster, role, window=None):
+    """
+    Restart all daemons of the given role without taking the service down.
+
+    :param role: one of namenodes, datanodes, journalnodes, nodemanagers.
+    :param window: number of hosts restarted at a time. Defaults to
+                   RollingRestartWindow.
+    :return: True if all daemons were restarted and came back.
+    """
+    window = int(window if window else cluster.get_config(constants.KEY_ROLLING_RESTART_WINDOW))
+    master_config = cluster.get_hdfs_master_config()
+
+    if role == 'namenodes':
+        return rolling_restart_namenodes(cluster)
+    elif role == 'datanodes':
+        return rolling_restart_workers(cluster, cluster.get_worker_nodes(), window,
+                                       'datanode', constants.HDFS_USER, wait_for_datanodes)
+    elif role == 'nodemanagers':
+        if not cluster.is_yarn_enabled():
+            get_logger().error("YARN is not enabled.")
+            return False
+        return rolling_restart_workers(cluster, cluster.get_worker_nodes(), window,
+                                       'nodemanager', constants.YARN_USER, wait_for_nodemanagers,
+                                       command='yarn')
+    elif role == 'journalnodes':
+        targets = sorted(master_config.get_jn_hosts())
+        # Never take down more JournalNodes than the quorum can tolerate.
+        max_window = max(1, (len(targets) - 1) // 2)
+        if window > max_window:
+            get_logger().info("Restarting at most {} JournalNodes at a time to keep a quorum.".format(max_window))
+            window = max_window
+        return rolling_restart_workers(cluster, targets, window,
+                                       'journalnode', constants.HDFS_USER, wait_for_journalnodes)
+
+    get_logger().error("Unsupported role for rolling restart: {}".format(role))
+    return False
+
+
+if __name__ == '__main__':
+    pass
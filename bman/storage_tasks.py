@@ -0,0 +1,221 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tasks that operate on the NameNode, DataNode and JournalNode storage
+directories of a host.
+
+Operations that walk many storage directories are grouped by the block
+device that holds each directory and run concurrently, one worker per
+device, so that a DataNode with many disks keeps all of them busy.
+
+Fast wipe moves each storage directory into a trash directory on the same
+filesystem, which is a cheap rename, and recreates it empty. The trash is
+then deleted in the background at idle I/O priority, with one deleter per
+filesystem.
+"""
+
+import time
+
+from fabric.api import task, sudo, hide, settings, execute, env
+from fabric.decorators import parallel
+
+from bman.logger import get_logger
+
+TRASH_DIR_NAME = '.bman-trash'
+
+
+def get_per_disk_script(dirs, command):
+    """
+    Shell script that runs command once for each of the given directories,
+    with the directories on the same block device handled sequentially and
+    different devices handled in parallel. The command refers to the
+    directory as "$d". Directories that do not exist yet are grouped by the
+    device of their nearest existing parent.
+
+    Each worker runs at best-effort I/O priority and prints one line per
+    directory ('done <device> <dir>' or 'failed <device> <dir>') followed
+    by a summary line 'disk <device> <dirs> <seconds>'.
+    """
+    return """
+pairs=$(for d in {dirs}; do
+  p="$d"
+  while [ ! -e "$p" ]; do p=$(dirname "$p"); done
+  echo "$(df --output=source "$p" | tail -1) $d"
+done)
+for dev in $(echo "$pairs" | cut -d' ' -f1 | sort -u); do
+  (
+    ionice -c2 -n7 -p $BASHPID > /dev/null 2>&1
+    start=$(date +%s)
+    n=0
+    for d in $(echo "$pairs" | awk -v dev="$dev" '$1 == dev {{print $2}}'); do
+      if ( {command} ) > /dev/null 2>&1; then
+        echo "done $dev $d"
+      else
+        echo "failed $dev $d"
+      fi
+      n=$((n + 1))
+    done
+    echo "disk $dev $n $(($(date +%s) - start))"
+  ) &
+done
+wait
+""".format(dirs=' '.join(dirs), command=command)
+
+
+def run_per_disk(dirs, command, description):
+    """
+    Run command for each of the given directories on the current host, in
+    parallel across block devices. See get_per_disk_script.
+
+    :return: True if the command succeeded for every directory.
+    """
+    if not dirs:
+        return True
+    result = sudo(get_per_disk_script(dirs, command), pty=False)
+    failed = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == 'failed':
+            failed.append(fields[2])
+        elif len(fields) == 4 and fields[0] == 'disk':
+            get_logger().debug("{}: {} {} directories on {} in {}s".format(
+                env.host, description, fields[2], fields[1], fields[3]))
+    if failed:
+        get_logger().error("{}: {} failed for {}".format(env.host, description, ', '.join(failed)))
+    return result.succeeded and not failed
+
+
+def get_fast_wipe_script(dirs, timestamp):
+    """
+    Shell script that moves the given directories to trash and starts the
+    background deleters. It prints one 'trash <path>' line per trash
+    directory and one 'failed <dir>' line per directory that could not be
+    moved.
+
+    If a directory is itself a mount point then it cannot be renamed, so its
+    contents are moved instead.
+    """
+    return """
+for d in {dirs}; do
+  [ -d "$d" ] || continue
+  mnt=$(df --output=target "$d" | tail -1)
+  trash="${{mnt%/}}/{trash}/{ts}"
+  dest="$trash/$(echo "$d" | tr / _)"
+  if [ "$mnt" = "$d" ]; then
+    mkdir -p "$dest" && \\
+      find "$d" -mindepth 1 -maxdepth 1 ! -name {trash} ! -name lost+found -exec mv -t "$dest" {{}} +
+  else
+    mode=$(stat -c %a "$d")
+    owner=$(stat -c %U:%G "$d")
+    mkdir -p "$trash" && mv "$d" "$dest" && mkdir -p "$d" && chmod "$mode" "$d" && chown "$owner" "$d"
+  fi
+  if [ $? -eq 0 ]; then echo "trash $trash"; else echo "failed $d"; fi
+done | sort -u | while read kind p; do
+  if [ "$kind" = trash ]; then
+    setsid nohup ionice -c3 nice -n 19 rm -rf "$p" > /dev/null 2>&1 < /dev/null &
+  fi
+  echo "$kind $p"
+done
+true
+""".format(dirs=' '.join(dirs), trash=TRASH_DIR_NAME, ts=timestamp)
+
+
+def fast_wipe_dirs(dirs):
+    """
+    Empty the given directories on the current host by moving them to trash.
+    Returns as soon as the renames are done; the data is deleted in the
+    background.
+
+    :return: True if every directory was moved to trash.
+    """
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    result = sudo(get_fast_wipe_script(dirs, timestamp), pty=False)
+    failed = []
+    for line in result.stdout.splitlines():
+        if line.startswith('trash '):
+            get_logger().debug("Deleting {} on {} in the background".format(line[6:], env.host))
+        elif line.startswith('failed '):
+            failed.append(line[7:])
+    if failed:
+        get_logger().error("{}: fast wipe failed for {}".format(env.host, ', '.join(failed)))
+    return result.succeeded and not failed
+
+
+def get_trash_status_script(dirs):
+    """
+    Shell script that reports the pending trash on every filesystem that
+    holds one of the given directories, and the number of running deleters.
+    """
+    return """
+for d in {dirs}; do
+  p="$d"
+  while [ ! -e "$p" ]; do p=$(dirname "$p"); done
+  df --output=target "$p" | tail -1
+done | sort -u | while read m; do
+  t="${{m%/}}/{trash}"
+  [ -d "$t" ] || continue
+  echo "trash $t $(find "$t" -mindepth 1 -maxdepth 1 | wc -l)"
+done
+echo "deleters $(pgrep -f '[r]m -rf .*/{trash}/' | wc -l)"
+""".format(dirs=' '.join(dirs), trash=TRASH_DIR_NAME)
+
+
+@task
+@parallel
+def get_trash_status(cluster=None):
+    """ :return: the trash status of this host, see parse_trash_status. """
+    with hide('everything'), settings(warn_only=True):
+        result = sudo(get_trash_status_script(cluster.get_storage_dirs(env.host)), pty=False)
+    return parse_trash_status(result.stdout)
+
+
+def parse_trash_status(output):
+    """
+    Parse the output of the trash status script.
+
+    :return: dict with the keys 'trash' (list of (path, pending wipes)
+             tuples) and 'deleters' (number of running background deletes).
+    """
+    status = {'trash': [], 'deleters': 0}
+    for line in output.splitlines():
+        fields = line.split()
+        if fields and fields[0] == 'trash' and len(fields) == 3 and fields[2].isdigit():
+            status['trash'].append((fields[1], int(fields[2])))
+        elif fields and fields[0] == 'deleters' and len(fields) == 2:
+            status['deleters'] = int(fields[1])
+    return status
+
+
+def print_trash_status(cluster):
+    """ Print the pending trash and running deleters of every host. """
+    with hide('everything'), settings(skip_bad_hosts=True, warn_only=True):
+        results = execute(get_trash_status, hosts=cluster.get_all_hosts(), cluster=cluster)
+    pending = 0
+    for host in sorted(results):
+        status = results[host]
+        if not isinstance(status, dict):
+            print("{}: unreachable".format(host))
+            continue
+        for path, count in status['trash']:
+            if count:
+                pending += 1
+                print("{}: {} - {} wipes pending, {} deleters running".format(
+                    host, path, count, status['deleters']))
+    if not pending:
+        print("No trash pending on {} hosts.".format(len(results)))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,117 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bman.bman_config
+from bman.bman_config import load_config
+from bman.constants import KEY_HDFS_SITE_SETTINGS
+from bman.host_roles import ROLE_NAMENODE, ROLE_JOURNALNODE, ROLE_DATANODE, ROLE_RESOURCEMANAGER, \
+    ROLE_NODEMANAGER, ROLE_SECONDARY_NAMENODE
+
+CONFIG = """
+Cluster: test
+HomeDir: /opt/hadoop
+HadoopTarball: /tmp/hadoop.tar.gz
+Workers: [worker1, worker2]
+CoreSiteSettings:
+  fs.defaultFS: 'hdfs://nn1:8020'
+HdfsSiteSettings:
+  dfs.namenode.name.dir: /data/name
+"""
+
+
+def test_load_config_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG)
+    cluster = load_config(str(config_file))
+
+    def fail(*args):
+        raise AssertionError('config was parsed again')
+
+    # An unchanged config file is loaded from the cache.
+    monkeypatch.setattr(bman.bman_config.Cluster, '__init__', fail)
+    cached = load_config(str(config_file))
+    assert cached.config == cluster.config
+    assert sorted(cached.get_all_hosts()) == ['nn1', 'worker1', 'worker2']
+
+    monkeypatch.undo()
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file.write('  dfs.replication: 2\n', mode='a')
+    assert load_config(str(config_file)).get_config(KEY_HDFS_SITE_SETTINGS)['dfs.replication'] == 2
+
+
+HA_CONFIG = """
+Cluster: ha
+HomeDir: /opt/hadoop
+HadoopTarball: /tmp/hadoop.tar.gz
+Workers: [worker1, worker2, nn2]
+CoreSiteSettings:
+  fs.defaultFS: 'hdfs://ns1'
+HdfsSiteSettings:
+  dfs.nameservices: ns1
+  dfs.ha.namenodes.ns1: nn1,nn2
+  dfs.namenode.rpc-address.ns1.nn1: 'nn1:8020'
+  dfs.namenode.rpc-address.ns1.nn2: 'nn2:8020'
+  dfs.namenode.shared.edits.dir: 'qjournal://nn1:8485;nn2:8485;jn3:8485/ns1'
+  dfs.namenode.name.dir: /data/name
+YarnSiteSettings:
+  yarn.resourcemanager.address: 'rm1:8032'
+"""
+
+
+def test_role_index(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(HA_CONFIG)
+    index = load_config(str(config_file)).get_role_index()
+
+    assert sorted(index.get_all_hosts()) == ['jn3', 'nn1', 'nn2', 'rm1', 'worker1', 'worker2']
+    assert sorted(index.get_hosts(ROLE_NAMENODE)) == ['nn1', 'nn2']
+    assert sorted(index.get_hosts(ROLE_JOURNALNODE)) == ['jn3', 'nn1', 'nn2']
+    assert index.get_hosts(ROLE_SECONDARY_NAMENODE) == ()
+    assert index.get_roles('nn2') == {ROLE_NAMENODE, ROLE_JOURNALNODE, ROLE_DATANODE, ROLE_NODEMANAGER}
+    assert index.get_roles('rm1') == {ROLE_RESOURCEMANAGER}
+    assert index.get_roles('unknown') == frozenset()
+    # Hosts with the same roles share one set.
+    assert index.get_roles('worker1') is index.get_roles('worker2')
+
+
+def test_workers_include_file_invalidates_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    tmpdir.join('workers.txt').write('dn[1-3]\n')
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG.replace('[worker1, worker2]', '[{include: workers.txt}, worker1]'))
+    assert list(load_config(str(config_file)).get_worker_nodes()) == ['dn1', 'dn2', 'dn3', 'worker1']
+
+    tmpdir.join('workers.txt').write('dn[1-4]\n')
+    assert len(load_config(str(config_file)).get_worker_nodes()) == 5
+
+
+def test_host_datanode_dirs(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG + """  dfs.datanode.data.dir: /data/1
+HostGroups:
+  bigdisk:
+    Hosts: [worker1]
+    HdfsSiteSettings:
+      dfs.datanode.data.dir: /data/1,/data/2
+HostOverrides:
+  worker2:
+    HdfsSiteSettings:
+      dfs.datanode.du.reserved: 1024
+""")
+    cluster = load_config(str(config_file))
+    assert cluster.get_datanode_dirs() == ['/data/1']
+    assert cluster.get_datanode_dirs('worker1') == ['/data/1', '/data/2']
+    assert cluster.get_datanode_dirs('worker2') == ['/data/1']
+    assert cluster.get_storage_dirs('worker1') == ['/data/name', '/data/1', '/data/2']
@@ -0,0 +1,38 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests for parsing the output of the status sweep.
+
+from bman.cluster_status import parse_status_output, SECTION_MARKER
+
+
+def test_parse_status_output():
+    output = '\n'.join([
+        SECTION_MARKER + 'jps',
+        '4242 NameNode',
+        '4343 SecureDataNodeStarter',
+        '4444 Jps',
+        SECTION_MARKER + 'ports',
+        'LISTEN 0      128          0.0.0.0:8020       0.0.0.0:*',
+        'LISTEN 0      128             [::]:9870          [::]:*',
+        SECTION_MARKER + 'pids',
+        '/tmp/hadoop-hdfs-namenode.pid 4242',
+        '/tmp/hadoop-hdfs-journalnode.pid 999'])
+    status = parse_status_output(output)
+    assert status['daemons'] == {'NameNode': 4242, 'DataNode': 4343, 'Jps': 4444}
+    assert status['ports'] == [8020, 9870]
+    assert status['pidfiles']['/tmp/hadoop-hdfs-journalnode.pid'] == 999
+
+
+def test_parse_empty_status_output():
+    status = parse_status_output('')
+    assert status == {'daemons': {}, 'ports': [], 'pidfiles': {}}
@@ -0,0 +1,140 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bman.converge
+from bman.converge import DesiredHostState, parse_state_output, plan_host, print_plan, apply_plan, \
+    ACTION_ADD_USER, ACTION_INSTALL, ACTION_FIX_DIR, ACTION_COPY_CONFIGS, ACTION_EXPORT_KEYTAB
+
+STATE_OUTPUT = """
+--bman-users
+hdfs hadoop
+yarn yarn
+--bman-dirs
+/data/1/dn 700 hdfs hadoop
+/data/2/dn 755 root root
+/opt/hadoop/logs 775 root hadoop
+--bman-tarball
+0123abcd
+--bman-configs
+aaaa  /opt/hadoop/etc/hadoop/core-site.xml
+bbbb  /opt/hadoop/etc/hadoop/capacity-scheduler.xml
+--bman-keytabs
+/etc/security/dn.keytab 2 dn/host1@EXAMPLE.COM
+/etc/security/dn.keytab 3 dn/host1@EXAMPLE.COM
+"""
+
+
+def make_desired(core_site_md5='aaaa'):
+    return DesiredHostState(
+        users=[('hdfs', 'hadoop'), ('yarn', 'hadoop')],
+        dirs=[('/data/1/dn', '700', 'hdfs', 'hadoop'), ('/data/2/dn', '700', 'hdfs', 'hadoop'),
+              ('/data/3/dn', '700', 'hdfs', 'hadoop'), ('/opt/hadoop/logs', '775', None, 'hadoop')],
+        tarball_md5='0123abcd',
+        config_md5s={'core-site.xml': core_site_md5},
+        keytabs=[('/etc/security/dn.keytab', 'dn/host1@EXAMPLE.COM')])
+
+
+def test_parse_state_output():
+    state = parse_state_output(STATE_OUTPUT)
+    assert state['users'] == {'hdfs': 'hadoop', 'yarn': 'yarn'}
+    assert state['dirs']['/data/2/dn'] == ('755', 'root', 'root')
+    assert state['tarball'] == '0123abcd'
+    assert state['configs']['core-site.xml'] == 'aaaa'
+    assert state['keytabs'] == {('/etc/security/dn.keytab', 'dn/host1@EXAMPLE.COM'): 3}
+
+
+def test_plan_host():
+    state = parse_state_output(STATE_OUTPUT)
+    kvnos = {'dn/host1@EXAMPLE.COM': 3}
+    assert plan_host(make_desired(), state, kvnos) == [
+        (ACTION_ADD_USER, 'yarn'),
+        (ACTION_FIX_DIR, '/data/2/dn', '700', 'hdfs', 'hadoop'),
+        (ACTION_FIX_DIR, '/data/3/dn', '700', 'hdfs', 'hadoop')]
+
+    actions = plan_host(make_desired(core_site_md5='cccc'), state, {'dn/host1@EXAMPLE.COM': 4})
+    assert (ACTION_COPY_CONFIGS,) in actions
+    assert (ACTION_EXPORT_KEYTAB, '/etc/security/dn.keytab', 'dn/host1@EXAMPLE.COM') in actions
+
+
+def test_print_plan(capsys):
+    print_plan({'host1': [(ACTION_FIX_DIR, '/opt/hadoop/logs', '775', None, 'hadoop'),
+                          (ACTION_COPY_CONFIGS,)]})
+    assert capsys.readouterr().out.splitlines() == [
+        'host1: fix-dir /opt/hadoop/logs 775 hadoop',
+        'host1: copy-configs']
+
+
+class FakeCluster(object):
+    def get_config(self, key):
+        return '/local/hadoop-3.1.0.tar.gz'
+
+    def get_hadoop_install_dir(self):
+        return '/opt/hadoop/hadoop-3.1.0'
+
+    def get_all_hosts(self):
+        return ['host1', 'host2', 'host3']
+
+    def get_service_users(self):
+        return []
+
+
+def fake_execute(executed, failing=()):
+    def execute(task, hosts=None, **kwargs):
+        executed.append(task.__name__)
+        return {host: host not in failing for host in hosts}
+    return execute
+
+
+def test_apply_plan_installs_only_planned_hosts(monkeypatch):
+    copied = []
+    monkeypatch.setattr(bman.converge, 'put_to_all_nodes',
+                        lambda cluster, source_file, remote_file, targets: copied.append(targets) or True)
+    monkeypatch.setattr(bman.converge, 'execute', fake_execute([]))
+    monkeypatch.setattr(bman.converge, 'extract_tarball', lambda **kwargs: True)
+    plan = {'host2': [(ACTION_INSTALL,)], 'host3': [(ACTION_COPY_CONFIGS,)]}
+    assert apply_plan(FakeCluster(), plan, {'host2': make_desired()})
+    assert copied == [['host2']]
+
+
+def test_apply_plan_failed_copy_skips_the_marker(monkeypatch):
+    executed = []
+    monkeypatch.setattr(bman.converge, 'put_to_all_nodes', lambda **kwargs: False)
+    monkeypatch.setattr(bman.converge, 'execute', fake_execute(executed))
+    plan = {'host2': [(ACTION_INSTALL,)], 'host3': [(ACTION_COPY_CONFIGS,)]}
+    assert not apply_plan(FakeCluster(), plan, {'host2': make_desired()})
+    assert executed == []
+
+
+def test_apply_plan_failed_extract_skips_the_marker(monkeypatch):
+    executed = []
+    monkeypatch.setattr(bman.converge, 'put_to_all_nodes', lambda **kwargs: True)
+    monkeypatch.setattr(bman.converge, 'execute', fake_execute(executed))
+    monkeypatch.setattr(bman.converge, 'extract_tarball', lambda **kwargs: False)
+    plan = {'host2': [(ACTION_INSTALL,)]}
+    assert not apply_plan(FakeCluster(), plan, {'host2': make_desired()})
+    assert 'mark_installed_tarball' not in executed
+
+
+def test_apply_plan_stops_at_failed_step(monkeypatch):
+    executed = []
+    monkeypatch.setattr(bman.converge, 'execute', fake_execute(executed, failing={'host3'}))
+    plan = {'host2': [(ACTION_FIX_DIR, '/data/1/dn', '700', 'hdfs', 'hadoop'), (ACTION_COPY_CONFIGS,)],
+            'host3': [(ACTION_FIX_DIR, '/data/1/dn', '700', 'hdfs', 'hadoop')]}
+    assert not apply_plan(FakeCluster(), plan, {})
+    assert executed == ['fix_dirs']
+
+
+def test_apply_plan_unreachable_user_host(monkeypatch):
+    monkeypatch.setattr(bman.converge, 'execute', lambda *args, **kwargs: {
+        'host1': {'hdfs': 'unchanged'}, 'host2': Exception('Timed out trying to connect')})
+    plan = {'host1': [(ACTION_ADD_USER, 'hdfs')], 'host2': [(ACTION_ADD_USER, 'hdfs')]}
+    assert not apply_plan(FakeCluster(), plan, {})
@@ -0,0 +1,65 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fabric.api import settings
+
+import bman.constants as constants
+import bman.remote_tasks
+from bman.remote_tasks import start_datanodes_in_waves
+
+
+class FakeCluster(object):
+    def __init__(self, wave_size):
+        self.wave_size = wave_size
+
+    def get_config(self, key):
+        return {constants.KEY_DATANODE_START_WAVE_SIZE: self.wave_size,
+                constants.KEY_DATANODE_START_MAX_RPC_QUEUE_TIME: 50}.get(key)
+
+    def get_hadoop_install_dir(self):
+        return '/opt/hadoop/hadoop-3.1.0'
+
+
+def fake_start(monkeypatch, failing=()):
+    """ Record the waves started, the DataNodes on failing hosts do not start. """
+    waves = []
+
+    def execute(task, hosts=None, **kwargs):
+        waves.append(list(hosts))
+        return {host: host not in failing for host in hosts}
+
+    monkeypatch.setattr(bman.remote_tasks, 'execute', execute)
+    monkeypatch.setattr(bman.remote_tasks, 'wait_for_datanode_registrations', lambda *args: True)
+    return waves
+
+
+def test_start_in_waves(monkeypatch):
+    waves = fake_start(monkeypatch)
+    assert start_datanodes_in_waves(FakeCluster(2), ['dn1', 'dn2', 'dn3'])
+    assert waves == [['dn1', 'dn2'], ['dn3']]
+
+
+def test_failed_start_is_reported(monkeypatch):
+    # Every wave is started, but a failure in any of them is returned.
+    waves = fake_start(monkeypatch, failing={'dn1'})
+    assert not start_datanodes_in_waves(FakeCluster(2), ['dn1', 'dn2', 'dn3'])
+    assert waves == [['dn1', 'dn2'], ['dn3']]
+
+    waves = fake_start(monkeypatch, failing={'dn3'})
+    assert not start_datanodes_in_waves(FakeCluster(0), ['dn1', 'dn2', 'dn3'])
+    assert waves == [['dn1', 'dn2', 'dn3']]
+
+
+def test_unreachable_host_is_reported():
+    # Nothing listens on port 1, so the connection is refused at once.
+    with settings(abort_on_prompts=True, connection_attempts=1):
+        assert not start_datanodes_in_waves(FakeCluster(0), ['127.0.0.1:1'])
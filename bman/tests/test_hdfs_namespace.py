@@ -0,0 +1,115 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import tempfile
+
+import bman.constants as constants
+from bman.hdfs_namespace import get_namespace_commands, get_publish_tez_commands, publish_tez_webhdfs
+
+# Logs every call and reports the xattr in $TEZ_XATTR for -getfattr.
+FAKE_HADOOP = """#!/bin/bash
+echo "$*" >> {log}
+if [ "$2" = -getfattr ]; then
+  echo "# file: ${{@: -1}}"
+  [ -n "$TEZ_XATTR" ] && echo "$TEZ_XATTR"
+fi
+true
+"""
+
+
+class FakeCluster(object):
+    def get_tez_lib_path(self):
+        return '/apps/tez-0.9.1/tez-0.9.1.tar.gz'
+
+    def get_tez_lib_replication(self):
+        return 3
+
+    def get_config(self, key):
+        return {constants.KEY_TEZ_TARBALL: '/local/tez-0.9.1.tar.gz'}.get(key)
+
+
+class FakeWebHdfsClient(object):
+    def __init__(self, md5=None):
+        self.xattrs = {constants.TEZ_LIB_MD5_XATTR: md5} if md5 else {}
+        self.uploads = []
+
+    def get_xattr(self, path, name):
+        return self.xattrs.get(name)
+
+    def set_xattr(self, path, name, value):
+        self.xattrs[name] = value
+
+    def upload(self, local_file, path, replication=None):
+        self.uploads.append((local_file, path, replication))
+
+    def mkdirs(self, path):
+        pass
+
+    def set_permission(self, path, permission):
+        pass
+
+    def set_owner(self, path, owner=None, group=None):
+        pass
+
+
+def test_namespace_commands_are_grouped():
+    paths = [('/tmp', '1777', 'hdfs', None),
+             ('/home', '755', 'hdfs', None),
+             ('/home/yarn', '700', 'yarn', None),
+             ('/home/mapred', '700', 'mapred', None),
+             ('/warehouse', '755', 'hive', 'hadoop')]
+    assert get_namespace_commands(paths, uri='hdfs://ns1') == [
+        'hadoop fs -mkdir -p hdfs://ns1/tmp hdfs://ns1/home hdfs://ns1/home/yarn '
+        'hdfs://ns1/home/mapred hdfs://ns1/warehouse',
+        'hadoop fs -chmod 1777 hdfs://ns1/tmp',
+        'hadoop fs -chmod 755 hdfs://ns1/home hdfs://ns1/warehouse',
+        'hadoop fs -chmod 700 hdfs://ns1/home/yarn hdfs://ns1/home/mapred',
+        'hadoop fs -chown hdfs hdfs://ns1/tmp hdfs://ns1/home',
+        'hadoop fs -chown yarn hdfs://ns1/home/yarn',
+        'hadoop fs -chown mapred hdfs://ns1/home/mapred',
+        'hadoop fs -chown hive:hadoop hdfs://ns1/warehouse']
+
+
+def run_publish_tez_commands(md5, hdfs_md5):
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, 'hadoop.log')
+        with open(os.path.join(tmp, 'hadoop'), 'w') as f:
+            f.write(FAKE_HADOOP.format(log=log))
+        os.chmod(os.path.join(tmp, 'hadoop'), 0o755)
+        env = dict(os.environ, PATH='{}:{}'.format(tmp, os.environ['PATH']),
+                   TEZ_XATTR='{}="{}"'.format(constants.TEZ_LIB_MD5_XATTR, hdfs_md5) if hdfs_md5 else '')
+        for command in get_publish_tez_commands(FakeCluster(), '/tmp/tez-0.9.1.tar.gz', md5, uri='hdfs://ns1'):
+            subprocess.check_call(['bash', '-c', command], env=env, stdout=subprocess.DEVNULL)
+        with open(log) as f:
+            return [line.split()[1] for line in f]
+
+
+def test_publish_tez_commands_skip_same_md5():
+    assert run_publish_tez_commands('0123abcd', '0123abcd') == ['-getfattr']
+
+
+def test_publish_tez_commands_upload_changed_md5():
+    for hdfs_md5 in ('99999999', None):
+        assert run_publish_tez_commands('0123abcd', hdfs_md5) == [
+            '-getfattr', '-mkdir', '-chmod', '-D', '-setfattr', '-chown']
+
+
+def test_publish_tez_webhdfs():
+    client = FakeWebHdfsClient(md5='0123abcd')
+    publish_tez_webhdfs(FakeCluster(), client, '0123abcd')
+    assert client.uploads == []
+
+    publish_tez_webhdfs(FakeCluster(), client, '4567cdef')
+    assert client.uploads == [('/local/tez-0.9.1.tar.gz', '/apps/tez-0.9.1/tez-0.9.1.tar.gz', 3)]
+    assert client.xattrs[constants.TEZ_LIB_MD5_XATTR] == '4567cdef'
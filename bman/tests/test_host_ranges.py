@@ -0,0 +1,35 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from bman.exceptions import ConfigurationError
+from bman.host_ranges import expand_host_range, iter_hosts
+
+
+def test_expand_host_range():
+    assert list(expand_host_range('nn1.example.com')) == ['nn1.example.com']
+    assert list(expand_host_range('dn[08-10].example.com')) == [
+        'dn08.example.com', 'dn09.example.com', 'dn10.example.com']
+    assert list(expand_host_range('dn[1-2].rack[1,3].example.com')) == [
+        'dn1.rack1.example.com', 'dn1.rack3.example.com', 'dn2.rack1.example.com', 'dn2.rack3.example.com']
+    assert len(list(expand_host_range('dn[0001-2000].rack[1-40].example.com'))) == 80000
+    for bad in ['dn[1-].example.com', 'dn[3-1].example.com', 'dn[1-2.example.com']:
+        with pytest.raises(ConfigurationError):
+            list(expand_host_range(bad))
+
+
+def test_iter_hosts_with_include_file(tmpdir):
+    tmpdir.join('workers.txt').write('# Rack 2\ndn[3-4].example.com\n\ndn5.example.com  # spare\n')
+    entries = ['dn[1-2].example.com', {'include': 'workers.txt'}]
+    assert list(iter_hosts(entries, str(tmpdir))) == ['dn{}.example.com'.format(i) for i in range(1, 6)]
+    assert list(iter_hosts('dn[1-2]')) == ['dn1', 'dn2']
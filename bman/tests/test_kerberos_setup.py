@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import getpass
+import io
+import grp
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+import pytest
+
+from bman.kerberos_setup import KadminBatch, get_kadmin_errors, parse_principal_kvnos, get_keytab_factory_script, \
+    KEYTAB_BUNDLE_CIPHER, parse_principal_list, select_stale_keytabs
+
+REALM = 'EXAMPLE.COM'
+
+GET_PRINCIPAL_OUTPUT = """
+kadmin:  get_principal dn/host1@EXAMPLE.COM
+Principal: dn/host1@EXAMPLE.COM
+Number of keys: 2
+Key: vno 3, aes256-cts-hmac-sha1-96
+Key: vno 3, aes128-cts-hmac-sha1-96
+kadmin:  get_principal nn/host1@EXAMPLE.COM
+get_principal: Principal does not exist while retrieving "nn/host1@EXAMPLE.COM".
+"""
+
+
+def test_batch_script():
+    batch = KadminBatch('kadmin -s kdc -p admin -w secret', batch_size=2)
+    batch.add_principal('nn/host1@EXAMPLE.COM')
+    batch.add_principal('dn/host1@EXAMPLE.COM')
+    batch.ktadd('/etc/security/keytabs/nn.service.keytab', 'nn/host1@EXAMPLE.COM')
+    script = batch.get_script()
+    assert script.count('kadmin -s kdc -p admin -w secret <<') == 2
+    assert 'ktadd -k /etc/security/keytabs/nn.service.keytab nn/host1@EXAMPLE.COM' in script
+
+
+def test_parse_kadmin_output():
+    assert parse_principal_kvnos(GET_PRINCIPAL_OUTPUT) == {'dn/host1@EXAMPLE.COM': 3}
+    assert parse_principal_list('kadmin:  list_principals\nkadmin:  K/M@EXAMPLE.COM\nnn/host1@EXAMPLE.COM\n') == {
+        'K/M@EXAMPLE.COM', 'nn/host1@EXAMPLE.COM'}
+    assert get_kadmin_errors(GET_PRINCIPAL_OUTPUT) == [
+        'get_principal: Principal does not exist while retrieving "nn/host1@EXAMPLE.COM".']
+    assert get_kadmin_errors(
+        'add_principal: Principal or policy already exists while creating "nn/host1@EXAMPLE.COM".') == []
+
+
+def test_select_stale_keytabs():
+    def keytab(name, principal):
+        return '/etc/security/keytabs/{}.keytab'.format(name), principal, 'hdfs', 'hadoop', '600'
+
+    host_keytabs = {host: [keytab('dn', 'dn/{}@{}'.format(host, REALM)), keytab('hdfs', 'hdfs@' + REALM)]
+                    for host in ('host1', 'host2', 'host3')}
+    kdc_kvnos = {'dn/host1@EXAMPLE.COM': 2, 'dn/host2@EXAMPLE.COM': 2, 'dn/host3@EXAMPLE.COM': 2,
+                 'hdfs@EXAMPLE.COM': 5}
+    host_kvnos = {host: {k[:2]: kdc_kvnos[k[1]] for k in keytabs} for host, keytabs in host_keytabs.items()}
+    assert select_stale_keytabs(host_keytabs, host_kvnos, kdc_kvnos) == {'host1': [], 'host2': [], 'host3': []}
+
+    # A stale host keytab is exported for that host only.
+    host_kvnos['host2'][('/etc/security/keytabs/dn.keytab', 'dn/host2@EXAMPLE.COM')] = 1
+    assert select_stale_keytabs(host_keytabs, host_kvnos, kdc_kvnos) == {
+        'host1': [], 'host2': [host_keytabs['host2'][0]], 'host3': []}
+
+    # Re-exporting a shared principal for one host invalidates it everywhere.
+    del host_kvnos['host3'][('/etc/security/keytabs/hdfs.keytab', 'hdfs@EXAMPLE.COM')]
+    stale = select_stale_keytabs(host_keytabs, host_kvnos, kdc_kvnos)
+    assert [k[1] for k in stale['host1']] == ['hdfs@EXAMPLE.COM']
+    assert [k[1] for k in stale['host3']] == ['hdfs@EXAMPLE.COM']
+
+
+class FakeKadminUtil(object):
+    """ Writes the principal names to the keytab files instead of keys. """
+
+    def make_batch(self):
+        return KadminBatch('while read query k keytab principal; do echo "$principal" >> "$keytab"; done')
+
+
+@pytest.mark.skipif(not shutil.which('openssl'), reason='openssl is not installed')
+def test_keytab_factory_bundles():
+    owner = getpass.getuser()
+    group = grp.getgrgid(os.getgid()).gr_name
+    spnego = '/etc/security/keytabs/spnego.service.keytab'
+    headless = '/etc/security/keytabs/hdfs.headless.keytab'
+    host_keytabs = {
+        host: [(spnego, 'HTTP/{}@{}'.format(host, REALM), owner, group, '644'),
+               (headless, 'hdfs@{}'.format(REALM), owner, group, '600')]
+        for host in ('host1', 'host2')}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        staging_dir = os.path.join(tmp, 'staging')
+        key_file = os.path.join(tmp, 'key')
+        with open(key_file, 'w') as f:
+            f.write('secret')
+        script = get_keytab_factory_script(FakeKadminUtil(), host_keytabs, staging_dir, key_file)
+        # The shared headless keytab is exported once, and the key is not in the script.
+        assert script.count('ktadd') == 3
+        assert 'secret' not in script
+        subprocess.check_call(['bash', '-c', script])
+
+        with tarfile.open(os.path.join(staging_dir, 'bundles.tar')) as bundles:
+            assert sorted(bundles.getnames()) == ['.', './host1.enc', './host2.enc']
+        bundle = subprocess.check_output(
+            'openssl enc -d {} -pass pass:secret -in {}/bundles/host2.enc'.format(
+                KEYTAB_BUNDLE_CIPHER, staging_dir), shell=True)
+        with tarfile.open(fileobj=io.BytesIO(bundle)) as keytabs:
+            members = {m.name: m for m in keytabs.getmembers()}
+            assert sorted(members) == ['.' + headless, '.' + spnego]
+            assert members['.' + headless].mode == 0o600
+            assert keytabs.extractfile('.' + spnego).read() == 'HTTP/host2@{}\n'.format(REALM).encode()
+            assert keytabs.extractfile('.' + headless).read() == 'hdfs@{}\n'.format(REALM).encode()
+
+
+@pytest.mark.skipif(not (shutil.which('kdb5_util') and shutil.which('kadmin.local') and shutil.which('klist')),
+                    reason='MIT Kerberos server tools are not installed')
+def test_batch_against_local_kdc():
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'krb5.conf'), 'w') as f:
+            f.write('[libdefaults]\n default_realm = {0}\n[realms]\n {0} = {{\n  kdc = localhost\n }}\n'.format(REALM))
+        with open(os.path.join(tmp, 'kdc.conf'), 'w') as f:
+            f.write('[realms]\n {} = {{\n  database_name = {1}/principal\n  key_stash_file = {1}/stash\n'
+                    '  acl_file = {1}/kadm5.acl\n }}\n'.format(REALM, tmp))
+        env = dict(os.environ, KRB5_CONFIG=os.path.join(tmp, 'krb5.conf'),
+                   KRB5_KDC_PROFILE=os.path.join(tmp, 'kdc.conf'))
+        subprocess.check_call(['kdb5_util', '-r', REALM, 'create', '-s', '-P', 'master'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        keytab = os.path.join(tmp, 'dn.service.keytab')
+        batch = KadminBatch('kadmin.local -r {}'.format(REALM), batch_size=3)
+        for host in ('host1', 'host2'):
+            batch.add_principal('dn/{}@{}'.format(host, REALM))
+        # Adding an existing principal again is not an error.
+        batch.add_principal('dn/host1@{}'.format(REALM))
+        batch.ktadd(keytab, 'dn/host1@{}'.format(REALM))
+        batch.get_principal('dn/host1@{}'.format(REALM))
+        batch.list_principals()
+        output = subprocess.run(['bash', '-c', batch.get_script()], env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True).stdout
+
+        assert get_kadmin_errors(output) == []
+        # ktadd randomizes the keys, so the KVNO goes from 1 to 2.
+        assert parse_principal_kvnos(output) == {'dn/host1@{}'.format(REALM): 2}
+        assert {'dn/host1@{}'.format(REALM), 'dn/host2@{}'.format(REALM)} <= parse_principal_list(output)
+        klist = subprocess.check_output(['klist', '-kt', keytab], env=env, universal_newlines=True)
+        assert 'dn/host1@{}'.format(REALM) in klist
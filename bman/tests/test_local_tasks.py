@@ -0,0 +1,111 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import xml.etree.ElementTree as ElementTree
+
+from bman.bman_config import load_config
+from bman.local_tasks import generate_configs, write_custom_settings, get_config_file_header, \
+    get_config_file_footer
+
+CONFIG = """
+Cluster: test
+HomeDir: /opt/hadoop
+HadoopTarball: /tmp/hadoop.tar.gz
+Workers: [worker1, worker2]
+CoreSiteSettings:
+  fs.defaultFS: 'hdfs://nn1:8020'
+YarnSiteSettings:
+  yarn.resourcemanager.address: 'nn1:8032'
+MapredSiteSettings: {}
+HdfsSiteSettings:
+  dfs.namenode.name.dir: /data/name
+"""
+
+
+def get_mtimes(path):
+    return {f: os.stat(os.path.join(path, f)).st_mtime_ns for f in os.listdir(path)}
+
+
+def test_generate_configs_only_rewrites_changed_files(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG)
+
+    cluster = load_config(str(config_file))
+    generate_configs(cluster)
+    conf_dir = cluster.get_generated_hadoop_conf_tmp_dir()
+    assert {'core-site.xml', 'hdfs-site.xml', 'hadoop-env.sh', 'workers'} <= set(os.listdir(conf_dir))
+    mtimes = get_mtimes(conf_dir)
+
+    # Nothing changed, so nothing is rewritten.
+    generate_configs(load_config(str(config_file)))
+    assert get_mtimes(conf_dir) == mtimes
+
+    config_file.write('  dfs.replication: 2\n', mode='a')
+    generate_configs(load_config(str(config_file)))
+    changed = {f for f, mtime in get_mtimes(conf_dir).items() if mtimes.get(f) != mtime}
+    assert changed == {'.bman-fingerprint', 'hdfs-site.xml'}
+    assert '<name>dfs.replication</name>' in open(os.path.join(conf_dir, 'hdfs-site.xml')).read()
+
+
+def test_write_custom_settings():
+    settings = {'b.key': 'a & b', 'a.key': '<value>', 'c.key': 3}
+    out = io.StringIO()
+    out.write(get_config_file_header())
+    write_custom_settings(out, settings, sort_keys=True)
+    out.write(get_config_file_footer())
+
+    root = ElementTree.fromstring(out.getvalue().encode('utf-8'))
+    assert [(p.find('name').text, p.find('value').text) for p in root.findall('property')] == [
+        ('a.key', '<value>'), ('b.key', 'a & b'), ('c.key', '3')]
+
+
+OVERRIDES_CONFIG = CONFIG.replace('[worker1, worker2]', '[worker1, worker2, worker3, worker4, worker5]') + """
+HostGroups:
+  bigdisk:
+    Hosts: [worker1, worker2]
+    HdfsSiteSettings:
+      dfs.datanode.data.dir: /data/1,/data/2
+HostOverrides:
+  worker3:
+    HdfsSiteSettings:
+      dfs.datanode.data.dir: /data/1,/data/2
+  worker4:
+    HdfsSiteSettings:
+      dfs.datanode.du.reserved: 1024
+"""
+
+
+def test_generate_host_config_sets(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(OVERRIDES_CONFIG)
+
+    cluster = load_config(str(config_file))
+    generate_configs(cluster)
+    base_dir = cluster.get_generated_hadoop_conf_tmp_dir()
+    set_dirs = {host: cluster.get_host_hadoop_conf_tmp_dir(host) for host in cluster.get_all_hosts()}
+    # Hosts with the same effective settings share a config set.
+    assert set_dirs['worker1'] == set_dirs['worker2'] == set_dirs['worker3']
+    assert len({set_dirs['worker1'], set_dirs['worker4'], base_dir}) == 3
+    assert set_dirs['worker5'] == set_dirs['nn1'] == base_dir
+
+    hdfs_site = open(os.path.join(set_dirs['worker1'], 'hdfs-site.xml')).read()
+    assert '<value>/data/1,/data/2</value>' in hdfs_site
+    assert '<value>/data/name</value>' in hdfs_site
+    assert open(os.path.join(set_dirs['worker4'], 'core-site.xml')).read() == \
+        open(os.path.join(base_dir, 'core-site.xml')).read()
+
+    # A fresh load finds the sets written by the previous run.
+    assert load_config(str(config_file)).get_host_hadoop_conf_tmp_dir('worker4') == set_dirs['worker4']
@@ -0,0 +1,90 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests for parsing and checking the host facts collected by 'preflight'.
+
+import bman.preflight
+from bman.bman_config import load_config
+from bman.preflight import parse_facts_output, check_host_facts, collect_host_facts, SECTION_MARKER
+
+CONFIG = """
+Cluster: preflight
+HomeDir: /opt/hadoop
+HadoopTarball: /tmp/hadoop.tar.gz
+JavaHome: /usr/java/default
+Workers: [worker1, worker2]
+CoreSiteSettings:
+  fs.defaultFS: 'hdfs://nn1:8020'
+HdfsSiteSettings:
+  dfs.namenode.name.dir: /data/name
+  dfs.datanode.data.dir: /data/dn1,/data/dn2
+"""
+
+
+def make_facts(**kwargs):
+    facts = {'cpus': 8, 'memory_mb': 32000, 'os': 'CentOS Linux 7 (Core)',
+             'java': 'openjdk version "1.8.0_292"', 'clock_skew': 0.2, 'endpoints': {},
+             'free_mb': {'/tmp': 50000, '/opt/hadoop': 50000, '/data/name': 50000,
+                         '/data/dn1': 50000, '/data/dn2': 50000}}
+    facts.update(kwargs)
+    return facts
+
+
+def test_parse_facts_output():
+    output = '\n'.join([
+        SECTION_MARKER + 'cpus', '16',
+        SECTION_MARKER + 'memory', '65842332',
+        SECTION_MARKER + 'os', 'CentOS Linux 7 (Core)',
+        SECTION_MARKER + 'java', 'bash: /usr/java/default/bin/java: No such file or directory',
+        SECTION_MARKER + 'disks', '/tmp 10485760', '/data/dn1 2048',
+        SECTION_MARKER + 'endpoints', 'kdc1:88 up', 'kdc1:749 down',
+        SECTION_MARKER + 'time', '1760000000.250'])
+    facts = parse_facts_output(output)
+    assert facts['cpus'] == 16
+    assert facts['memory_mb'] == 64299
+    assert facts['java'] is None
+    assert facts['free_mb'] == {'/tmp': 10240, '/data/dn1': 2}
+    assert facts['endpoints'] == {'kdc1:88': True, 'kdc1:749': False}
+    assert facts['time'] == 1760000000.25
+
+
+def test_check_host_facts(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG)
+    cluster = load_config(str(config_file))
+    problems = check_host_facts(cluster, {
+        'nn1': make_facts(clock_skew=-95.0),
+        'worker1': make_facts(free_mb={'/data/dn1': 100, '/data/name': 10}),
+        'worker2': None})
+    assert problems == {'nn1': ['clock is -95s off'],
+                        'worker1': ['/data/dn1 has 100 MB free, needs 1024 MB'],
+                        'worker2': ['unreachable']}
+
+
+def test_collect_host_facts_reuses_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    config_file = tmpdir.join('config.yaml')
+    config_file.write(CONFIG)
+    cluster = load_config(str(config_file))
+    swept = []
+
+    def execute(task, hosts, cluster):
+        swept.append(sorted(hosts))
+        return {host: make_facts() if host != 'worker2' else Exception('timed out') for host in hosts}
+
+    monkeypatch.setattr(bman.preflight, 'execute', execute)
+    assert collect_host_facts(cluster)['worker2'] is None
+    # Only the host that could not be reached is asked again.
+    assert collect_host_facts(cluster)['nn1']['cpus'] == 8
+    collect_host_facts(cluster, refresh=True)
+    assert swept == [['nn1', 'worker1', 'worker2'], ['worker2'], ['nn1', 'worker1', 'worker2']]
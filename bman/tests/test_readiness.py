@@ -0,0 +1,93 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests for the readiness probes, run against a fake JMX servlet on localhost.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bman.hdfs_master_configs import HdfsMasterConfigs
+from bman.readiness import namenode_is_up, namenode_is_out_of_safemode, wait_until_ready, \
+    get_live_datanode_hosts, is_same_host
+
+BEANS = {}
+
+
+class FakeJmxHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = self.path.split('qry=')[-1]
+        body = json.dumps({'beans': [BEANS[query]] if query in BEANS else []}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_namenode():
+    # The fake server answers both the 'RPC' connect probe and JMX queries.
+    server = HTTPServer(('localhost', 0), FakeJmxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    nn = HdfsMasterConfigs({
+        'fs.defaultFS': 'hdfs://localhost:{}'.format(port),
+        'dfs.namenode.http-address': '0.0.0.0:{}'.format(port)}).get_nn_configs()[0]
+    return server, nn
+
+
+def test_namenode_address_parsing():
+    nn = HdfsMasterConfigs({'fs.defaultFS': 'hdfs://nn1.example.com:9000'}).get_nn_configs()[0]
+    assert nn.get_rpc_port() == 9000
+    assert nn.get_http_address() == 'nn1.example.com:9870'
+
+
+def test_namenode_is_up():
+    server, nn = start_fake_namenode()
+    try:
+        BEANS.clear()
+        assert not namenode_is_up(nn)
+        BEANS['Hadoop:service=NameNode,name=NameNodeStatus'] = {'State': 'standby'}
+        assert namenode_is_up(nn)
+    finally:
+        server.shutdown()
+
+
+def test_namenode_safemode():
+    server, nn = start_fake_namenode()
+    try:
+        BEANS['Hadoop:service=NameNode,name=NameNodeInfo'] = {'Safemode': 'Safe mode is ON.'}
+        assert not namenode_is_out_of_safemode(nn)
+        BEANS['Hadoop:service=NameNode,name=NameNodeInfo'] = {'Safemode': ''}
+        assert namenode_is_out_of_safemode(nn)
+    finally:
+        server.shutdown()
+
+
+def test_wait_until_ready_deadline():
+    assert wait_until_ready(['a', 'b'], lambda t: t == 'a', 'targets', timeout=1) == ['b']
+    assert wait_until_ready(['a', 'b'], lambda t: True, 'targets', timeout=1) == []
+
+
+def test_live_datanode_hosts():
+    server, nn = start_fake_namenode()
+    try:
+        BEANS['Hadoop:service=NameNode,name=NameNodeInfo'] = {
+            'LiveNodes': json.dumps({'dn1.example.com:9866': {}, 'dn2.example.com:9866': {}})}
+        live = get_live_datanode_hosts(nn)
+        assert live == {'dn1.example.com', 'dn2.example.com'}
+        assert any(is_same_host('dn1', name) for name in live)
+        assert not any(is_same_host('dn3', name) for name in live)
+    finally:
+        server.shutdown()
@@ -0,0 +1,184 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests for the rolling restart order, run against fake JMX servlets on localhost.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import bman.constants as constants
+import bman.rolling_restart
+from bman.hdfs_master_configs import HdfsMasterConfigs
+from bman.readiness import wait_for_datanodes
+from bman.rolling_restart import rolling_restart, rolling_restart_workers
+
+
+def start_fake_jmx(beans):
+    """ Serve the given beans, keyed by bean name, from a JMX servlet on localhost. """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = self.path.split('qry=')[-1]
+            body = json.dumps({'beans': [beans[query]] if query in beans else []}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeCluster(object):
+    def __init__(self, site_settings=None, workers=(), datanode_http_port=None):
+        self.master_config = HdfsMasterConfigs(site_settings or {'fs.defaultFS': 'hdfs://nn1:8020'})
+        self.workers = tuple(workers)
+        self.datanode_http_port = datanode_http_port
+
+    def get_config(self, key):
+        return {constants.KEY_ROLLING_RESTART_WINDOW: 1, constants.KEY_READINESS_TIMEOUT: 1}.get(key)
+
+    def get_hdfs_master_config(self):
+        return self.master_config
+
+    def get_worker_nodes(self):
+        return self.workers
+
+    def get_datanode_http_port(self):
+        return self.datanode_http_port
+
+    def get_hadoop_install_dir(self):
+        return '/opt/hadoop/hadoop-3.1.0'
+
+
+def ha_settings(nn1_http_port=9870, nn2_http_port=9870, jns='jn1:8485;jn2:8485;jn3:8485'):
+    return {'fs.defaultFS': 'hdfs://ns1',
+            'dfs.nameservices': 'ns1',
+            'dfs.ha.namenodes.ns1': 'nn1,nn2',
+            'dfs.namenode.rpc-address.ns1.nn1': '127.0.0.1:8020',
+            'dfs.namenode.rpc-address.ns1.nn2': 'localhost:8020',
+            'dfs.namenode.http-address.ns1.nn1': '0.0.0.0:{}'.format(nn1_http_port),
+            'dfs.namenode.http-address.ns1.nn2': '0.0.0.0:{}'.format(nn2_http_port),
+            'dfs.namenode.shared.edits.dir': 'qjournal://{}/ns1'.format(jns)}
+
+
+def record_restarts(monkeypatch):
+    restarted = []
+    monkeypatch.setattr(bman.rolling_restart, 'restart_window',
+                        lambda cluster, hosts, service_name, user, command='hdfs': restarted.append(list(hosts)))
+    return restarted
+
+
+def test_restart_windows(monkeypatch):
+    restarted = record_restarts(monkeypatch)
+    hosts = ['dn1', 'dn2', 'dn3', 'dn4', 'dn5']
+    assert rolling_restart_workers(FakeCluster(), tuple(hosts), 2, 'datanode', 'hdfs', lambda c, h: True)
+    assert restarted == [['dn1', 'dn2'], ['dn3', 'dn4'], ['dn5']]
+
+    # A window that does not come back stops the restart.
+    del restarted[:]
+    assert not rolling_restart_workers(FakeCluster(), hosts, 2, 'datanode', 'hdfs', lambda c, h: 'dn3' not in h)
+    assert restarted == [['dn1', 'dn2'], ['dn3', 'dn4']]
+
+
+def test_restart_datanodes_waits_for_registration(monkeypatch):
+    restarted = record_restarts(monkeypatch)
+    beans = {'Hadoop:service=DataNode,name=DataNodeInfo': {'BPServiceActorInfo': json.dumps([
+        {'NamenodeAddress': 'nn1:8020', 'ActorState': 'RUNNING'},
+        {'NamenodeAddress': 'nn2:8020', 'ActorState': 'RUNNING'}])}}
+    server = start_fake_jmx(beans)
+    try:
+        cluster = FakeCluster(workers=['localhost', '127.0.0.1'], datanode_http_port=server.server_address[1])
+        assert wait_for_datanodes(cluster, ['localhost'])
+        assert rolling_restart(cluster, 'datanodes', window=1)
+        assert restarted == [['localhost'], ['127.0.0.1']]
+
+        beans['Hadoop:service=DataNode,name=DataNodeInfo']['BPServiceActorInfo'] = json.dumps([
+            {'NamenodeAddress': 'nn1:8020', 'ActorState': 'CONNECTING'}])
+        assert not wait_for_datanodes(cluster, ['localhost'])
+    finally:
+        server.shutdown()
+
+
+def test_journalnode_window_keeps_quorum(monkeypatch):
+    restarted = record_restarts(monkeypatch)
+    monkeypatch.setattr(bman.rolling_restart, 'wait_for_journalnodes', lambda cluster, hosts: True)
+    cluster = FakeCluster(site_settings=ha_settings(jns='jn1:8485;jn2:8485;jn3:8485;jn4:8485;jn5:8485'))
+    assert rolling_restart(cluster, 'journalnodes', window=4)
+    assert restarted == [['jn1', 'jn2'], ['jn3', 'jn4'], ['jn5']]
+
+
+STATUS_BEAN = 'Hadoop:service=NameNode,name=NameNodeStatus'
+
+
+def restart_namenodes(monkeypatch, failover):
+    """
+    Rolling restart an HA nameservice where nn2 is active. failover(nn1, nn2)
+    is called with the status beans of both NameNodes for the failover
+    command and returns its result.
+    :return: (result, restarted windows, failover commands)
+    """
+    restarted = record_restarts(monkeypatch)
+    commands = []
+    nn1_beans, nn2_beans = {STATUS_BEAN: {'State': 'standby'}}, {STATUS_BEAN: {'State': 'active'}}
+
+    def run_dfs_command(cluster, cmd):
+        commands.append(cmd)
+        return failover(nn1_beans[STATUS_BEAN], nn2_beans[STATUS_BEAN])
+
+    monkeypatch.setattr(bman.rolling_restart, 'wait_for_namenodes', lambda cluster, nns: True)
+    monkeypatch.setattr(bman.rolling_restart, 'run_dfs_command', run_dfs_command)
+    nn1, nn2 = start_fake_jmx(nn1_beans), start_fake_jmx(nn2_beans)
+    try:
+        cluster = FakeCluster(site_settings=ha_settings(nn1.server_address[1], nn2.server_address[1]))
+        return rolling_restart(cluster, 'namenodes'), restarted, commands
+    finally:
+        nn1.shutdown()
+        nn2.shutdown()
+
+
+def test_namenodes_restart_standby_first(monkeypatch):
+    def failover(nn1, nn2):
+        nn1['State'], nn2['State'] = 'active', 'standby'
+        return True
+
+    # nn1 sorts first, so it would be picked as active if the state was not read.
+    result, restarted, commands = restart_namenodes(monkeypatch, failover)
+    assert result
+    assert restarted == [['127.0.0.1'], ['localhost']]
+    assert commands == ['/opt/hadoop/hadoop-3.1.0/bin/hdfs haadmin -ns ns1 -failover nn2 nn1']
+
+
+def test_namenodes_failed_failover_keeps_the_active(monkeypatch):
+    # The failover command fails.
+    result, restarted, commands = restart_namenodes(monkeypatch, lambda nn1, nn2: False)
+    assert not result
+    assert restarted == [['127.0.0.1']]
+
+    # The failover command succeeds, but the standby never becomes active.
+    result, restarted, commands = restart_namenodes(monkeypatch, lambda nn1, nn2: True)
+    assert not result
+    assert restarted == [['127.0.0.1']]
+
+
+def test_namenodes_without_active_are_not_restarted(monkeypatch):
+    def failover(nn1, nn2):
+        raise AssertionError('no failover without an active NameNode')
+
+    monkeypatch.setattr(bman.rolling_restart, 'get_namenode_state', lambda nn: 'standby')
+    result, restarted, commands = restart_namenodes(monkeypatch, failover)
+    assert not result
+    assert restarted == []
@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the generated stop script with the local bash against a temporary pid dir.
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from fabric.api import settings
+
+import bman.constants as constants
+import bman.remote_tasks
+from bman.remote_tasks import get_stop_daemons_script, stop_all_daemons
+
+UNREACHABLE_HOST = '127.0.0.1:1'
+IGNORE_TERM = 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print(1, flush=True); time.sleep(60)'
+
+
+class FakeCluster(object):
+    def __init__(self, pid_dir):
+        self.pid_dir = pid_dir
+
+    def get_hadoop_pid_dir(self):
+        return self.pid_dir
+
+    def get_all_hosts(self):
+        return ['host1', 'host2']
+
+    def get_config(self, key):
+        return {constants.KEY_DAEMON_STOP_TIMEOUT: 1}.get(key)
+
+
+def write_pid_file(pid_dir, name, pid):
+    path = os.path.join(pid_dir, name)
+    with open(path, 'w') as f:
+        f.write('{}\n'.format(pid))
+    return path
+
+
+def test_stop_daemons_script(monkeypatch):
+    pid_dir = tempfile.mkdtemp()
+    # Only look at the temporary pid dir, never at real pid files under /tmp.
+    monkeypatch.setattr(bman.remote_tasks, 'get_pid_file_patterns', lambda cluster: [pid_dir + '/*.pid'])
+    graceful = subprocess.Popen(['sleep', '60'])
+    stubborn = subprocess.Popen([sys.executable, '-c', IGNORE_TERM], stdout=subprocess.PIPE)
+    stubborn.stdout.readline()
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    # Reap the daemons as soon as they exit, or kill -0 would still find the zombies.
+    reapers = [threading.Thread(target=p.wait) for p in (graceful, stubborn)]
+    for reaper in reapers:
+        reaper.start()
+    try:
+        datanode = write_pid_file(pid_dir, 'hadoop-hdfs-datanode.pid', graceful.pid)
+        nodemanager = write_pid_file(pid_dir, 'hadoop-yarn-nodemanager.pid', stubborn.pid)
+        write_pid_file(pid_dir, 'hadoop-hdfs-namenode.pid', exited.pid)
+
+        output = subprocess.check_output(
+            ['bash', '-c', get_stop_daemons_script(FakeCluster(pid_dir), 1)]).decode('utf-8')
+        outcomes = {fields[1]: fields[0] for fields in (line.split() for line in output.splitlines())}
+        # The stale pid file is removed without a report.
+        assert outcomes == {datanode: 'stopped', nodemanager: 'killed'}
+        assert os.listdir(pid_dir) == []
+        for reaper in reapers:
+            reaper.join(timeout=5)
+        assert (graceful.returncode, stubborn.returncode) == (-15, -9)
+    finally:
+        for process in (graceful, stubborn):
+            if process.returncode is None:
+                process.kill()
+        for reaper in reapers:
+            reaper.join()
+        subprocess.check_call(['rm', '-rf', pid_dir])
+
+
+def test_stop_all_daemons_unreachable_host():
+    # Nothing listens on port 1, so the connection is refused at once. The
+    # host must be reported as a failure instead of aborting the command.
+    with settings(abort_on_prompts=True, connection_attempts=1):
+        assert not stop_all_daemons(FakeCluster('/var/run'), targets=[UNREACHABLE_HOST])
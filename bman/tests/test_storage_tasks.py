@@ -0,0 +1,102 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the generated per-disk script with the local bash.
+
+import os
+import subprocess
+import tempfile
+import time
+
+from bman.storage_tasks import get_per_disk_script, get_fast_wipe_script, get_trash_status_script, \
+    parse_trash_status, TRASH_DIR_NAME
+
+# Reports base as the mount point of every path, and base/disk2 as a mount
+# point of its own, so that the trash never lands outside base.
+FAKE_DF = """#!/bin/bash
+path="${{@: -1}}"
+echo "Mounted on"
+case "$path" in
+  {base}/disk2*) echo {base}/disk2 ;;
+  *) echo {base} ;;
+esac
+"""
+
+
+def test_per_disk_script():
+    base = tempfile.mkdtemp()
+    dirs = [os.path.join(base, 'dn1'), os.path.join(base, 'disk2', 'dn')]
+    output = subprocess.check_output(
+        ['bash', '-c', get_per_disk_script(dirs, 'install -d -m 0700 "$d"')]).decode('utf-8')
+    lines = [line.split() for line in output.splitlines()]
+
+    assert all(os.path.isdir(d) for d in dirs)
+    assert sorted(fields[2] for fields in lines if fields[0] == 'done') == sorted(dirs)
+    # Both directories are on the same device, so there is one summary line.
+    assert [fields[2] for fields in lines if fields[0] == 'disk'] == ['2']
+    subprocess.check_call(['rm', '-rf', base])
+
+
+def run_with_fake_df(base, script):
+    bin_dir = os.path.join(base, 'bin')
+    os.mkdir(bin_dir)
+    with open(os.path.join(bin_dir, 'df'), 'w') as f:
+        f.write(FAKE_DF.format(base=base))
+    os.chmod(os.path.join(bin_dir, 'df'), 0o755)
+    env = dict(os.environ, PATH='{}:{}'.format(bin_dir, os.environ['PATH']))
+    return subprocess.check_output(['bash', '-c', script], env=env).decode('utf-8')
+
+
+def test_fast_wipe_script():
+    base = tempfile.mkdtemp()
+    # dn1 is renamed into the trash. disk2 is a mount point, so its contents are moved instead.
+    dirs = [os.path.join(base, 'dn1'), os.path.join(base, 'disk2')]
+    for d in dirs:
+        os.makedirs(os.path.join(d, 'current'))
+    os.chmod(dirs[0], 0o700)
+    output = run_with_fake_df(base, get_fast_wipe_script(dirs + [os.path.join(base, 'missing')], 'ts'))
+
+    trash = [os.path.join(base, TRASH_DIR_NAME, 'ts'), os.path.join(base, 'disk2', TRASH_DIR_NAME, 'ts')]
+    assert sorted(output.splitlines()) == sorted('trash ' + t for t in trash)
+    assert os.listdir(dirs[0]) == []
+    assert os.stat(dirs[0]).st_mode & 0o777 == 0o700
+    assert os.listdir(dirs[1]) == [TRASH_DIR_NAME]
+    # The background deleters empty the trash.
+    deadline = time.time() + 10
+    while any(os.path.exists(t) for t in trash) and time.time() < deadline:
+        time.sleep(0.1)
+    assert not any(os.path.exists(t) for t in trash)
+    subprocess.check_call(['rm', '-rf', base])
+
+
+def test_fast_wipe_script_reports_failures():
+    base = tempfile.mkdtemp()
+    d = os.path.join(base, 'dn1')
+    os.makedirs(d)
+    # The trash cannot be created where a file is in the way.
+    open(os.path.join(base, TRASH_DIR_NAME), 'w').close()
+    output = run_with_fake_df(base, get_fast_wipe_script([d], 'ts'))
+    assert output.splitlines() == ['failed ' + d]
+    assert os.path.isdir(d)
+    subprocess.check_call(['rm', '-rf', base])
+
+
+def test_trash_status():
+    base = tempfile.mkdtemp()
+    os.makedirs(os.path.join(base, TRASH_DIR_NAME, 'ts1'))
+    os.makedirs(os.path.join(base, TRASH_DIR_NAME, 'ts2'))
+    output = run_with_fake_df(base, get_trash_status_script(
+        [os.path.join(base, 'dn1'), os.path.join(base, 'disk2', 'dn')]))
+    status = parse_trash_status(output)
+    assert status['trash'] == [(os.path.join(base, TRASH_DIR_NAME), 2)]
+    assert status['deleters'] == 0
+    subprocess.check_call(['rm', '-rf', base])
@@ -0,0 +1,93 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import tempfile
+
+from fabric.api import settings
+
+from bman.bman_config import UserConfig, load_users_csv
+from bman.remote_tasks import get_sync_users_script, add_users
+
+# Stubs for the account tools. $STATE/users/<name> holds the primary group
+# of each user and every call that changes something is logged to $STATE/log.
+FAKE_TOOLS = {
+    'id': 'f="$STATE/users/${@: -1}"; [ -f "$f" ] || exit 1; [ "$1" = -gn ] && cat "$f"; true',
+    'getent': '[ -f "$STATE/groups/$2" ]',
+    'groupadd': 'echo "groupadd $1" >> $STATE/log; touch "$STATE/groups/$1"',
+    'useradd': 'echo "useradd $1" >> $STATE/log; [ "$1" != broken ] && echo "$4" > "$STATE/users/$1"',
+    'usermod': 'echo "usermod $3" >> $STATE/log; echo "$2" > "$STATE/users/$3"',
+    'userdel': 'echo "userdel ${@: -1}" >> $STATE/log; rm "$STATE/users/${@: -1}"',
+    'chpasswd': 'while read line; do echo "chpasswd ${line%%:*}" >> $STATE/log; done',
+}
+
+
+def test_load_users_csv():
+    with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+        f.write('# name,password,group\nalice,secret1,analysts\n\nbob, secret2 ,analysts\n')
+        f.flush()
+        users = load_users_csv(f.name)
+    assert [(u.name, u.password, u.group) for u in users] == [
+        ('alice', 'secret1', 'analysts'), ('bob', 'secret2', 'analysts')]
+
+
+def run_sync_users_script(users, existing, recreate=False):
+    """ :return: the script output and the logged changes. """
+    with tempfile.TemporaryDirectory() as state:
+        bin_dir = os.path.join(state, 'bin')
+        for d in (bin_dir, os.path.join(state, 'users'), os.path.join(state, 'groups')):
+            os.mkdir(d)
+        for name, body in FAKE_TOOLS.items():
+            with open(os.path.join(bin_dir, name), 'w') as f:
+                f.write('#!/bin/bash\n' + body + '\n')
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+        for name, group in existing.items():
+            with open(os.path.join(state, 'users', name), 'w') as f:
+                f.write(group + '\n')
+            open(os.path.join(state, 'groups', group), 'w').close()
+        env = dict(os.environ, STATE=state, PATH='{}:{}'.format(bin_dir, os.environ['PATH']))
+        output = subprocess.check_output(['bash', '-c', get_sync_users_script(users, recreate)], env=env)
+        log_file = os.path.join(state, 'log')
+        log = open(log_file).read().splitlines() if os.path.exists(log_file) else []
+        return output.decode('utf-8').splitlines(), log
+
+
+def test_sync_users_script():
+    users = [UserConfig('hdfs', 'pw1', 'hadoop'), UserConfig('yarn', None, 'hadoop'),
+             UserConfig('mapred', 'pw3', 'hadoop'), UserConfig('broken', None, 'analysts')]
+    output, log = run_sync_users_script(users, {'hdfs': 'hadoop', 'yarn': 'yarn'})
+    assert output == ['unchanged hdfs', 'updated yarn', 'added mapred', 'failed broken']
+    assert log == ['groupadd analysts', 'usermod yarn', 'useradd mapred', 'useradd broken',
+                   'chpasswd hdfs', 'chpasswd mapred']
+
+
+def test_sync_users_script_recreate():
+    users = [UserConfig('hdfs', 'pw1', 'hadoop'), UserConfig('yarn', 'pw2', 'hadoop')]
+    output, log = run_sync_users_script(users, {'hdfs': 'hadoop'}, recreate=True)
+    assert output == ['added hdfs', 'added yarn']
+    assert log == ['userdel hdfs', 'useradd hdfs', 'useradd yarn', 'chpasswd hdfs', 'chpasswd yarn']
+
+
+class FakeCluster(object):
+    def get_all_hosts(self):
+        # Nothing listens on port 1, so the connection is refused at once.
+        return ['127.0.0.1:1']
+
+    def is_kerberized(self):
+        return False
+
+
+def test_add_users_unreachable_host():
+    # The host must be reported as a failure instead of aborting the command.
+    with settings(abort_on_prompts=True, connection_attempts=1):
+        assert not add_users(FakeCluster(), [UserConfig('alice', None, 'analysts')])
@@ -0,0 +1,54 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import bman.constants as constants
+from bman.utils import run_in_processes, HdfsTicketSession
+
+
+class FakeMasterConfig(object):
+    def get_nn_hosts(self):
+        return ['nn1']
+
+
+class FakeCluster(object):
+    def get_hdfs_master_config(self):
+        return FakeMasterConfig()
+
+    def get_realm(self):
+        return 'EXAMPLE.COM'
+
+
+def fail():
+    raise RuntimeError('boom')
+
+
+def test_run_in_processes():
+    parent = os.getpid()
+    results = run_in_processes({'ns1': lambda: os.getpid() != parent,
+                                'ns2': lambda: False,
+                                'ns3': fail})
+    assert results == {'ns1': True, 'ns2': False, 'ns3': False}
+
+
+def test_hdfs_ticket_session_logs_in_once():
+    session = HdfsTicketSession(FakeCluster())
+    first = session.get_command('hdfs dfs -ls /')
+    second = session.get_command('hdfs dfs -ls /tmp')
+    assert first.startswith('export KRB5CCNAME={}; (kinit -kt '.format(session.ccache))
+    assert first.endswith('hdfs@EXAMPLE.COM -l 3600s) && hdfs dfs -ls /')
+    assert second.startswith('export KRB5CCNAME={}; (klist -s || kinit -kt '.format(session.ccache))
+
+    # Log in again when the ticket is close to expiry.
+    session.login_time.value -= constants.HDFS_TICKET_LIFETIME_SECONDS
+    assert '(kinit -kt ' in session.get_command('hdfs dfs -ls /')
@@ -0,0 +1,141 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests for the WebHDFS client, run against a fake in-memory WebHDFS server.
+
+import json
+import os
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bman.webhdfs import WebHdfsClient
+
+FILES = {}
+LOCK = threading.Lock()
+
+
+class FakeWebHdfsHandler(BaseHTTPRequestHandler):
+    def reply(self, code, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_op(self):
+        url = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(url.path[len('/webhdfs/v1'):])
+        params = dict(urllib.parse.parse_qsl(url.query))
+        op = params['op']
+        with LOCK:
+            if op == 'MKDIRS':
+                FILES.setdefault(path, {'type': 'DIRECTORY', 'permission': '755'})
+                return self.reply(200, {'boolean': True})
+            if op == 'SETPERMISSION':
+                FILES[path]['permission'] = params['permission']
+                return self.reply(200)
+            if op == 'SETOWNER':
+                FILES[path]['owner'] = params.get('owner')
+                return self.reply(200)
+            if op == 'GETFILESTATUS':
+                if path not in FILES:
+                    return self.reply(404, {'RemoteException': {'exception': 'FileNotFoundException'}})
+                return self.reply(200, {'FileStatus': {k: v for k, v in FILES[path].items() if k != 'data'}})
+            if op == 'CREATE' and 'datanode' not in params:
+                location = 'http://{}:{}{}&datanode=true'.format(
+                    self.server.server_address[0], self.server.server_address[1], self.path)
+                return self.reply(307, headers={'Location': location})
+            if op == 'GETXATTRS':
+                xattrs = FILES.get(path, {}).get('xattrs', {})
+                return self.reply(200, {'XAttrs': [{'name': k, 'value': v} for k, v in xattrs.items()]})
+            if op == 'SETXATTR':
+                FILES[path].setdefault('xattrs', {})[params['xattr.name']] = params['xattr.value']
+                return self.reply(200)
+            if op == 'CONCAT':
+                for source in params['sources'].split(','):
+                    FILES[path]['data'] += FILES.pop(source)['data']
+                return self.reply(200)
+            if op == 'RENAME':
+                FILES[params['destination']] = FILES.pop(path)
+                return self.reply(200, {'boolean': True})
+            if op == 'DELETE':
+                return self.reply(200, {'boolean': FILES.pop(path, None) is not None})
+        if op == 'CREATE':
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            with LOCK:
+                FILES[path] = {'type': 'FILE', 'data': data}
+            return self.reply(201)
+        self.reply(400)
+
+    do_GET = do_PUT = do_POST = do_DELETE = handle_op
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_webhdfs():
+    server = ThreadingHTTPServer(('localhost', 0), FakeWebHdfsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, WebHdfsClient(['localhost:{}'.format(server.server_address[1])])
+
+
+def test_namespace_operations():
+    server, client = start_fake_webhdfs()
+    try:
+        FILES.clear()
+        assert client.get_file_status('/tmp') is None
+        assert client.mkdirs('/tmp')
+        client.set_permission('/tmp', '1777')
+        client.set_owner('/tmp', owner='hdfs')
+        assert client.get_file_status('/tmp') == {'type': 'DIRECTORY', 'permission': '1777', 'owner': 'hdfs'}
+    finally:
+        server.shutdown()
+
+
+def test_parallel_chunked_upload():
+    server, client = start_fake_webhdfs()
+    data = os.urandom(10000)
+    try:
+        FILES.clear()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            client.upload(f.name, '/apps/tez.tar.gz', block_size=1024, parallelism=4)
+            # Uploading again replaces the file.
+            client.upload(f.name, '/apps/tez.tar.gz', block_size=1024, parallelism=4)
+        assert list(FILES) == ['/apps/tez.tar.gz']
+        assert FILES['/apps/tez.tar.gz']['data'] == data
+
+        assert client.get_xattr('/apps/tez.tar.gz', 'user.bman.md5') is None
+        client.set_xattr('/apps/tez.tar.gz', 'user.bman.md5', '0123abcd')
+        assert client.get_xattr('/apps/tez.tar.gz', 'user.bman.md5') == '0123abcd'
+    finally:
+        server.shutdown()
+
+
+def test_failover_from_parallel_threads():
+    server, _ = start_fake_webhdfs()
+    # Nothing listens on the first address, so every upload thread fails over.
+    client = WebHdfsClient(['localhost:1', 'localhost:{}'.format(server.server_address[1])])
+    try:
+        FILES.clear()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(8192))
+            f.flush()
+            client.upload(f.name, '/apps/tez.tar.gz', block_size=1024, parallelism=8)
+        assert client.http_addresses == ['localhost:{}'.format(server.server_address[1]), 'localhost:1']
+    finally:
+        server.shutdown()
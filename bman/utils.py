@@ -13,11 +13,16 @@
 # limitations under the License.
 
 import glob
+import multiprocessing
 import os
+import queue
+import uuid
 
 import time
+from contextlib import contextmanager
 
-from fabric.context_managers import hide
+import fabric.state
+from fabric.context_managers import hide, settings
 
 from bman.kerberos_config_manager import KEYTABS_DEFAULT_DIR
 from fabric.tasks import execute
@@ -48,11 +53,12 @@ def copy(source_file=None, remote_file=None):
 
 
 def copy_hadoop_config_files(cluster):
-    """ Copy the config to the right location."""
-    for config_file in glob.glob(os.path.join(cluster.get_generated_hadoop_conf_tmp_dir(), "*")):
+    """ Copy the config for this host, i.e. its config set if it has one, to the right location."""
+    for config_file in glob.glob(os.path.join(cluster.get_host_hadoop_conf_tmp_dir(env.host), "*")):
         filename = os.path.basename(config_file)
         full_file_name = os.path.join(cluster.get_hadoop_conf_dir(), filename)
         put(config_file, full_file_name, use_sudo=True)
+    return True
 
 
 def copy_tez_config_files(cluster):
@@ -71,14 +77,22 @@ def do_untar(tarball=None, target_folder=None, strip_level=0):
 
 
 @task
-def start_stop_service(cluster, action, service_name, user=None):
-    """ Starts or stops a service """
+def start_stop_service(cluster, action, service_name, user=None, command='hdfs'):
+    """ Starts or stops a service. Use command='yarn' for YARN services. """
     install_dir = cluster.get_hadoop_install_dir()
-    cmd = 'nohup {}/bin/hdfs --daemon {} {}'.format(install_dir, action, service_name)
+    cmd = 'nohup {}/bin/{} --daemon {} {}'.format(install_dir, command, action, service_name)
     get_logger().info('{} {} on {}'.format(action, service_name, env.host_string))
     return sudo(cmd, user=user).succeeded
 
 
+def get_pid_file_patterns(cluster):
+    """
+    Return shell glob patterns that match Hadoop daemon pid files on a host.
+    Older deployments kept pid files under /tmp.
+    """
+    return ['{}/*.pid'.format(cluster.get_hadoop_pid_dir()), '/tmp/hadoop-*.pid']
+
+
 def get_md5(source_file, local_file):
     """Returns MD5 of a file based on it is local or remote."""
     cmd = get_command(source_file, local_file)
@@ -151,7 +165,7 @@ def run_cmd(cmd_string=None, user=None):
 
 
 @task
-def fast_copy(cluster, remote_file=None):
+def fast_copy(cluster, remote_file=None, targets=None):
     """
     scp a file from one cluster node to the rest.
 
@@ -164,8 +178,10 @@ def fast_copy(cluster, remote_file=None):
     phase).
 
     The caller must later change permissions on the file on all hosts.
+
+    :param targets: the hosts to copy to. Defaults to all cluster hosts.
     """
-    targets = set(cluster.get_all_hosts()).symmetric_difference({env.host})
+    targets = set(targets or cluster.get_all_hosts()).difference({env.host})
     for i, host_name in enumerate(targets):
         scp_cmd = 'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null {} {}:{}'.format(
             remote_file, host_name, remote_file)
@@ -179,11 +195,12 @@ def fast_copy(cluster, remote_file=None):
         # env.sudo_password = saved_password   # Restore the global fabric environment.
 
 
-def put_to_all_nodes(cluster=None, source_file=None, remote_file=None):
+def put_to_all_nodes(cluster=None, source_file=None, remote_file=None, targets=None):
     """
-    Copy a file to all cluster nodes.
+    Copy a file to all cluster nodes, or only to the given targets.
     """
-    source_node = sorted(list(cluster.get_all_hosts()))[0]
+    targets = targets or cluster.get_all_hosts()
+    source_node = min(targets)
     get_logger().info("Copying the tarball {} to {}.".format(
         source_file, source_node))
     with hide('status', 'warnings', 'running', 'stdout', 'stderr',
@@ -193,25 +210,139 @@ def put_to_all_nodes(cluster=None, source_file=None, remote_file=None):
             get_logger().error('copy failed.')
             return False
 
-    if not execute(fast_copy, hosts=source_node, cluster=cluster, remote_file=remote_file):
+    if not execute(fast_copy, hosts=source_node, cluster=cluster, remote_file=remote_file,
+                   targets=targets):
         get_logger().error('fast copy failed.')
         return False
+    return True
+
+
+def get_kinit_command(cluster):
+    """ Command to login as the hdfs superuser with its headless keytab. """
+    hdfs_headless_principal = '{}@{}'.format(constants.HDFS_USER, cluster.get_realm())
+    hdfs_headless_keytab = os.path.join(
+        KEYTABS_DEFAULT_DIR, '{}.headless.keytab'.format(constants.HDFS_USER))
+    return 'kinit -kt {} {}'.format(hdfs_headless_keytab, hdfs_headless_principal)
+
+
+class HdfsTicketSession(object):
+    """
+    A Kerberos login as the hdfs superuser on the first NameNode host,
+    kept in a dedicated credentials cache and shared by every
+    run_dfs_command call during one bman operation.
+
+    The login happens on first use. The session logs in again when the
+    requested ticket lifetime is close to expiry, or when the ticket is
+    found to be missing or expired on the host. close() destroys the
+    credentials cache.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.host = cluster.get_hdfs_master_config().get_nn_hosts()[0]
+        self.ccache = 'FILE:/tmp/krb5cc_bman_{}_{}'.format(constants.HDFS_USER, uuid.uuid4().hex)
+        # Time of the last login. Shared memory so that logins from processes
+        # forked by run_in_processes are seen by the parent.
+        self.login_time = multiprocessing.get_context('fork').Value('d', 0.0)
+
+    def needs_login(self):
+        expiry = self.login_time.value + constants.HDFS_TICKET_LIFETIME_SECONDS
+        return time.time() > expiry - constants.HDFS_TICKET_RENEW_MARGIN_SECONDS
+
+    def get_command(self, cmd):
+        """ Wrap cmd so that it runs with the session's credentials. """
+        kinit = '{} -l {}s'.format(get_kinit_command(self.cluster), constants.HDFS_TICKET_LIFETIME_SECONDS)
+        if self.needs_login():
+            get_logger().debug("Logging in as {} on {}".format(constants.HDFS_USER, self.host))
+            self.login_time.value = time.time()
+            login = kinit
+        else:
+            login = 'klist -s || {}'.format(kinit)
+        return 'export KRB5CCNAME={}; ({}) && {}'.format(self.ccache, login, cmd)
+
+    def close(self):
+        if not self.login_time.value:
+            return
+        with hide('everything'), settings(warn_only=True):
+            execute(run_cmd, hosts=[self.host], user=constants.HDFS_USER,
+                    cmd_string='KRB5CCNAME={} kdestroy'.format(self.ccache))
+        self.login_time.value = 0.0
+
+
+_hdfs_ticket_session = None
+
+
+@contextmanager
+def hdfs_ticket_session(cluster):
+    """
+    Share one HdfsTicketSession between the run_dfs_command calls made in
+    this block. Nested blocks reuse the outer session. Does nothing if the
+    cluster is not kerberized.
+    """
+    global _hdfs_ticket_session
+    if not cluster.is_kerberized() or _hdfs_ticket_session is not None:
+        yield _hdfs_ticket_session
+        return
+    _hdfs_ticket_session = HdfsTicketSession(cluster)
+    try:
+        yield _hdfs_ticket_session
+    finally:
+        session, _hdfs_ticket_session = _hdfs_ticket_session, None
+        session.close()
 
 
 def run_dfs_command(cluster=None, cmd=None):
-    if cluster.is_kerberized():
-        # Prepend a command to login as the hdfs superuser, and append a command
-        # to destroy the credentials when done.
-        hdfs_headless_principal = '{}@{}'.format(constants.HDFS_USER, cluster.get_realm())
-        hdfs_headless_keytab = os.path.join(
-            KEYTABS_DEFAULT_DIR, '{}.headless.keytab'.format(constants.HDFS_USER))
-        cmd = 'kinit -kt {} {}'.format(hdfs_headless_keytab, hdfs_headless_principal) + \
-              ' && ' + cmd + ' && ' + 'kdestroy'
-
-    # Run the command on a NameNode host and as the 'hdfs' user.
-    get_logger().debug("Running command '{}'".format(cmd))
-    execute(run_cmd, hosts=cluster.get_hdfs_master_config().get_nn_hosts()[0:1],
-            cmd_string=cmd, user=constants.HDFS_USER)
+    with hdfs_ticket_session(cluster) as session:
+        if session:
+            cmd = session.get_command(cmd)
+
+        # Run the command on a NameNode host and as the 'hdfs' user.
+        get_logger().debug("Running command '{}'".format(cmd))
+        results = execute(run_cmd, hosts=cluster.get_hdfs_master_config().get_nn_hosts()[0:1],
+                          cmd_string=cmd, user=constants.HDFS_USER)
+    return all(results.values())
+
+
+def run_in_processes(tasks):
+    """
+    Run each callable in its own forked process, the way Fabric runs
+    @parallel tasks, so that each one can call execute() with its own SSH
+    connections.
+
+    :param tasks: dict mapping a name to a callable that returns True on success.
+    :return: dict mapping each name to the callable's result. A callable that
+             raised or whose process died counts as failed.
+    """
+    if len(tasks) == 1:
+        name, fn = next(iter(tasks.items()))
+        return {name: bool(fn())}
+
+    context = multiprocessing.get_context('fork')
+    results_queue = context.Queue()
+
+    def run(name, fn):
+        # Don't reuse the parent's SSH connections from the child process.
+        fabric.state.connections.clear()
+        try:
+            result = bool(fn())
+        except Exception as e:
+            get_logger().exception(e)
+            result = False
+        results_queue.put((name, result))
+
+    processes = [context.Process(target=run, args=(name, fn)) for name, fn in tasks.items()]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    results = {name: False for name in tasks}
+    for _ in processes:
+        try:
+            name, result = results_queue.get(timeout=5)
+        except queue.Empty:
+            break
+        results[name] = result
+    return results
 
 
 def is_true(input_string):
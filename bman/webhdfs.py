@@ -0,0 +1,236 @@
+# Copyright 2016-2018 Hortonworks Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A minimal WebHDFS client for namespace operations from the bman host.
+
+Requests go straight to the NameNode HTTP address, so there is no SSH hop
+and no JVM startup per operation. When the cluster is kerberized the
+client authenticates with SPNEGO using the credentials in the local ticket
+cache. This needs the optional 'gssapi' package.
+"""
+
+import base64
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import bman.constants as constants
+from bman.exceptions import WebHdfsError
+from bman.logger import get_logger
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+DEFAULT_BLOCK_SIZE = 128 * 1024 * 1024
+DEFAULT_UPLOAD_PARALLELISM = 4
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """ WebHDFS write redirects must be followed manually to send the data. """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class FileRange(object):
+    """ A read-only view of part of an open file, so that uploads are streamed. """
+
+    def __init__(self, f, offset, length):
+        f.seek(offset)
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class WebHdfsClient(object):
+    """
+    Client for one nameservice. Requests are sent to the first NameNode
+    that answers; a standby NameNode is skipped and the active one is
+    remembered for later requests. A client may be shared by threads.
+    """
+
+    def __init__(self, http_addresses, user=constants.HDFS_USER, kerberos=False, timeout=60):
+        self.http_addresses = list(http_addresses)
+        # Guards the order of http_addresses, which changes on failover.
+        self.addresses_lock = threading.Lock()
+        self.user = user
+        self.kerberos = kerberos
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(NoRedirect)
+
+    def get_auth_headers(self, host):
+        if not self.kerberos:
+            return {}
+        try:
+            import gssapi
+        except ImportError:
+            raise WebHdfsError("WebHDFS on a kerberized cluster requires the 'gssapi' package.")
+        name = gssapi.Name('HTTP@{}'.format(host), gssapi.NameType.hostbased_service)
+        token = gssapi.SecurityContext(name=name, usage='initiate').step()
+        return {'Authorization': 'Negotiate {}'.format(base64.b64encode(token).decode('ascii'))}
+
+    def open(self, method, url, data=None, length=None):
+        host = urllib.parse.urlparse(url).hostname
+        request = urllib.request.Request(url, data=data, method=method,
+                                         headers=self.get_auth_headers(host))
+        if data is not None:
+            request.add_header('Content-Type', 'application/octet-stream')
+        if length is not None:
+            request.add_header('Content-Length', str(length))
+        return self.opener.open(request, timeout=self.timeout)
+
+    def request(self, method, path, op, **params):
+        """
+        Send one WebHDFS request and return the decoded JSON response, or
+        the redirect location for operations that write data.
+        """
+        params['op'] = op
+        if not self.kerberos:
+            params['user.name'] = self.user
+        query = urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+        errors = []
+        with self.addresses_lock:
+            addresses = list(self.http_addresses)
+        for address in addresses:
+            url = 'http://{}{}{}?{}'.format(address, WEBHDFS_PREFIX, urllib.parse.quote(path), query)
+            try:
+                with self.open(method, url) as response:
+                    body = response.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 307:
+                    return e.headers['Location']
+                message = e.read().decode('utf-8', 'replace')
+                if 'StandbyException' in message:
+                    errors.append('{} is standby'.format(address))
+                    continue
+                raise WebHdfsError('{} {} failed: {} {}'.format(method, url, e.code, message))
+            except OSError as e:
+                errors.append('{}: {}'.format(address, e))
+                continue
+            # Remember the NameNode that answered.
+            with self.addresses_lock:
+                if self.http_addresses[0] != address:
+                    self.http_addresses = [address] + [a for a in self.http_addresses if a != address]
+            return json.loads(body.decode('utf-8')) if body else {}
+        raise WebHdfsError('No NameNode could serve {} {}: {}'.format(op, path, '; '.join(errors)))
+
+    def get_file_status(self, path):
+        """ :return: the FileStatus dict, or None if the path does not exist. """
+        try:
+            return self.request('GET', path, 'GETFILESTATUS')['FileStatus']
+        except WebHdfsError as e:
+            if 'FileNotFoundException' in str(e):
+                return None
+            raise
+
+    def mkdirs(self, path, permission=None):
+        return self.request('PUT', path, 'MKDIRS', permission=permission)['boolean']
+
+    def set_permission(self, path, permission):
+        self.request('PUT', path, 'SETPERMISSION', permission=permission)
+
+    def set_owner(self, path, owner=None, group=None):
+        self.request('PUT', path, 'SETOWNER', owner=owner, group=group)
+
+    def rename(self, path, destination):
+        return self.request('PUT', path, 'RENAME', destination=destination)['boolean']
+
+    def delete(self, path, recursive=False):
+        return self.request('DELETE', path, 'DELETE', recursive=str(recursive).lower())['boolean']
+
+    def get_xattr(self, path, name):
+        """ :return: the text value of an extended attribute, or None if it is not set. """
+        try:
+            xattrs = self.request('GET', path, 'GETXATTRS', encoding='text')['XAttrs']
+        except WebHdfsError as e:
+            if 'FileNotFoundException' in str(e):
+                return None
+            raise
+        for xattr in xattrs:
+            if xattr['name'] == name:
+                return xattr['value'].strip('"')
+        return None
+
+    def set_xattr(self, path, name, value):
+        self.request('PUT', path, 'SETXATTR', flag='CREATE,REPLACE',
+                     **{'xattr.name': name, 'xattr.value': '"{}"'.format(value)})
+
+    def concat(self, path, sources):
+        self.request('POST', path, 'CONCAT', sources=','.join(sources))
+
+    def create(self, path, data, overwrite=False, replication=None, permission=None,
+               block_size=None, length=None):
+        """
+        Create a file, following the DataNode redirect. data is either bytes
+        or a file-like object of the given length.
+        """
+        location = self.request('PUT', path, 'CREATE', overwrite=str(overwrite).lower(),
+                                replication=replication, permission=permission,
+                                blocksize=block_size)
+        try:
+            with self.open('PUT', location, data, length) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            raise WebHdfsError('Writing {} failed: {} {}'.format(
+                path, e.code, e.read().decode('utf-8', 'replace')))
+
+    def upload(self, local_file, path, replication=None, permission=None,
+               block_size=DEFAULT_BLOCK_SIZE, parallelism=DEFAULT_UPLOAD_PARALLELISM):
+        """
+        Upload a local file, replacing any existing file at path.
+
+        Large files are split into whole-block chunks that are written in
+        parallel as separate files, then joined with CONCAT and renamed into
+        place.
+        """
+        size = os.path.getsize(local_file)
+        chunk_size = block_size * max(1, -(-size // (block_size * parallelism)))
+        offsets = list(range(0, size, chunk_size)) or [0]
+        parts = ['{}._COPYING_.{}'.format(path, i) for i in range(len(offsets))]
+        get_logger().debug("Uploading {} to {} in {} parts".format(local_file, path, len(parts)))
+
+        def write_part(i):
+            length = min(chunk_size, size - offsets[i])
+            with open(local_file, 'rb') as f:
+                self.create(parts[i], FileRange(f, offsets[i], length), overwrite=True,
+                            replication=replication, permission=permission,
+                            block_size=block_size, length=length)
+
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            list(pool.map(write_part, range(len(parts))))
+        if len(parts) > 1:
+            self.concat(parts[0], parts[1:])
+        if self.get_file_status(path) is not None:
+            self.delete(path)
+        if not self.rename(parts[0], path):
+            raise WebHdfsError('Failed to rename {} to {}'.format(parts[0], path))
+
+
+def get_webhdfs_client(cluster, ns, user=constants.HDFS_USER):
+    """ Return a WebHdfsClient for the given nameservice. """
+    return WebHdfsClient([nn.get_http_address() for nn in sorted(ns.get_nn_configs())],
+                         user=user, kerberos=cluster.is_kerberized())
+
+
+if __name__ == '__main__':
+    pass
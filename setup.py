@@ -41,4 +41,8 @@ setup(name='bman',
           "pygments>=2.1.3",
           "pytest>=3.0.5",
           "pyyaml>=3.12"
-      ])
+      ],
+      extras_require={
+          # SPNEGO authentication for WebHDFS on kerberized clusters.
+          'kerberos': ["gssapi>=1.4.1"]
+      })